@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""Benchmark of the per-exchange overhead of building and parsing messages.
+
+Runs complete client <-> server exchanges in which no Hi() computation is
+needed (the server has the ``"SCRAM-<hash>-Keys"`` credentials and the
+client a `credentials.ClientProfile` with the keys already derived), so only
+the message handling, nonce generation and signature HMACs are measured.
+For every hash and channel binding setting it reports:
+
+  - ``us``: the time per exchange (microseconds),
+  - ``peak``: the peak memory (in bytes, traced by `tracemalloc`) allocated
+    above the baseline during a single exchange,
+  - ``blocks``: the number of memory blocks allocated during a single
+    exchange and not freed before its end (the authenticators themselves
+    and the state they keep).
+
+CPython has no public counter of all the allocations, so ``peak`` is the
+measure of the temporary objects created while building the messages.
+
+Usage::
+
+    python benchmarks/bench_alloc.py [--exchanges 20000] [--hashes SHA-1]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import gc
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                        ".."))
+
+# pylint: disable=C0413
+from pyxmpp2_scram.credentials import ClientProfile
+from pyxmpp2_scram.scram import HASH_FACTORIES, SCRAMOperations, \
+        SCRAMClientAuthenticator, SCRAMServerAuthenticator
+
+SALT = b"0123456789abcdef"
+ITERATION_COUNT = 4096
+CB_DATA = {"tls-unique": b"\x01" * 12}
+
+class PasswordDatabase(object):
+    """Single-user password database with precomputed keys."""
+    # pylint: disable=R0903
+    def __init__(self, hash_name):
+        operations = SCRAMOperations(hash_name)
+        salted_password = operations.Hi(operations.Normalize("pencil"), SALT,
+                                                            ITERATION_COUNT)
+        self.keys = (SALT, ITERATION_COUNT,
+                        operations.H(operations.HMAC(salted_password,
+                                                            b"Client Key")),
+                        operations.HMAC(salted_password, b"Server Key"))
+        self.pformat = "SCRAM-{0}-Keys".format(hash_name)
+
+    def get_password(self, username, formats, properties):
+        """Return the keys."""
+        # pylint: disable=W0613
+        return self.keys, self.pformat
+
+def exchange(hash_name, channel_binding, database, profile):
+    """Run a single exchange."""
+    properties = {"SCRAM-client-profile": profile}
+    server_properties = {}
+    if channel_binding:
+        properties["channel-binding"] = CB_DATA
+        server_properties["channel-binding"] = CB_DATA
+    client = SCRAMClientAuthenticator(hash_name, channel_binding)
+    server = SCRAMServerAuthenticator(hash_name, channel_binding, database)
+    response = client.start(properties)
+    challenge = server.start(server_properties, response)
+    response = client.challenge(challenge)
+    challenge = server.response(response)[1]
+    client.finish(challenge)
+    return client, server
+
+def measure(hash_name, channel_binding, count):
+    """Measure the exchanges for a hash and channel binding setting.
+
+    :returntype: `dict`
+    """
+    database = PasswordDatabase(hash_name)
+    profile = ClientProfile("user", "pencil")
+    exchange(hash_name, channel_binding, database, profile)
+    start = time.perf_counter()
+    for _ in range(count):
+        exchange(hash_name, channel_binding, database, profile)
+    elapsed = (time.perf_counter() - start) / count
+    gc.collect()
+    gc.disable()
+    tracemalloc.start()
+    try:
+        peaks = []
+        blocks = []
+        for _ in range(100):
+            before = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            result = exchange(hash_name, channel_binding, database, profile)
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+            after = tracemalloc.take_snapshot()
+            blocks.append(sum(stat.count_diff for stat
+                                    in after.compare_to(before, "filename")
+                                    if stat.count_diff > 0))
+            del result, before, after
+    finally:
+        tracemalloc.stop()
+        gc.enable()
+    return {"us": elapsed * 1e6, "peak": min(peaks), "blocks": min(blocks)}
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+    parser.add_argument("--exchanges", type = int, default = 20000,
+                        help = "number of timed exchanges")
+    parser.add_argument("--hashes", default = ",".join(sorted(HASH_FACTORIES)),
+                        help = "comma-separated hash names")
+    args = parser.parse_args()
+    print("{0:20} {1:>10} {2:>10} {3:>8}".format("mechanism", "us",
+                                                        "peak", "blocks"))
+    for hash_name in args.hashes.split(","):
+        for channel_binding in (False, True):
+            result = measure(hash_name, channel_binding, args.exchanges)
+            name = "SCRAM-" + hash_name + ("-PLUS" if channel_binding else "")
+            print("{0:20} {1[us]:10.1f} {1[peak]:10d} {1[blocks]:8d}".format(
+                                                                name, result))
+
+if __name__ == "__main__":
+    main()
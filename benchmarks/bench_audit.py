@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""Benchmark of the per-login cost of the audit and debug logging.
+
+Runs complete client <-> server exchanges with no Hi() computation (the
+server has the ``"SCRAM-<hash>-Keys"`` credentials and the client
+a `credentials.ClientProfile` with the keys already derived), so the
+logging overhead is not hidden by the key derivation, in these settings:
+
+  - ``none``: no audit log,
+  - ``gated``: an `audit.AuditLog` with its level above the events,
+  - ``sampled``: an `audit.AuditLog` recording 1% of the exchanges,
+  - ``all``: an `audit.AuditLog` recording every exchange,
+  - ``debug``: no audit log, the ``pyxmpp2_scram`` logger enabled for
+    ``DEBUG`` (with a `logging.NullHandler`), so the redacted messages are
+    formatted.
+
+The sink of the audit log discards the events, so the time spent in the
+drain thread is included, but not any I/O. The fastest of ``--rounds``
+runs is reported for every setting.
+
+Usage::
+
+    python benchmarks/bench_audit.py [--exchanges 20000] [--hash SHA-1]
+            [--rounds 5]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import time
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                        ".."))
+
+# pylint: disable=C0413
+from pyxmpp2_scram.audit import AuditLog, AuditSink
+from pyxmpp2_scram.credentials import ClientProfile
+from pyxmpp2_scram.scram import SCRAMOperations, SCRAMClientAuthenticator, \
+        SCRAMServerAuthenticator
+
+SALT = b"0123456789abcdef"
+ITERATION_COUNT = 4096
+
+class PasswordDatabase(object):
+    """Single-user password database with precomputed keys."""
+    # pylint: disable=R0903
+    def __init__(self, hash_name):
+        operations = SCRAMOperations(hash_name)
+        salted_password = operations.Hi(operations.Normalize("pencil"), SALT,
+                                                            ITERATION_COUNT)
+        self.keys = (SALT, ITERATION_COUNT,
+                        operations.H(operations.HMAC(salted_password,
+                                                            b"Client Key")),
+                        operations.HMAC(salted_password, b"Server Key"))
+        self.pformat = "SCRAM-{0}-Keys".format(hash_name)
+
+    def get_password(self, username, formats, properties):
+        """Return the keys."""
+        # pylint: disable=W0613
+        return self.keys, self.pformat
+
+class NullAuditSink(AuditSink):
+    """Discards the events."""
+    def __init__(self):
+        self.count = 0
+
+    def emit(self, events):
+        self.count += len(events)
+
+def measure(hash_name, count, audit):
+    """Measure the exchanges with an audit log (or `None`).
+
+    :return: time per exchange (in seconds)
+    :returntype: `float`
+    """
+    database = PasswordDatabase(hash_name)
+    profile = ClientProfile("user", "pencil")
+    server_properties = {}
+    if audit is not None:
+        server_properties["SCRAM-audit-log"] = audit
+    start = time.perf_counter()
+    for _ in range(count):
+        client = SCRAMClientAuthenticator(hash_name, False)
+        server = SCRAMServerAuthenticator(hash_name, False, database)
+        response = client.start({"SCRAM-client-profile": profile})
+        challenge = server.start(server_properties, response)
+        response = client.challenge(challenge)
+        challenge = server.response(response)[1]
+        client.finish(challenge)
+    return (time.perf_counter() - start) / count
+
+def measure_debug(hash_name, count):
+    """Measure the exchanges with the debug logging enabled.
+
+    :return: time per exchange (in seconds)
+    :returntype: `float`
+    """
+    scram_logger = logging.getLogger("pyxmpp2_scram")
+    handler = logging.NullHandler()
+    scram_logger.addHandler(handler)
+    scram_logger.setLevel(logging.DEBUG)
+    try:
+        return measure(hash_name, count, None)
+    finally:
+        scram_logger.removeHandler(handler)
+        scram_logger.setLevel(logging.NOTSET)
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+    parser.add_argument("--exchanges", type = int, default = 20000,
+                        help = "number of timed exchanges per setting")
+    parser.add_argument("--hash", default = "SHA-1",
+                        help = "hash name")
+    parser.add_argument("--rounds", type = int, default = 5,
+                        help = "number of runs per setting (the fastest is"
+                                                            " reported)")
+    args = parser.parse_args()
+    settings = [
+        ("none", None),
+        ("gated", lambda sink: AuditLog([sink], level = logging.ERROR)),
+        ("sampled", lambda sink: AuditLog([sink],
+                                            success_sample_rate = 0.01)),
+        ("all", lambda sink: AuditLog([sink])),
+        ("debug", None),
+        ]
+    measure(args.hash, 100, None)
+    print("{0:10} {1:>10} {2:>10} {3:>10}".format("setting", "us",
+                                                    "overhead", "events"))
+    baseline = None
+    results = []
+    for name, factory in settings:
+        best = None
+        for _ in range(args.rounds):
+            sink = NullAuditSink()
+            audit = factory(sink) if factory is not None else None
+            if name == "debug":
+                elapsed = measure_debug(args.hash, args.exchanges)
+            else:
+                elapsed = measure(args.hash, args.exchanges, audit)
+            if audit is not None:
+                audit.close()
+            if best is None or elapsed < best:
+                best = elapsed
+        results.append((name, best, sink.count))
+    for name, elapsed, events in results:
+        if baseline is None:
+            baseline = elapsed
+        print("{0:10} {1:10.1f} {2:10.1f} {3:10d}".format(name,
+                        elapsed * 1e6, (elapsed - baseline) * 1e6, events))
+
+if __name__ == "__main__":
+    main()
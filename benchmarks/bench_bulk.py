@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Benchmark of bulk SCRAM key derivation.
+
+Derives the keys for a number of passwords with a `SCRAMOperations.Hi`
+call per password and with `bulk.BulkDeriver` (thread and process pools)
+and reports the passwords per second of each.
+
+Usage::
+
+    python benchmarks/bench_bulk.py [--count 2000] [--hash SHA-1]
+            [--iterations 4096] [--batch-size 64]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import time
+import argparse
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                        ".."))
+
+# pylint: disable=C0413
+from pyxmpp2_scram import kdf
+from pyxmpp2_scram.bulk import BulkDeriver
+from pyxmpp2_scram.scram import SCRAMOperations, derive_keys
+
+def sequential(hash_name, jobs):
+    """Derive the keys one password at a time."""
+    operations = SCRAMOperations(hash_name)
+    for password, salt, iteration_count in jobs:
+        client_key = derive_keys(operations, operations.Hi(
+                    operations.Normalize(password), salt, iteration_count))[0]
+        operations.H(client_key)
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+    parser.add_argument("--count", type = int, default = 2000,
+                        help = "number of passwords")
+    parser.add_argument("--hash", default = "SHA-1", help = "hash name")
+    parser.add_argument("--iterations", type = int, default = 4096,
+                        help = "iteration count")
+    parser.add_argument("--batch-size", type = int, default = 64,
+                        help = "passwords per worker call")
+    args = parser.parse_args()
+    jobs = [("password{0}".format(i), os.urandom(16), args.iterations)
+                                                    for i in range(args.count)]
+    workers = kdf.cpu_count()
+    runs = [("sequential", lambda: sequential(args.hash, jobs))]
+    for label, executor_class in (("threads", ThreadPoolExecutor),
+                                    ("processes", ProcessPoolExecutor)):
+        def run(executor_class = executor_class):
+            """Derive the keys with a `BulkDeriver`."""
+            with executor_class(workers) as executor:
+                deriver = BulkDeriver(executor,
+                                        batch_size = args.batch_size)
+                for _ in deriver.derive_hash(args.hash, jobs):
+                    pass
+        runs.append(("bulk ({0}, {1} workers)".format(label, workers), run))
+    for label, run in runs:
+        start = time.time()
+        run()
+        elapsed = time.time() - start
+        print("{0:32} {1:10.0f} passwords/s".format(label,
+                                                    args.count / elapsed))
+
+if __name__ == "__main__":
+    main()
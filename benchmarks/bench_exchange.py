@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+"""Benchmark of complete in-memory SCRAM exchanges.
+
+Runs `SCRAMClientAuthenticator` <-> `SCRAMServerAuthenticator` exchanges for
+every combination of the selected hashes, iteration counts, server password
+formats (``plain``, ``SaltedPassword``, ``Keys``) and channel binding
+setting, with one or more concurrent workers (threads or processes).
+
+For every combination it reports the throughput, the mean, median and 99th
+percentile latency of the exchange phases:
+
+  - ``parse`` -- message parsing and building (everything but the phases
+    below),
+  - ``kdf`` -- Hi() computations on both sides,
+  - ``proof`` -- the client proof computation,
+  - ``verify`` -- the proof and server signature verification,
+
+and the peak memory traced while running a few exchanges. Results are
+printed as a single JSON document, so runs of different versions can be
+compared, or as a table with ``--table``.
+
+Usage::
+
+    python benchmarks/bench_exchange.py [--hashes SHA-1,SHA-256]
+            [--iterations 4096,600000] [--formats plain,Keys]
+            [--channel-binding on,off] [--workers 1,4] [--mode thread]
+            [--exchanges 20] [--table]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                        ".."))
+
+from pyxmpp2_scram import kdf                          # pylint: disable=C0413
+from pyxmpp2_scram.scram import HASH_FACTORIES, SCRAMOperations, \
+        SCRAMClientAuthenticator, SCRAMServerAuthenticator
+
+USERNAME = "user"
+PASSWORD = "pencil"
+SALT = b"0123456789abcdef"
+CB_DATA = {"tls-unique": b"\x01" * 12}
+FORMATS = ("plain", "SaltedPassword", "Keys")
+
+class TimingKDFBackend(kdf.KDFBackend):
+    """KDF backend measuring the time spent in another backend."""
+    def __init__(self, backend):
+        kdf.KDFBackend.__init__(self)
+        self.backend = backend
+        self.name = backend.name
+        self.elapsed = 0.0
+
+    def derive(self, digest_name, password, salt, iterations):
+        start = time.perf_counter()
+        try:
+            return self.backend.derive(digest_name, password, salt,
+                                                                iterations)
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+class PasswordDatabase(object):
+    """Single-user password database returning the benchmarked format."""
+    # pylint: disable=R0903
+    def __init__(self, hash_name, pformat, iteration_count):
+        self.pformat = pformat
+        if pformat == "plain":
+            self.password = PASSWORD
+            return
+        operations = SCRAMOperations(hash_name)
+        salted_password = operations.Hi(operations.Normalize(PASSWORD), SALT,
+                                                            iteration_count)
+        if pformat == "SaltedPassword":
+            self.password = (SALT, iteration_count, salted_password)
+        else:
+            self.password = (SALT, iteration_count,
+                        operations.H(operations.HMAC(salted_password,
+                                                            b"Client Key")),
+                        operations.HMAC(salted_password, b"Server Key"))
+        self.pformat = "SCRAM-{0}-{1}".format(hash_name, pformat)
+
+    def get_password(self, username, formats, properties):
+        """Return the password in the configured format."""
+        # pylint: disable=W0613
+        if username == USERNAME and self.pformat in formats:
+            return self.password, self.pformat
+        return None, None
+
+def exchange(hash_name, channel_binding, database, iteration_count):
+    """Run a single exchange.
+
+    :return: phase timings in seconds
+    """
+    backend = kdf.get_default_backend()
+    client_kdf = TimingKDFBackend(backend)
+    server_kdf = TimingKDFBackend(backend)
+    client = SCRAMClientAuthenticator(hash_name, channel_binding, client_kdf)
+    server = SCRAMServerAuthenticator(hash_name, channel_binding, database,
+                                                                server_kdf)
+    properties = {"username": USERNAME, "password": PASSWORD}
+    server_properties = {"SCRAM-salt": SALT,
+                                "SCRAM-iteration-count": iteration_count}
+    if channel_binding:
+        properties["channel-binding"] = CB_DATA
+        server_properties["channel-binding"] = CB_DATA
+
+    times = [time.perf_counter()]
+    client_first = client.start(properties)
+    times.append(time.perf_counter())
+    server_first = server.start(server_properties, client_first)
+    times.append(time.perf_counter())
+    client_final = client.challenge(server_first)
+    times.append(time.perf_counter())
+    _, server_final = server.response(client_final)
+    times.append(time.perf_counter())
+    client.finish(server_final)
+    times.append(time.perf_counter())
+
+    durations = [end - start for start, end in zip(times, times[1:])]
+    kdf_time = client_kdf.elapsed + server_kdf.elapsed
+    return {
+        "parse": durations[0] + durations[1] - server_kdf.elapsed,
+        "kdf": kdf_time,
+        "proof": durations[2] - client_kdf.elapsed,
+        "verify": durations[3] + durations[4],
+        "total": sum(durations),
+        }
+
+def run_worker(args):
+    """Run exchanges in a worker; `args` is a tuple so it can be sent to
+    a process pool.
+
+    :return: start time, end time (wall clock, excluding setup) and the
+        phase timings of every exchange
+    """
+    hash_name, channel_binding, pformat, iteration_count, backend, count = args
+    kdf.set_default_backend(backend)
+    database = PasswordDatabase(hash_name, pformat, iteration_count)
+    start = time.time()
+    timings = [exchange(hash_name, channel_binding, database, iteration_count)
+                                                    for _ in range(count)]
+    return start, time.time(), timings
+
+def peak_memory(hash_name, channel_binding, pformat, iteration_count):
+    """Peak traced memory (in bytes) while running a few exchanges."""
+    database = PasswordDatabase(hash_name, pformat, iteration_count)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    for _ in range(3):
+        exchange(hash_name, channel_binding, database, iteration_count)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak - base
+
+def summarize(samples):
+    """Compute mean, median and 99th percentile of samples."""
+    samples = sorted(samples)
+    count = len(samples)
+    return {
+        "mean": sum(samples) / count,
+        "p50": samples[(count - 1) * 50 // 100],
+        "p99": samples[(count - 1) * 99 // 100],
+        }
+
+def run_case(hash_name, iteration_count, pformat, channel_binding, workers,
+                                                        mode, exchanges):
+    """Benchmark one combination of parameters."""
+    # pylint: disable=R0913
+    args = (hash_name, channel_binding, pformat, iteration_count,
+                            kdf.get_default_backend().name, exchanges)
+    if workers == 1:
+        results = [run_worker(args)]
+    else:
+        if mode == "process":
+            executor = ProcessPoolExecutor(workers)
+        else:
+            executor = ThreadPoolExecutor(workers)
+        with executor:
+            # warm the pool up
+            list(executor.map(run_worker, [args[:-1] + (1,)] * workers))
+            results = list(executor.map(run_worker, [args] * workers))
+    wall = max(result[1] for result in results) \
+                                    - min(result[0] for result in results)
+    timings = [timing for result in results for timing in result[2]]
+    return {
+        "hash": hash_name,
+        "iteration_count": iteration_count,
+        "format": pformat,
+        "channel_binding": channel_binding,
+        "workers": workers,
+        "mode": mode,
+        "exchanges": len(timings),
+        "throughput": len(timings) / wall,
+        "phases": dict((phase, summarize([timing[phase]
+                                                for timing in timings]))
+                    for phase in ("parse", "kdf", "proof", "verify", "total")),
+        "peak_memory": peak_memory(hash_name, channel_binding, pformat,
+                                                            iteration_count),
+        }
+
+def parse_list(value, convert = str):
+    """Parse a comma-separated list argument."""
+    return [convert(item) for item in value.split(",") if item]
+
+def print_table(results):
+    """Print the results in human-readable form."""
+    print("{0:8} {1:>7} {2:15} {3:>3} {4:>3} {5:>9} {6:>9} {7:>9} {8:>9}"
+            " {9:>9} {10:>9} {11:>9}".format("hash", "iter", "format", "cb",
+                "w", "login/s", "parse", "kdf", "proof", "verify", "p99",
+                "peak KiB"))
+    for result in results:
+        phases = result["phases"]
+        print("{0:8} {1:7} {2:15} {3:>3} {4:3} {5:9.1f} {6:9.3f} {7:9.3f}"
+                " {8:9.3f} {9:9.3f} {10:9.3f} {11:9.1f}".format(
+                    result["hash"], result["iteration_count"],
+                    result["format"],
+                    "on" if result["channel_binding"] else "off",
+                    result["workers"], result["throughput"],
+                    phases["parse"]["mean"] * 1000,
+                    phases["kdf"]["mean"] * 1000,
+                    phases["proof"]["mean"] * 1000,
+                    phases["verify"]["mean"] * 1000,
+                    phases["total"]["p99"] * 1000,
+                    result["peak_memory"] / 1024))
+    print("(phase times: mean in milliseconds; p99: total exchange time)")
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+    parser.add_argument("--hashes", type = parse_list,
+                        default = sorted(HASH_FACTORIES),
+                        help = "comma-separated hash names")
+    parser.add_argument("--iterations", type = lambda x: parse_list(x, int),
+                        default = [4096, 100000, 600000],
+                        help = "comma-separated iteration counts")
+    parser.add_argument("--formats", type = parse_list,
+                        default = list(FORMATS),
+                        help = "comma-separated server password formats")
+    parser.add_argument("--channel-binding", type = parse_list,
+                        default = ["off", "on"],
+                        help = "channel binding settings: on, off or both")
+    parser.add_argument("--workers", type = lambda x: parse_list(x, int),
+                        default = [1], help = "comma-separated worker counts")
+    parser.add_argument("--mode", choices = ("thread", "process"),
+                        default = "thread", help = "kind of workers")
+    parser.add_argument("--exchanges", type = int, default = 10,
+                        help = "exchanges per worker")
+    parser.add_argument("--backend", default = None,
+                        help = "KDF backend (default: {0})".format(
+                                            kdf.get_default_backend().name))
+    parser.add_argument("--table", action = "store_true",
+                        help = "print a table instead of JSON")
+    args = parser.parse_args()
+    for pformat in args.formats:
+        if pformat not in FORMATS:
+            parser.error("Unknown format: {0!r}".format(pformat))
+    if args.backend:
+        kdf.set_default_backend(args.backend)
+
+    results = []
+    for hash_name in args.hashes:
+        for iteration_count in args.iterations:
+            for pformat in args.formats:
+                for channel_binding in args.channel_binding:
+                    for workers in args.workers:
+                        results.append(run_case(hash_name, iteration_count,
+                                pformat, channel_binding == "on", workers,
+                                args.mode, args.exchanges))
+                        if not args.table:
+                            print(".", end = "", file = sys.stderr)
+                            sys.stderr.flush()
+    if args.table:
+        print_table(results)
+        return
+    print(file = sys.stderr)
+    json.dump({
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpu_count": kdf.cpu_count(),
+        "kdf_backend": kdf.get_default_backend().name,
+        "timestamp": time.time(),
+        "results": results,
+        }, sys.stdout, indent = 2, sort_keys = True)
+    print()
+
+if __name__ == "__main__":
+    main()
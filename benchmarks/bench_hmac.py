@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Microbenchmark of HMAC computation with a reused key.
+
+For every hash in `HASH_FACTORIES` it compares, per HMAC computation:
+
+  - ``new``: a fresh `hmac.new` object (what Hi() did in every iteration),
+  - ``hmac_copy``: copying a keyed `hmac.HMAC` prototype,
+  - ``precomputed``: copying the precomputed inner/outer hash states of
+    `core.PrecomputedHMAC` (what Hi() does now),
+
+and the cost of deriving ClientKey and ServerKey from SaltedPassword with two
+`SCRAMOperations.HMAC` calls versus one `SCRAMOperations.keyed_HMAC`.
+
+Usage::
+
+    python benchmarks/bench_hmac.py [--json]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import hmac
+import json
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                        ".."))
+
+from pyxmpp2_scram.core import PrecomputedHMAC        # pylint: disable=C0413
+from pyxmpp2_scram.scram import HASH_FACTORIES, SCRAMOperations
+
+def per_call(func, number = 20000):
+    """Best time of a single call, in microseconds."""
+    return min(timeit.repeat(func, number = number, repeat = 5)) \
+                                                        / number * 1e6
+
+def bench_hash(hash_name):
+    """Run the benchmarks for one hash."""
+    operations = SCRAMOperations(hash_name)
+    hash_factory = operations.hash_factory
+    key = os.urandom(operations.digest_size)
+    message = os.urandom(operations.digest_size)
+
+    prototype = hmac.new(key, None, hash_factory)
+    precomputed = PrecomputedHMAC(key, hash_factory)
+
+    def new():
+        """HMAC with a new object."""
+        return hmac.new(key, message, hash_factory).digest()
+    def hmac_copy():
+        """HMAC with a copied hmac object."""
+        mac = prototype.copy()
+        mac.update(message)
+        return mac.digest()
+    def precomputed_copy():
+        """HMAC with copied inner and outer hash states."""
+        return precomputed(message)
+    assert new() == hmac_copy() == precomputed_copy()
+
+    def keys_hmac():
+        """ClientKey and ServerKey with two HMAC calls."""
+        return (operations.HMAC(key, b"Client Key"),
+                                    operations.HMAC(key, b"Server Key"))
+    def keys_keyed():
+        """ClientKey and ServerKey with a keyed HMAC."""
+        salted_password_hmac = operations.keyed_HMAC(key)
+        return (salted_password_hmac(b"Client Key"),
+                                    salted_password_hmac(b"Server Key"))
+    assert keys_hmac() == keys_keyed()
+
+    return {
+        "hash": hash_name,
+        "new_us": per_call(new),
+        "hmac_copy_us": per_call(hmac_copy),
+        "precomputed_us": per_call(precomputed_copy),
+        "keys_hmac_us": per_call(keys_hmac),
+        "keys_keyed_us": per_call(keys_keyed),
+        }
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+    parser.add_argument("--json", action = "store_true",
+                                        help = "print results as JSON")
+    args = parser.parse_args()
+    results = [bench_hash(hash_name) for hash_name in sorted(HASH_FACTORIES)]
+    if args.json:
+        json.dump(results, sys.stdout, indent = 2)
+        print()
+        return
+    print("{0:8} {1:>10} {2:>10} {3:>12} {4:>10} {5:>10}".format("hash",
+                "new", "hmac copy", "precomputed", "keys HMAC", "keys keyed"))
+    for result in results:
+        print("{hash:8} {new_us:10.3f} {hmac_copy_us:10.3f}"
+                " {precomputed_us:12.3f} {keys_hmac_us:10.3f}"
+                " {keys_keyed_us:10.3f}".format(**result))
+    print("(times in microseconds per call)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""Benchmark of the memory used by pending server-side SCRAM exchanges.
+
+Starts many `SCRAMServerAuthenticator` exchanges, each stopped after the
+server first message (as for connections which never send the client final
+message) and reports the memory (traced by `tracemalloc`) retained per
+exchange. The client messages and the password database are created before
+the measurement and the properties dictionary is shared, so only the
+authenticators and the state they keep are counted.
+
+Usage::
+
+    python benchmarks/bench_memory.py [--count 100000] [--hash SHA-1]
+            [--channel-binding]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import gc
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                        ".."))
+
+# pylint: disable=C0413
+from pyxmpp2_scram.scram import SCRAMOperations, SCRAMServerAuthenticator
+
+SALT = b"0123456789abcdef"
+ITERATION_COUNT = 4096
+CB_DATA = {"tls-unique": b"\x01" * 12}
+
+class PasswordDatabase(object):
+    """Password database returning the same precomputed keys for every
+    user."""
+    # pylint: disable=R0903
+    def __init__(self, hash_name):
+        operations = SCRAMOperations(hash_name)
+        salted_password = operations.Hi(operations.Normalize("pencil"), SALT,
+                                                            ITERATION_COUNT)
+        self.keys = (SALT, ITERATION_COUNT,
+                        operations.H(operations.HMAC(salted_password,
+                                                            b"Client Key")),
+                        operations.HMAC(salted_password, b"Server Key"))
+        self.pformat = "SCRAM-{0}-Keys".format(hash_name)
+
+    def get_password(self, username, formats, properties):
+        """Return the keys."""
+        # pylint: disable=W0613
+        return self.keys, self.pformat
+
+def measure(hash_name, channel_binding, count):
+    """Start `count` exchanges and return the memory retained per exchange.
+
+    :returntype: `float`
+    """
+    database = PasswordDatabase(hash_name)
+    properties = {}
+    gs2_header = b"n,,"
+    if channel_binding:
+        properties["channel-binding"] = CB_DATA
+        gs2_header = b"p=tls-unique,,"
+    messages = [gs2_header + "n=user{0},r={1:032x}".format(i, i)
+                                        .encode("utf-8") for i in range(count)]
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    exchanges = []
+    for message in messages:
+        authenticator = SCRAMServerAuthenticator(hash_name, channel_binding,
+                                                                    database)
+        authenticator.start(properties, message)
+        exchanges.append(authenticator)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    # the list itself
+    used -= sys.getsizeof(exchanges)
+    return used / count
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+    parser.add_argument("--count", type = int, default = 100000,
+                        help = "number of pending exchanges")
+    parser.add_argument("--hash", default = "SHA-1", help = "hash name")
+    parser.add_argument("--channel-binding", action = "store_true",
+                        help = "use the -PLUS variant")
+    args = parser.parse_args()
+    per_exchange = measure(args.hash, args.channel_binding, args.count)
+    print("{0} pending exchanges: {1:.0f} bytes per exchange".format(
+                                                args.count, per_exchange))
+
+if __name__ == "__main__":
+    main()
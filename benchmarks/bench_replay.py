@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""Benchmark of the `replay.NonceRegistry`.
+
+Fills a registry with ``--capacity`` random nonces spread over one window
+(as a server at full rated load would) and reports:
+
+  - the memory used by the filters,
+  - the time of a single `NonceRegistry.add` call,
+  - the measured false positive rate (fresh random nonces reported as
+    replays) and the rate estimated by
+    `NonceRegistry.false_positive_rate`.
+
+Usage::
+
+    python benchmarks/bench_replay.py [--capacity 1000000]
+            [--error-rate 1e-6] [--generations 3] [--probes 200000]
+            [--shared]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                        ".."))
+
+from pyxmpp2_scram.replay import NonceRegistry       # pylint: disable=C0413
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+    parser.add_argument("--capacity", type = int, default = 1000000,
+                        help = "nonces per window")
+    parser.add_argument("--error-rate", type = float, default = 1e-6,
+                        help = "target false positive rate")
+    parser.add_argument("--generations", type = int, default = 3,
+                        help = "number of filters")
+    parser.add_argument("--probes", type = int, default = 200000,
+                        help = "number of fresh nonces to probe with")
+    parser.add_argument("--shared", action = "store_true",
+                        help = "use the shared memory variant")
+    args = parser.parse_args()
+    window = 300
+    registry = NonceRegistry(args.capacity, window, args.error_rate,
+                                        args.generations, args.shared)
+    # the nonces of the last window, spread over its periods; the probes
+    # are registered too, so they make up the end of the current period
+    now = 1000 * window
+    per_period = args.capacity // (args.generations - 1)
+    if args.probes > per_period:
+        parser.error("--probes must not exceed the nonces per period")
+    count = 0
+    start = time.perf_counter()
+    for generation in range(args.generations - 1):
+        at = now - (args.generations - 2 - generation) * registry.period
+        if at == now:
+            fill = per_period - args.probes
+        else:
+            fill = per_period
+        for _ in range(fill):
+            registry.add(os.urandom(24), at)
+        count += fill
+    elapsed = time.perf_counter() - start
+    false_positives = 0
+    for _ in range(args.probes):
+        if not registry.add(os.urandom(24), now):
+            false_positives += 1
+    print("filters:             {0} x {1} bits, {2} hashes, {3:.1f} MiB"
+            .format(args.generations, registry.bits, registry.hash_count,
+                                                    registry.size / 2 ** 20))
+    print("add():               {0:.2f} us".format(elapsed / count * 1e6))
+    print("false positive rate: {0:.2e} measured ({1} of {2}),"
+            " {3:.2e} estimated".format(false_positives / args.probes,
+                                    false_positives, args.probes,
+                                    registry.false_positive_rate(now)))
+
+if __name__ == "__main__":
+    main()
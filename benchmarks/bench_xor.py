@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Microbenchmark of the SCRAM XOR operation and the pure Python Hi() loop.
+
+For every digest size used by `HASH_FACTORIES` it compares the original
+generator-based XOR with `SCRAMOperations.XOR`, and the original pure
+Python Hi() loop with the ``"python"`` KDF backend, reporting the time per
+call/iteration and the peak memory temporarily allocated by a XOR call.
+
+Usage::
+
+    python benchmarks/bench_xor.py [--iterations N] [--json]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import hmac
+import json
+import timeit
+import hashlib
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                        ".."))
+
+from pyxmpp2_scram import kdf                       # pylint: disable=C0413
+from pyxmpp2_scram.scram import HASH_FACTORIES, SCRAMOperations
+
+def old_xor(str1, str2):
+    """The XOR operator as implemented before."""
+    return bytes(a ^ b for a, b in zip(str1, str2))
+
+def old_hi(digestmod, password, salt, iterations):
+    """The Hi() loop as implemented before."""
+    # pylint: disable=C0103
+    Uj = hmac.new(password, salt + b"\000\000\000\001", digestmod).digest()
+    result = Uj
+    for _ in range(2, iterations + 1):
+        Uj = hmac.new(password, Uj, digestmod).digest()
+        result = old_xor(result, Uj)
+    return result
+
+def peak_memory(func):
+    """Peak memory (in bytes) temporarily allocated by a call of `func`."""
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak - base
+
+def per_call(func, number):
+    """Best time of a single call, in microseconds."""
+    return min(timeit.repeat(func, number = number, repeat = 5)) \
+                                                        / number * 1e6
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+    parser.add_argument("--iterations", type = int, default = 4096,
+                                        help = "Hi() iteration count")
+    parser.add_argument("--json", action = "store_true",
+                                        help = "print results as JSON")
+    args = parser.parse_args()
+
+    python_backend = kdf.get_backend("python")
+    results = []
+    for hash_name in sorted(HASH_FACTORIES):
+        operations = SCRAMOperations(hash_name)
+        digestmod = getattr(hashlib, operations.digest_name)
+        str1 = os.urandom(operations.digest_size)
+        str2 = os.urandom(operations.digest_size)
+        assert old_xor(str1, str2) == operations.XOR(str1, str2)
+        assert old_hi(digestmod, b"pencil", b"salt", 100) == \
+                python_backend.derive(operations.digest_name, b"pencil",
+                                                            b"salt", 100)
+        hi_number = max(1, 100000 // args.iterations)
+        results.append({
+            "hash": hash_name,
+            "digest_size": operations.digest_size,
+            "xor_old_us": per_call(lambda: old_xor(str1, str2), 20000),
+            "xor_new_us": per_call(lambda: operations.XOR(str1, str2), 20000),
+            "xor_old_peak_bytes": peak_memory(lambda: old_xor(str1, str2)),
+            "xor_new_peak_bytes": peak_memory(
+                                    lambda: operations.XOR(str1, str2)),
+            "hi_old_us_per_iteration": per_call(
+                        lambda: old_hi(digestmod, b"pencil", b"salt",
+                            args.iterations), hi_number) / args.iterations,
+            "hi_new_us_per_iteration": per_call(
+                        lambda: python_backend.derive(operations.digest_name,
+                            b"pencil", b"salt", args.iterations),
+                        hi_number) / args.iterations,
+            })
+
+    if args.json:
+        json.dump(results, sys.stdout, indent = 2)
+        print()
+        return
+    print("{0:8} {1:>4} {2:>10} {3:>10} {4:>8} {5:>8} {6:>10} {7:>10}".format(
+            "hash", "size", "xor old", "xor new", "peak", "peak",
+            "Hi old", "Hi new"))
+    print("{0:8} {1:>4} {2:>10} {3:>10} {4:>8} {5:>8} {6:>10} {7:>10}".format(
+            "", "", "us", "us", "bytes", "bytes", "us/iter", "us/iter"))
+    for result in results:
+        print("{hash:8} {digest_size:4} {xor_old_us:10.3f} {xor_new_us:10.3f}"
+                " {xor_old_peak_bytes:8} {xor_new_peak_bytes:8}"
+                " {hi_old_us_per_iteration:10.3f}"
+                " {hi_new_us_per_iteration:10.3f}".format(**result))
+
+if __name__ == "__main__":
+    main()
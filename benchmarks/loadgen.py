@@ -0,0 +1,626 @@
+#!/usr/bin/env python
+"""Load generator and soak test for `SCRAMServerAuthenticator`.
+
+Runs many concurrent simulated clients, each one repeatedly logging in with
+`SCRAMClientAuthenticator` to an asyncio server using
+`aio.AsyncSCRAMServerAuthenticator` (Hi() computed in an `aio.KDFExecutor`
+with ``--kdf-workers`` threads). The clients reach the server over:
+
+  - ``memory``: direct calls (the clients yield to the event loop between
+    the exchange steps, so all of them have exchanges in progress),
+  - ``tcp`` or ``unix``: a local socket, with a minimal line-based SASL
+    stand-in protocol (see `ServerSession`).
+
+Every client connection gets random ``tls-unique`` channel binding data
+from the server. The clients share a key cache, so (like real clients
+logging in again) they compute Hi() only on the first login of each user
+and password; after that most of the CPU time is the server's.
+
+Each login is one of the scenarios, chosen at random with the ``--mix``
+weights:
+
+  - ``valid``: correct user name and password,
+  - ``bad-password``: an existing user with a wrong password,
+  - ``unknown-user``: a user unknown to the password database,
+  - ``downgrade``: a client supporting -PLUS selecting the plain mechanism
+    (the server advertises both),
+  - ``malformed``: a corrupted client first or final message.
+
+Only the ``valid`` logins should succeed; other outcomes are counted as
+unexpected. The failure reasons (exception classes raised by the server
+authenticator or, prefixed with ``client``, by the client one) are counted
+per scenario, so e.g. an unexpected exception escaping the authenticator on
+malformed input shows up in the summary.
+
+Every ``--interval`` seconds a line is printed with the throughput, the
+median, 99th and 99.9th percentile login latency, the CPU time per login
+(of the whole process: clients, server and KDF threads) and the resident
+memory. With ``--tracemalloc`` the traced memory is reported too, and the
+summary lists the code locations where it grew the most since the end of
+the first interval -- the per-exchange state kept by mistake. Memory growth
+is computed from the end of the first interval, after the caches filled.
+
+Usage::
+
+    python benchmarks/loadgen.py [--clients 1000] [--duration 60]
+            [--users 1000] [--hash SHA-1] [--iterations 4096]
+            [--format plain] [--channel-binding] [--transport memory]
+            [--kdf-workers 4] [--interval 5] [--seed 1] [--tracemalloc]
+            [--json] [--mix valid=90,bad-password=4,unknown-user=3,
+                                                downgrade=2,malformed=1]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import gc
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+from base64 import standard_b64encode, standard_b64decode
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                        ".."))
+
+# pylint: disable=C0413
+from pyxmpp2_scram import kdf
+from pyxmpp2_scram.aio import AsyncSCRAMServerAuthenticator, KDFExecutor
+from pyxmpp2_scram.cache import KeyCache
+from pyxmpp2_scram.exceptions import ScramException
+from pyxmpp2_scram.scram import HASH_FACTORIES, SCRAMOperations, \
+        SCRAMClientAuthenticator
+
+PASSWORD = "pencil"
+SALT = b"0123456789abcdef"
+SCENARIOS = ("valid", "bad-password", "unknown-user", "downgrade",
+                                                                "malformed")
+DEFAULT_MIX = "valid=90,bad-password=4,unknown-user=3,downgrade=2,malformed=1"
+
+def exception_name(exception):
+    """Name of an exception class, with the module name unless it is
+    a built-in or SCRAM exception."""
+    cls = exception.__class__
+    if cls.__module__ in ("builtins", "pyxmpp2_scram.exceptions"):
+        return cls.__name__
+    return cls.__module__ + "." + cls.__name__
+
+class PasswordDatabase(object):
+    """Password database of ``user0`` .. ``user<N-1>``, all with the same
+    password, in the ``plain`` or ``Keys`` format."""
+    # pylint: disable=R0903
+    def __init__(self, hash_name, users, pformat, iteration_count):
+        self.users = frozenset("user{0}".format(i) for i in range(users))
+        if pformat == "plain":
+            self.password = PASSWORD
+            self.pformat = "plain"
+            return
+        operations = SCRAMOperations(hash_name)
+        salted_password = operations.Hi(operations.Normalize(PASSWORD), SALT,
+                                                            iteration_count)
+        self.password = (SALT, iteration_count,
+                        operations.H(operations.HMAC(salted_password,
+                                                            b"Client Key")),
+                        operations.HMAC(salted_password, b"Server Key"))
+        self.pformat = "SCRAM-{0}-Keys".format(hash_name)
+
+    def get_password(self, username, formats, properties):
+        """Return the password of a known user."""
+        # pylint: disable=W0613
+        if username in self.users and self.pformat in formats:
+            return self.password, self.pformat
+        return None, None
+
+class Server(object):
+    """The authenticating side: configuration shared by the sessions."""
+    def __init__(self, hash_name, database, kdf_executor, iteration_count):
+        self.hash_name = hash_name
+        self.database = database
+        self.kdf_executor = kdf_executor
+        self.iteration_count = iteration_count
+        name = "SCRAM-" + hash_name
+        self.mechanisms = {name: False, name + "-PLUS": True}
+
+    def session(self):
+        """Create a session for a new connection.
+
+        :returntype: `ServerSession`
+        """
+        return ServerSession(self, {"tls-unique": os.urandom(12)})
+
+class ServerSession(object):
+    """Server side of a single connection of the SASL stand-in.
+
+    Client requests are single lines: ``AUTH <mechanism> <base64>`` or
+    ``RESP <base64>``; the replies are ``CHAL <base64>``, ``OK <base64>``
+    or ``FAIL <reason>``. A new ``AUTH`` may follow an ``OK`` or ``FAIL``.
+    On connection the server sends ``HELLO <base64>`` with the channel
+    binding data.
+    """
+    def __init__(self, server, cb_data):
+        self.server = server
+        self.cb_data = cb_data
+        self.authenticator = None
+
+    def hello(self):
+        """The greeting line."""
+        return b"HELLO " + standard_b64encode(self.cb_data["tls-unique"])
+
+    async def handle(self, line):
+        """Process a request line and return the reply line."""
+        # pylint: disable=W0703
+        try:
+            command, _, args = line.partition(b" ")
+            if command == b"AUTH":
+                mechanism, _, data = args.partition(b" ")
+                return await self._auth(mechanism.decode("ascii"),
+                                                standard_b64decode(data))
+            elif command == b"RESP" and self.authenticator is not None:
+                result = await self.authenticator.response(
+                                                    standard_b64decode(args))
+                return self._reply(result)
+            else:
+                raise ValueError("Unexpected command")
+        except Exception as err:
+            self.authenticator = None
+            return b"FAIL " + exception_name(err).encode("ascii")
+
+    async def _auth(self, mechanism, data):
+        """Start an exchange."""
+        server = self.server
+        channel_binding = server.mechanisms[mechanism]
+        self.authenticator = AsyncSCRAMServerAuthenticator(server.hash_name,
+                            channel_binding, server.database,
+                            server.kdf_executor)
+        properties = {"channel-binding": self.cb_data,
+                        "enabled_mechanisms": list(server.mechanisms),
+                        "SCRAM-salt": SALT,
+                        "SCRAM-iteration-count": server.iteration_count}
+        return self._reply(await self.authenticator.start(properties, data))
+
+    def _reply(self, result):
+        """Build the reply line for an authenticator result."""
+        if isinstance(result, tuple):
+            self.authenticator = None
+            return b"OK " + standard_b64encode(result[1])
+        return b"CHAL " + standard_b64encode(result)
+
+class MemoryConnection(object):
+    """Client connection calling the `ServerSession` directly."""
+    def __init__(self, server):
+        self.session = server.session()
+        self.cb_data = self.session.cb_data
+
+    async def request(self, line):
+        """Send a request line and return the reply line."""
+        await asyncio.sleep(0)
+        return await self.session.handle(line)
+
+    def close(self):
+        """Close the connection."""
+        pass
+
+class StreamConnection(object):
+    """Client connection over a local socket."""
+    def __init__(self, reader, writer, cb_data):
+        self.reader = reader
+        self.writer = writer
+        self.cb_data = cb_data
+
+    @classmethod
+    async def connect(cls, address):
+        """Connect to the server.
+
+        :returntype: `StreamConnection`
+        """
+        if isinstance(address, tuple):
+            reader, writer = await asyncio.open_connection(*address)
+        else:
+            reader, writer = await asyncio.open_unix_connection(address)
+        hello = (await reader.readline()).rstrip(b"\n")
+        cb_data = {"tls-unique": standard_b64decode(hello.split(b" ")[1])}
+        return cls(reader, writer, cb_data)
+
+    async def request(self, line):
+        """Send a request line and return the reply line."""
+        self.writer.write(line + b"\n")
+        reply = await self.reader.readline()
+        if not reply:
+            raise ConnectionError("Connection closed")
+        return reply.rstrip(b"\n")
+
+    def close(self):
+        """Close the connection."""
+        self.writer.close()
+
+async def serve_stream(server, reader, writer):
+    """Handle a socket connection."""
+    session = server.session()
+    writer.write(session.hello() + b"\n")
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            writer.write(await session.handle(line.rstrip(b"\n")) + b"\n")
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+def corrupt(message, rng):
+    """Return a malformed variant of a client message."""
+    choice = rng.randrange(3)
+    if choice == 0:
+        return message[:rng.randrange(len(message))]
+    elif choice == 1:
+        return message.replace(b"r=", b"r", 1)
+    return b"x" + message
+
+class Stats(object):
+    """Login statistics.
+
+    :Ivariables:
+        - `outcomes`: outcome counts by scenario
+        - `failures`: server failure reasons by scenario
+        - `latencies`: login latencies since the last interval
+        - `logins`: number of logins finished
+    """
+    def __init__(self):
+        self.outcomes = dict((scenario, {}) for scenario in SCENARIOS)
+        self.failures = dict((scenario, {}) for scenario in SCENARIOS)
+        self.latencies = []
+        self.logins = 0
+
+    def record(self, scenario, outcome, reason, latency):
+        """Record a finished login."""
+        counts = self.outcomes[scenario]
+        counts[outcome] = counts.get(outcome, 0) + 1
+        if reason is not None:
+            counts = self.failures[scenario]
+            counts[reason] = counts.get(reason, 0) + 1
+        self.latencies.append(latency)
+        self.logins += 1
+
+    def unexpected(self):
+        """Number of logins with an unexpected outcome."""
+        count = 0
+        for scenario, counts in self.outcomes.items():
+            expected = "success" if scenario == "valid" else "rejected"
+            count += sum(number for outcome, number in counts.items()
+                                                    if outcome != expected)
+        return count
+
+async def login(connection, hash_name, channel_binding, scenario, user, rng,
+                                                                key_cache):
+    """Run a single login.
+
+    :return: the outcome (``"success"``, ``"rejected"`` or ``"error"``) and
+        the server failure reason
+    """
+    # pylint: disable=R0913
+    name = "SCRAM-" + hash_name
+    properties = {"username": "user{0}".format(user), "password": PASSWORD,
+                                                "SCRAM-key-cache": key_cache}
+    if scenario == "downgrade":
+        channel_binding = False
+        properties["enabled_mechanisms"] = [name, name + "-PLUS"]
+    elif scenario == "bad-password":
+        properties["password"] = "wrong " + PASSWORD
+    elif scenario == "unknown-user":
+        properties["username"] = "nobody{0}".format(user)
+    if channel_binding:
+        name += "-PLUS"
+    properties["channel-binding"] = connection.cb_data
+    client = SCRAMClientAuthenticator(hash_name, channel_binding)
+    malformed = None
+    if scenario == "malformed":
+        malformed = rng.choice(("first", "final"))
+    message = client.start(properties)
+    if malformed == "first":
+        message = corrupt(message, rng)
+    reply = await connection.request(b" ".join((b"AUTH",
+                    name.encode("ascii"), standard_b64encode(message))))
+    if reply.startswith(b"CHAL "):
+        message = client.challenge(standard_b64decode(reply[5:]))
+        if malformed == "final":
+            message = corrupt(message, rng)
+        reply = await connection.request(b"RESP "
+                                            + standard_b64encode(message))
+    if reply.startswith(b"FAIL "):
+        return "rejected", reply[5:].decode("ascii")
+    if reply.startswith(b"OK "):
+        client.finish(standard_b64decode(reply[3:]))
+        return "success", None
+    return "error", None
+
+async def run_client(connect, stats, args, weights, rng, deadline,
+                                                                key_cache):
+    """Log in repeatedly until the deadline."""
+    # pylint: disable=R0913
+    connection = await connect()
+    try:
+        while time.perf_counter() < deadline:
+            scenario = rng.choices(SCENARIOS, weights)[0]
+            user = rng.randrange(args.users)
+            start = time.perf_counter()
+            try:
+                outcome, reason = await login(connection, args.hash,
+                            args.channel_binding, scenario, user, rng,
+                            key_cache)
+            except ScramException as err:
+                # the client rejected the server message (e.g. a challenge
+                # to a truncated client first message)
+                outcome, reason = "rejected", "client " + exception_name(err)
+            stats.record(scenario, outcome, reason,
+                                                time.perf_counter() - start)
+    finally:
+        connection.close()
+
+def rss_bytes():
+    """Current resident set size (in bytes), or the peak one where the
+    current one is not available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def percentile(samples, fraction):
+    """Percentile of sorted samples."""
+    if not samples:
+        return 0.0
+    return samples[int((len(samples) - 1) * fraction)]
+
+def sample(stats, interval_start, cpu_start, traced):
+    """Take the measurements of an interval.
+
+    :returntype: `dict`
+    """
+    now = time.perf_counter()
+    latencies = sorted(stats.latencies)
+    stats.latencies = []
+    cpu = time.process_time()
+    result = {
+        "time": now,
+        "logins": len(latencies),
+        "throughput": len(latencies) / (now - interval_start),
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+        "p999": percentile(latencies, 0.999),
+        "cpu_per_login": (cpu - cpu_start) / max(1, len(latencies)),
+        "cpu": cpu,
+        "rss": rss_bytes(),
+        }
+    if traced:
+        result["traced"] = tracemalloc.get_traced_memory()[0]
+    return result
+
+def print_sample(number, result):
+    """Print the measurements of an interval."""
+    if number == 0:
+        print("{0:>4} {1:>9} {2:>8} {3:>8} {4:>8} {5:>8} {6:>9} {7:>9}".format(
+                "#", "login/s", "p50 ms", "p99 ms", "p999 ms", "cpu ms",
+                "rss MiB", "trace MiB"))
+    print("{0:4} {1:9.1f} {2:8.2f} {3:8.2f} {4:8.2f} {5:8.3f} {6:9.1f}"
+            " {7:>9}".format(number, result["throughput"],
+                result["p50"] * 1000, result["p99"] * 1000,
+                result["p999"] * 1000, result["cpu_per_login"] * 1000,
+                result["rss"] / 2 ** 20,
+                "{0:.1f}".format(result["traced"] / 2 ** 20)
+                                        if "traced" in result else "-"))
+    sys.stdout.flush()
+
+async def monitor(stats, args, deadline, verbose):
+    """Take the measurements every interval until the deadline."""
+    samples = []
+    baseline = None
+    interval_start = time.perf_counter()
+    cpu_start = time.process_time()
+    while True:
+        remaining = deadline - time.perf_counter()
+        await asyncio.sleep(max(0, min(args.interval, remaining)))
+        result = sample(stats, interval_start, cpu_start, args.tracemalloc)
+        interval_start, cpu_start = result["time"], result["cpu"]
+        if verbose:
+            print_sample(len(samples), result)
+        samples.append(result)
+        if baseline is None and args.tracemalloc:
+            gc.collect()
+            baseline = tracemalloc.take_snapshot()
+        if remaining <= args.interval:
+            return samples, baseline
+
+def parse_mix(value):
+    """Parse the ``--mix`` argument into scenario weights."""
+    weights = dict((scenario, 0) for scenario in SCENARIOS)
+    for item in value.split(","):
+        scenario, _, weight = item.partition("=")
+        if scenario not in weights:
+            raise argparse.ArgumentTypeError("Unknown scenario: {0!r}"
+                                                        .format(scenario))
+        weights[scenario] = float(weight)
+    return [weights[scenario] for scenario in SCENARIOS]
+
+async def run(args, weights):
+    """Run the load test.
+
+    :return: the interval measurements, the statistics, the tracemalloc
+        snapshot taken after the first interval and the server
+    """
+    database = PasswordDatabase(args.hash, args.users, args.format,
+                                                        args.iterations)
+    kdf_executor = KDFExecutor(max_concurrency = args.kdf_workers)
+    server = Server(args.hash, database, kdf_executor, args.iterations)
+    listener = None
+    tmpdir = None
+    if args.transport == "memory":
+        async def connect():
+            """Create a memory connection."""
+            return MemoryConnection(server)
+    else:
+        handler = lambda reader, writer: serve_stream(server, reader, writer)
+        if args.transport == "tcp":
+            listener = await asyncio.start_server(handler, "127.0.0.1", 0,
+                                                        backlog = args.clients)
+            address = listener.sockets[0].getsockname()[:2]
+        else:
+            tmpdir = tempfile.mkdtemp()
+            address = os.path.join(tmpdir, "sasl.sock")
+            listener = await asyncio.start_unix_server(handler, address,
+                                                        backlog = args.clients)
+        async def connect():
+            """Create a socket connection."""
+            return await StreamConnection.connect(address)
+    stats = Stats()
+    key_cache = KeyCache(2 * args.users + 16)
+    deadline = time.perf_counter() + args.duration
+    master = random.Random(args.seed)
+    clients = [asyncio.ensure_future(run_client(connect, stats, args,
+                                weights, random.Random(master.random()),
+                                deadline, key_cache))
+                                                for _ in range(args.clients)]
+    try:
+        samples, baseline = await monitor(stats, args, deadline,
+                                                        not args.json)
+        await asyncio.gather(*clients)
+    finally:
+        for client in clients:
+            client.cancel()
+        if listener is not None:
+            listener.close()
+            await listener.wait_closed()
+        if tmpdir is not None:
+            os.unlink(address)
+            os.rmdir(tmpdir)
+        kdf_executor.shutdown()
+    return samples, stats, baseline
+
+def summarize(args, samples, stats, baseline):
+    """Build the run summary.
+
+    :returntype: `dict`
+    """
+    first, last = samples[0], samples[-1]
+    hours = (last["time"] - first["time"]) / 3600
+    summary = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "kdf_backend": kdf.get_default_backend().name,
+        "settings": dict((key, value) for key, value in vars(args).items()
+                                                        if key != "json"),
+        "logins": stats.logins,
+        "unexpected": stats.unexpected(),
+        "outcomes": stats.outcomes,
+        "failures": stats.failures,
+        "throughput": stats.logins / args.duration,
+        "p99_max": max(result["p99"] for result in samples),
+        "cpu_per_login": sum(result["cpu_per_login"] * result["logins"]
+                                for result in samples) / max(1, stats.logins),
+        "rss_growth": last["rss"] - first["rss"],
+        "rss_growth_per_hour": (last["rss"] - first["rss"]) / hours
+                                                        if hours else None,
+        "intervals": samples,
+        }
+    if baseline is not None:
+        gc.collect()
+        stats_diff = tracemalloc.take_snapshot().compare_to(baseline,
+                                                                "lineno")
+        summary["traced_growth"] = last["traced"] - first["traced"]
+        summary["top_growth"] = [str(stat) for stat in stats_diff
+                                                if stat.size_diff > 0][:10]
+    return summary
+
+def print_summary(summary):
+    """Print the summary in human-readable form."""
+    print()
+    print("logins: {0}, {1:.1f}/s, unexpected outcomes: {2}".format(
+                summary["logins"], summary["throughput"],
+                summary["unexpected"]))
+    print("CPU per login: {0:.3f} ms, worst interval p99: {1:.2f} ms".format(
+                summary["cpu_per_login"] * 1000, summary["p99_max"] * 1000))
+    print("RSS growth after the first interval: {0:.1f} KiB".format(
+                summary["rss_growth"] / 1024))
+    if "traced_growth" in summary:
+        print("traced memory growth: {0:.1f} KiB".format(
+                summary["traced_growth"] / 1024))
+        for line in summary["top_growth"]:
+            print("  " + line)
+    print()
+    print("{0:14} {1}".format("scenario", "outcomes / server failures"))
+    for scenario in SCENARIOS:
+        outcomes = summary["outcomes"][scenario]
+        if not outcomes:
+            continue
+        print("{0:14} {1} / {2}".format(scenario,
+            ", ".join("{0}={1}".format(*item)
+                                    for item in sorted(outcomes.items())),
+            ", ".join("{0}={1}".format(*item) for item
+                            in sorted(summary["failures"][scenario].items()))
+                                                                    or "-"))
+
+def main():
+    """Run the load test."""
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+    parser.add_argument("--clients", type = int, default = 1000,
+                        help = "number of concurrent clients")
+    parser.add_argument("--duration", type = float, default = 60,
+                        help = "run time in seconds")
+    parser.add_argument("--users", type = int, default = 1000,
+                        help = "number of users in the password database")
+    parser.add_argument("--hash", default = "SHA-1",
+                        choices = sorted(HASH_FACTORIES), help = "hash name")
+    parser.add_argument("--iterations", type = int, default = 4096,
+                        help = "iteration count")
+    parser.add_argument("--format", choices = ("plain", "Keys"),
+                        default = "plain",
+                        help = "password database format (plain: Hi() on"
+                                                " the server for every login)")
+    parser.add_argument("--channel-binding", action = "store_true",
+                        help = "use the -PLUS mechanism for the logins")
+    parser.add_argument("--transport", choices = ("memory", "tcp", "unix"),
+                        default = "memory", help = "client connections")
+    parser.add_argument("--kdf-workers", type = int, default = None,
+                        help = "Hi() worker threads (default: CPU count)")
+    parser.add_argument("--mix", type = parse_mix, default = DEFAULT_MIX,
+                        help = "scenario weights (default: {0})".format(
+                                                            DEFAULT_MIX))
+    parser.add_argument("--interval", type = float, default = 5,
+                        help = "reporting interval in seconds")
+    parser.add_argument("--seed", type = int, default = 1,
+                        help = "random seed of the scenario choice")
+    parser.add_argument("--tracemalloc", action = "store_true",
+                        help = "trace the Python memory allocations (slow)")
+    parser.add_argument("--json", action = "store_true",
+                        help = "print the summary as JSON instead of a table")
+    args = parser.parse_args()
+    weights = args.mix
+    if isinstance(weights, str):
+        weights = parse_mix(weights)
+    args.mix = dict(zip(SCENARIOS, weights))
+    if args.tracemalloc:
+        tracemalloc.start()
+    loop = asyncio.new_event_loop()
+    try:
+        samples, stats, baseline = loop.run_until_complete(run(args,
+                                                                    weights))
+    finally:
+        loop.close()
+    summary = summarize(args, samples, stats, baseline)
+    if args.json:
+        json.dump(summary, sys.stdout, indent = 2, sort_keys = True)
+        print()
+    else:
+        print_summary(summary)
+    sys.exit(1 if summary["unexpected"] else 0)
+
+if __name__ == "__main__":
+    main()
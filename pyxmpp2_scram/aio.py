@@ -0,0 +1,344 @@
+"""Asyncio variants of the SCRAM authenticators.
+
+The authenticators defined here work like `SCRAMClientAuthenticator` and
+`SCRAMServerAuthenticator`, but their `start`, `challenge` and `response`
+methods are coroutines and the Hi() computation is run in an executor, so
+it does not block the event loop.
+
+This module requires Python 3.7 or newer and is not imported by the
+package ``__init__``.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+__docformat__ = "restructuredtext en"
+
+import asyncio
+import logging
+import time
+import weakref
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from . import kdf
+from .aiodb import get_password
+from .audit import redact_message
+from .credentials import ClientKeys
+from .exceptions import BadChallengeException
+from .instrument import timer
+from .scram import SCRAMClientAuthenticator, SCRAMServerAuthenticator, \
+        derive_keys
+
+logger = logging.getLogger("pyxmpp2_scram.aio")
+
+class KDFExecutor(object):
+    """Runs Hi() computations in a thread or process pool.
+
+    A thread pool is used by default when the KDF backend releases the GIL,
+    a process pool otherwise. The number of computations submitted at once
+    (from a single event loop) is limited, the others wait in the event
+    loop. The object is not bound to any event loop, so it may be shared by
+    loops run one after another or in different threads.
+
+    :Ivariables:
+        - `backend`: the `kdf.KDFBackend` used
+        - `executor`: the `concurrent.futures.Executor` used
+        - `max_concurrency`: maximum number of computations in the executor
+    """
+    def __init__(self, executor = None, max_concurrency = None,
+                                        backend = None, history_size = 4096):
+        """Initialize the executor.
+
+        :Parameters:
+            - `executor`: the executor to use, `None` to create one
+            - `max_concurrency`: maximum number of computations running at
+              once, `None` for the number of CPUs
+            - `backend`: KDF backend, `None` for the default one
+            - `history_size`: number of latency samples kept for
+              `latency_stats`
+        :Types:
+            - `executor`: `concurrent.futures.Executor`
+            - `max_concurrency`: `int`
+            - `backend`: `unicode` or `kdf.KDFBackend`
+            - `history_size`: `int`
+        """
+        self.backend = kdf.get_backend(backend)
+        if max_concurrency is None:
+            max_concurrency = kdf.cpu_count()
+        self.max_concurrency = max_concurrency
+        self._own_executor = executor is None
+        if executor is None:
+            executor = kdf.create_executor(self.backend, max_concurrency)
+        self.executor = executor
+        self._in_process = not isinstance(executor, ProcessPoolExecutor)
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._latencies = deque(maxlen = history_size)
+        self._queue_times = deque(maxlen = history_size)
+
+    async def derive(self, digest_name, password, salt, iterations):
+        """Compute Hi() in the executor.
+
+        :Parameters:
+            - `digest_name`: `hashlib` name of the digest
+            - `password`: the normalized password
+            - `salt`: the salt
+            - `iterations`: iteration count
+        :Types:
+            - `digest_name`: `unicode`
+            - `password`: `bytes`
+            - `salt`: `bytes`
+            - `iterations`: `int`
+
+        :returntype: `bytes`
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            semaphore = self._semaphores.setdefault(loop, semaphore)
+        start = time.perf_counter()
+        async with semaphore:
+            queued = time.perf_counter()
+            if self._in_process:
+                result = await loop.run_in_executor(self.executor,
+                                self.backend.derive,
+                                digest_name, password, salt, iterations)
+            else:
+                result = await loop.run_in_executor(self.executor,
+                                kdf.pbkdf2, digest_name, password, salt,
+                                iterations, self.backend.name)
+        end = time.perf_counter()
+        self._queue_times.append(queued - start)
+        self._latencies.append(end - start)
+        return result
+
+    def latency_stats(self):
+        """Return statistics of the recent computations.
+
+        Latency is measured from the `derive` call, so it includes the time
+        spent waiting for a free slot (reported separately as 'queue').
+
+        :return: dictionary with the 'count' and 'p50', 'p99' and 'max' of
+            'latency' and 'queue' times (in seconds)
+        :returntype: `dict`
+        """
+        result = {"count": len(self._latencies)}
+        for name, samples in (("latency", self._latencies),
+                                                ("queue", self._queue_times)):
+            samples = sorted(samples)
+            if samples:
+                result[name] = {
+                    "p50": samples[(len(samples) - 1) * 50 // 100],
+                    "p99": samples[(len(samples) - 1) * 99 // 100],
+                    "max": samples[-1],
+                    }
+            else:
+                result[name] = {"p50": None, "p99": None, "max": None}
+        return result
+
+    def shutdown(self, wait = True):
+        """Shut down the executor, if created by this object."""
+        if self._own_executor:
+            self.executor.shutdown(wait)
+
+_default_executor = None
+
+def get_default_kdf_executor():
+    """Get the `KDFExecutor` shared by authenticators created without one.
+
+    :returntype: `KDFExecutor`
+    """
+    # pylint: disable=W0603
+    global _default_executor
+    if _default_executor is None:
+        _default_executor = KDFExecutor()
+    return _default_executor
+
+class AsyncSCRAMClientAuthenticator(SCRAMClientAuthenticator):
+    """`SCRAMClientAuthenticator` with coroutine methods."""
+    def __init__(self, hash_name, channel_binding, kdf_executor = None):
+        """Initialize an `AsyncSCRAMClientAuthenticator` object.
+
+        :Parameters:
+            - `hash_function_name`: hash function name, e.g. ``"SHA-1"``
+            - `channel_binding`: `True` to enable channel binding
+            - `kdf_executor`: executor for the Hi() computation, `None` for
+              the default one
+        :Types:
+            - `hash_function_name`: `unicode`
+            - `channel_binding`: `bool`
+            - `kdf_executor`: `KDFExecutor`
+        """
+        if kdf_executor is None:
+            kdf_executor = get_default_kdf_executor()
+        SCRAMClientAuthenticator.__init__(self, hash_name, channel_binding,
+                                                        kdf_executor.backend)
+        self.kdf_executor = kdf_executor
+
+    async def start(self, properties):
+        return SCRAMClientAuthenticator.start(self, properties)
+
+    async def challenge(self, challenge):
+        """Process a challenge and return the response.
+
+        :Parameters:
+            - `challenge`: the challenge from server.
+        :Types:
+            - `challenge`: `bytes`
+
+        :return: the response
+        :returntype: bytes
+        :raises: `BadChallengeException`
+        """
+        try:
+            if not challenge:
+                raise BadChallengeException('Empty challenge')
+            if self._server_first_message:
+                return self._timed("verify", self._final_challenge, challenge)
+            nonce, salt, iteration_count = self._timed("parse",
+                                    self._parse_first_challenge, challenge)
+            if self._profile is not None:
+                return await self._profile_response(nonce, salt,
+                                                            iteration_count)
+            password = self.Normalize(self.password)
+            self.password = None
+            if self._key_cache is None:
+                keys = None
+            else:
+                cache_key = self._key_cache.make_key(self.hash_function_name,
+                            self.username, password, salt, iteration_count)
+                keys = self._key_cache.get(cache_key)
+                if self._instrumentation is not None:
+                    self._instrumentation.cache(self.name, keys is not None)
+            if keys is None:
+                start = timer()
+                salted_password = await self.kdf_executor.derive(
+                        self.digest_name, password, salt, iteration_count)
+                self._report_kdf(iteration_count, timer() - start)
+                keys = derive_keys(self, salted_password)
+                if self._key_cache is not None:
+                    self._key_cache.put(cache_key, keys)
+            return self._timed("proof", self._make_final_message, nonce,
+                                                                    *keys)
+        except Exception as err:
+            self._report_failure(err)
+            raise
+
+    async def _profile_response(self, nonce, salt, iteration_count):
+        """Make the response using the keys from the client profile.
+
+        :return: the response
+        :returntype: bytes
+        """
+        profile = self._profile
+        keys = profile.lookup_keys(self.hash_function_name, salt,
+                                                            iteration_count)
+        if self._instrumentation is not None:
+            self._instrumentation.cache(self.name, keys is not None)
+        if keys is None:
+            start = timer()
+            salted_password = await self.kdf_executor.derive(
+                    self.digest_name, profile.password, salt, iteration_count)
+            self._report_kdf(iteration_count, timer() - start)
+            keys = ClientKeys(self, salted_password)
+            profile.add_keys(self.hash_function_name, salt, iteration_count,
+                                                                        keys)
+        return self._timed("proof", self._make_final_message, nonce,
+                                keys.client_key, keys.server_key,
+                                keys.stored_key_hmac, keys.server_key_hmac)
+
+    async def finish(self, data):
+        return SCRAMClientAuthenticator.finish(self, data)
+
+class AsyncSCRAMServerAuthenticator(SCRAMServerAuthenticator):
+    """`SCRAMServerAuthenticator` with coroutine methods.
+
+    The ``get_password`` method of the password database may be
+    a coroutine (see `aiodb`)."""
+    __slots__ = ("kdf_executor",)
+    def __init__(self, hash_name, channel_binding, password_database,
+                                                        kdf_executor = None):
+        """Initialize an `AsyncSCRAMServerAuthenticator` object.
+
+        :Parameters:
+            - `hash_function_name`: hash function name, e.g. ``"SHA-1"``
+            - `channel_binding`: `True` to enable channel binding
+            - `password_database`: the password database
+            - `kdf_executor`: executor for the Hi() computation, `None` for
+              the default one
+        :Types:
+            - `hash_function_name`: `unicode`
+            - `channel_binding`: `bool`
+            - `kdf_executor`: `KDFExecutor`
+        """
+        if kdf_executor is None:
+            kdf_executor = get_default_kdf_executor()
+        SCRAMServerAuthenticator.__init__(self, hash_name, channel_binding,
+                                password_database, kdf_executor.backend)
+        self.kdf_executor = kdf_executor
+
+    @classmethod
+    def from_config(cls, config, password_database, kdf_executor = None):
+        """Create an authenticator for a mechanism configuration.
+
+        :Parameters:
+            - `config`: the mechanism configuration
+            - `password_database`: the password database
+            - `kdf_executor`: executor for the Hi() computation, `None` for
+              the default one
+        :Types:
+            - `config`: `SCRAMServerConfig`
+            - `kdf_executor`: `KDFExecutor`
+
+        :returntype: `AsyncSCRAMServerAuthenticator`
+        """
+        authenticator = super().from_config(config, password_database)
+        if kdf_executor is None:
+            kdf_executor = get_default_kdf_executor()
+        authenticator.kdf_executor = kdf_executor
+        return authenticator
+
+    async def start(self, properties, initial_response):
+        self._reset(properties)
+        if not initial_response:
+            return b""
+        return await self.response(initial_response)
+
+    async def response(self, response):
+        try:
+            if self._client_first_message_bare:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Client final message: %r",
+                                                redact_message(response))
+                result = self._timed("verify", self._handle_final_response,
+                                                                    response)
+                self._report_success()
+                return result
+            else:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Client first message: %r",
+                                                redact_message(response))
+                return await self._handle_first_response_async(response)
+        except Exception as err:
+            self._report_failure(err)
+            raise
+
+    async def _handle_first_response_async(self, response):
+        """Coroutine version of `_handle_first_response`."""
+        username, properties = self._timed("parse",
+                                    self._parse_first_response, response)
+        start = timer()
+        password, pformat = await get_password(self.password_database,
+                                username, self._password_formats, properties)
+        if self._instrumentation is not None:
+            self._instrumentation.phase(self.name, self._side, "lookup",
+                                                            timer() - start)
+        pending = self._prepare_keys(username, password, pformat)
+        if pending.password is not None:
+            start = timer()
+            salted_password = await self.kdf_executor.derive(self.digest_name,
+                    pending.password, pending.salt, pending.iteration_count)
+            self._report_kdf(pending.iteration_count, timer() - start)
+            pending.set_salted_password(self, salted_password)
+        return self._build_server_first_message(pending)
@@ -0,0 +1,321 @@
+"""Asynchronous password databases.
+
+`aio.AsyncSCRAMServerAuthenticator` accepts, besides the usual password
+databases, objects whose ``get_password(username, formats, properties)``
+method is a coroutine (returning the same (password, format) pair), so
+a lookup in an SQL or LDAP backend does not block the event loop.
+
+Two such databases are provided:
+
+  - `PooledPasswordDatabase` -- runs blocking lookups (e.g. DB-API
+    queries) in a thread pool, on a bounded pool of reused connections,
+  - `CachingPasswordDatabase` -- caches the results of another database
+    (synchronous or asynchronous) for a limited time, including the "no
+    such user" results, and makes concurrent lookups of the same user share
+    a single backend call.
+
+A typical setup with `sqlite3`::
+
+    def connect():
+        return sqlite3.connect("users.db", check_same_thread = False)
+
+    def lookup(connection, username, formats, properties):
+        row = connection.execute("SELECT password FROM users"
+                                " WHERE username = ?", (username,)).fetchone()
+        if row is None:
+            return None, None
+        return row[0], "plain"
+
+    database = CachingPasswordDatabase(PooledPasswordDatabase(connect,
+                                                                    lookup))
+
+Both databases may be shared by several event loops. This module requires
+Python 3.7 or newer and is not imported by the package ``__init__``.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+__docformat__ = "restructuredtext en"
+
+import asyncio
+import inspect
+import logging
+import threading
+import weakref
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import LRUCache
+
+logger = logging.getLogger("pyxmpp2_scram.aiodb")
+
+async def get_password(database, username, formats, properties):
+    """Look a user up in a synchronous or asynchronous password database.
+
+    :Parameters:
+        - `database`: the password database
+        - `username`: the user name
+        - `formats`: acceptable password formats
+        - `properties`: authentication properties
+    :Types:
+        - `formats`: sequence of `unicode`
+        - `properties`: `dict`
+
+    :return: the password and its format
+    :returntype: (`unicode` or `tuple`, `unicode`)
+    """
+    result = database.get_password(username, formats, properties)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+class PooledPasswordDatabase(object):
+    """Asynchronous adapter for a blocking password backend.
+
+    Lookups are run in a thread pool, each on a connection taken from
+    a pool of at most `pool_size` connections, created on demand and reused.
+    A connection which raised an exception is closed and replaced.
+
+    :Ivariables:
+        - `pool_size`: maximum number of connections (and concurrent
+          lookups) per event loop
+    """
+    def __init__(self, connect, lookup, pool_size = 4, executor = None):
+        """Initialize the adapter.
+
+        :Parameters:
+            - `connect`: function returning a new backend connection
+            - `lookup`: function called as ``lookup(connection, username,
+              formats, properties)`` returning the (password, format) pair
+              like ``get_password`` of a password database
+            - `pool_size`: maximum number of connections
+            - `executor`: the executor to run `connect` and `lookup` in,
+              `None` to create a thread pool of `pool_size` threads
+        :Types:
+            - `pool_size`: `int`
+            - `executor`: `concurrent.futures.Executor`
+        """
+        self.pool_size = pool_size
+        self._connect = connect
+        self._lookup = lookup
+        self._own_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(pool_size)
+        self._executor = executor
+        self._idle = []
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    async def get_password(self, username, formats, properties):
+        """Look a user up in the backend.
+
+        :Parameters:
+            - `username`: the user name
+            - `formats`: acceptable password formats
+            - `properties`: authentication properties
+        :Types:
+            - `formats`: sequence of `unicode`
+            - `properties`: `dict`
+
+        :return: the password and its format
+        :returntype: (`unicode` or `tuple`, `unicode`)
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.pool_size)
+            semaphore = self._semaphores.setdefault(loop, semaphore)
+        async with semaphore:
+            if self._idle:
+                connection = self._idle.pop()
+            else:
+                connecting = self._executor.submit(self._connect)
+                try:
+                    connection = await asyncio.wrap_future(connecting)
+                except BaseException:
+                    # if cancelled, the connection may still be made
+                    connecting.add_done_callback(self._close_connected)
+                    raise
+            lookup = self._executor.submit(self._lookup, connection,
+                                                username, formats, properties)
+            try:
+                result = await asyncio.wrap_future(lookup)
+            except BaseException:
+                logger.debug("Lookup failed or cancelled, dropping the"
+                                        " connection", exc_info = True)
+                # if cancelled, the lookup may still be running in the
+                # executor thread, so close the connection when it is done
+                lookup.add_done_callback(
+                                lambda _: self._close_connection(connection))
+                raise
+            self._idle.append(connection)
+        return result
+
+    @classmethod
+    def _close_connected(cls, future):
+        """Close the connection made by a cancelled `_connect` call."""
+        if not future.cancelled() and future.exception() is None:
+            cls._close_connection(future.result())
+
+    @staticmethod
+    def _close_connection(connection):
+        """Close a connection, ignoring errors."""
+        close = getattr(connection, "close", None)
+        if close is None:
+            return
+        try:
+            close()
+        except Exception:           # pylint: disable=W0703
+            logger.debug("Error closing connection", exc_info = True)
+
+    def close(self):
+        """Close the idle connections and shut down the executor, if created
+        by this object."""
+        while self._idle:
+            self._close_connection(self._idle.pop())
+        if self._own_executor:
+            self._executor.shutdown()
+
+class CachingPasswordDatabase(object):
+    """Caching, coalescing wrapper of a password database.
+
+    Results are cached by the user name and the requested formats; the
+    authentication properties are passed to the wrapped database on a cache
+    miss, but they are not a part of the cache key. Concurrent lookups are
+    coalesced only within an event loop.
+
+    The result of a lookup which was in progress when `invalidate` was
+    called for its user is returned, but not cached.
+
+    :Ivariables:
+        - `database`: the wrapped database
+        - `coalesced`: number of lookups which waited for a lookup of the
+          same user already in progress
+    """
+    def __init__(self, database, max_size = 10000, ttl = 60,
+                            negative_ttl = 10, negative_max_size = None):
+        """Initialize the cache.
+
+        :Parameters:
+            - `database`: the password database to wrap, synchronous or
+              asynchronous
+            - `max_size`: maximum number of cached results
+            - `ttl`: lifetime of cached results (in seconds), `None` for no
+              expiry
+            - `negative_ttl`: lifetime of cached "no such user" results
+              (in seconds), `None` for no expiry
+            - `negative_max_size`: maximum number of cached "no such user"
+              results, `None` for `max_size`
+        :Types:
+            - `max_size`: `int`
+            - `ttl`: `float`
+            - `negative_ttl`: `float`
+            - `negative_max_size`: `int`
+        """
+        # pylint: disable=R0913
+        self.database = database
+        if negative_max_size is None:
+            negative_max_size = max_size
+        self._cache = LRUCache(max_size, ttl)
+        self._negative_cache = LRUCache(negative_max_size, negative_ttl)
+        self.coalesced = 0
+        self._pending = weakref.WeakKeyDictionary()
+        # [generation, lookups in progress] of the users being looked up
+        self._generations = {}
+        self._generations_lock = threading.Lock()
+
+    async def get_password(self, username, formats, properties):
+        """Look a user up in the cache or in the wrapped database.
+
+        :Parameters:
+            - `username`: the user name
+            - `formats`: acceptable password formats
+            - `properties`: authentication properties
+        :Types:
+            - `formats`: sequence of `unicode`
+            - `properties`: `dict`
+
+        :return: the password and its format
+        :returntype: (`unicode` or `tuple`, `unicode`)
+        """
+        key = (username, tuple(formats))
+        result = self._cache.get(key, count_miss = False)
+        if result is not None:
+            return result
+        if self._negative_cache.get(key) is not None:
+            return None, None
+        self._cache.add_miss()
+        loop = asyncio.get_running_loop()
+        pending = self._pending.get(loop)
+        if pending is None:
+            pending = self._pending.setdefault(loop, {})
+        task = pending.get(key)
+        if task is None:
+            task = loop.create_task(self._lookup(pending, key, properties))
+            pending[key] = task
+        else:
+            self.coalesced += 1
+        # a cancelled caller must not cancel the lookup for the others
+        return await asyncio.shield(task)
+
+    async def _lookup(self, pending, key, properties):
+        """Look a user up in the wrapped database and cache the result,
+        unless the user was invalidated in the meantime."""
+        username, formats = key
+        with self._generations_lock:
+            state = self._generations.setdefault(username, [0, 0])
+            state[1] += 1
+            generation = state[0]
+        try:
+            password, pformat = await get_password(self.database, username,
+                                                        formats, properties)
+        finally:
+            del pending[key]
+            with self._generations_lock:
+                state[1] -= 1
+                if not state[1]:
+                    del self._generations[username]
+                current = state[0] == generation
+        if pformat is None or password is None:
+            if current:
+                self._negative_cache.put(key, True)
+            return None, None
+        if current:
+            self._cache.put(key, (password, pformat))
+        return password, pformat
+
+    def invalidate(self, username = None):
+        """Remove the cached results for a user.
+
+        Call it when the credentials of a user change or a user is created.
+
+        :Parameters:
+            - `username`: the user name, `None` for all
+        """
+        with self._generations_lock:
+            if username is None:
+                states = list(self._generations.values())
+            else:
+                states = [self._generations.get(username, [0, 0])]
+            for state in states:
+                state[0] += 1
+        if username is None:
+            self._cache.clear()
+            self._negative_cache.clear()
+        else:
+            self._cache.remove_if(lambda key: key[0] == username)
+            self._negative_cache.remove_if(lambda key: key[0] == username)
+
+    def stats(self):
+        """Return the cache counters.
+
+        :return: the counters (size, max_size, hits, misses and evictions)
+            of the positive ('found') and the negative ('unknown') cache and
+            the 'coalesced' count. Lookups answered by the negative cache
+            are not counted as misses of the positive one, so the 'found'
+            misses are the lookups passed to the wrapped database
+            (including the coalesced ones).
+        :returntype: `dict`
+        """
+        return {"found": self._cache.stats(),
+                "unknown": self._negative_cache.stats(),
+                "coalesced": self.coalesced}
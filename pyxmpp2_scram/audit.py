@@ -0,0 +1,293 @@
+"""Authentication audit log.
+
+An `AuditLog` given as the ``"SCRAM-audit-log"`` property of
+`SCRAMServerAuthenticator` records an `AuditEvent` for every finished
+server exchange: the mechanism, the user name and authorization id, the
+outcome, the exception class (for failures) and the time since the exchange
+started. Neither the messages nor the proofs, nonces or keys are recorded.
+
+Recording is cheap and does not wait for the sinks: the event is appended
+to a bounded in-memory ring buffer (a `collections.deque`, with a lock held
+only for the append and the update of the counters) and a background
+thread passes the buffered events to the sinks (`LoggingAuditSink`, `FileAuditSink`) every
+`AuditLog.flush_interval` seconds. When the sinks fall behind, the oldest
+events are overwritten and counted in `AuditLog.dropped`.
+
+Events below the `AuditLog.level` are not recorded (successes are logged at
+``INFO``, failures at ``WARNING``) and successes and failures may be sampled
+at different rates; rejected events cost only a comparison. Without the
+property the authenticator does not record anything.
+
+The drain thread is not inherited by forked processes: create the
+`AuditLog` in every worker process.
+
+`redact_message` hides the nonces, proofs, server signatures and channel
+binding data of SCRAM messages, for debug logs.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+__docformat__ = "restructuredtext en"
+
+import io
+import re
+import json
+import time
+import random
+import logging
+import threading
+
+from collections import deque, namedtuple
+
+logger = logging.getLogger("pyxmpp2_scram.audit")
+
+AuditEvent = namedtuple("AuditEvent", "timestamp mechanism side username"
+                            " authzid outcome exception duration")
+
+SUCCESS = "success"
+FAILURE = "failure"
+
+# r=, c= and v= anywhere, p= (the proof) but not in the GS2 header
+_REDACTED_RE = re.compile(br"(^|,)((?:[rcv]|(?<=,)p)=)[^,]*")
+
+def redact_message(message):
+    """Replace the nonce, proof, signature and channel binding attribute
+    values of a SCRAM message with ``...``.
+
+    :Parameters:
+        - `message`: a SCRAM message
+    :Types:
+        - `message`: `bytes`
+
+    :returntype: `bytes`
+    """
+    return _REDACTED_RE.sub(br"\1\2...", message)
+
+class AuditSink(object):
+    """Base class of audit event sinks."""
+    def emit(self, events):
+        """Write audit events. Called from the drain thread only.
+
+        :Parameters:
+            - `events`: the events, oldest first
+        :Types:
+            - `events`: `list` of `AuditEvent`
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release the sink resources."""
+        pass
+
+class LoggingAuditSink(AuditSink):
+    """Passes the audit events to a `logging.Logger`.
+
+    :Ivariables:
+        - `logger`: the logger used
+    """
+    def __init__(self, logger = None): # pylint: disable=W0621
+        if logger is None:
+            logger = logging.getLogger("pyxmpp2_scram.audit.events")
+        self.logger = logger
+
+    def emit(self, events):
+        for event in events:
+            if event.outcome == SUCCESS:
+                self.logger.info("%s %s success for %r (authzid %r), %.6fs",
+                            event.mechanism, event.side, event.username,
+                            event.authzid, event.duration)
+            else:
+                self.logger.warning("%s %s failure (%s) for %r"
+                            " (authzid %r), %.6fs", event.mechanism,
+                            event.side, event.exception, event.username,
+                            event.authzid, event.duration)
+
+class FileAuditSink(AuditSink):
+    """Appends the audit events to a file, as JSON objects, one per line.
+
+    :Ivariables:
+        - `path`: the file name
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = io.open(path, "a", encoding = "utf-8")
+
+    def emit(self, events):
+        lines = []
+        for event in events:
+            lines.append(json.dumps(event._asdict(), sort_keys = True))
+        lines.append("")
+        self._file.write("\n".join(lines))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class AuditLog(object):
+    """Buffers the audit events and drains them to the sinks in
+    a background thread.
+
+    :Ivariables:
+        - `sinks`: the sinks the events are passed to
+        - `capacity`: maximum number of buffered events
+        - `flush_interval`: time (in seconds) between the buffer drains
+        - `recorded`: number of events recorded
+        - `dropped`: number of events overwritten before being drained
+    """
+    # pylint: disable=R0902,R0913
+    def __init__(self, sinks = None, capacity = 65536, level = logging.INFO,
+                        success_sample_rate = 1.0, failure_sample_rate = 1.0,
+                        flush_interval = 1.0):
+        """Initialize the audit log and start the drain thread.
+
+        :Parameters:
+            - `sinks`: the sinks, `None` for a `LoggingAuditSink`
+            - `capacity`: maximum number of buffered events
+            - `level`: minimum level of the recorded events
+            - `success_sample_rate`: fraction of the successful exchanges
+              recorded
+            - `failure_sample_rate`: fraction of the failed exchanges
+              recorded
+            - `flush_interval`: time (in seconds) between the buffer drains
+        :Types:
+            - `sinks`: `list` of `AuditSink`
+            - `capacity`: `int`
+            - `level`: `int`
+            - `success_sample_rate`: `float`
+            - `failure_sample_rate`: `float`
+            - `flush_interval`: `float`
+        """
+        if sinks is None:
+            sinks = [LoggingAuditSink()]
+        self.sinks = list(sinks)
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.recorded = 0
+        self.dropped = 0
+        self._buffer = deque(maxlen = capacity)
+        self._record_lock = threading.Lock()
+        self._success_sample_rate = success_sample_rate
+        self._failure_sample_rate = failure_sample_rate
+        self._success_rate = 0.0
+        self._failure_rate = 0.0
+        self._level = None
+        self.level = level
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target = self._run,
+                                                name = "SCRAM audit log")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def level(self):
+        """Minimum level of the recorded events."""
+        return self._level
+
+    @level.setter
+    def level(self, level):
+        """Change the minimum level of the recorded events."""
+        self._level = level
+        if level <= logging.INFO:
+            self._success_rate = self._success_sample_rate
+        else:
+            self._success_rate = 0.0
+        if level <= logging.WARNING:
+            self._failure_rate = self._failure_sample_rate
+        else:
+            self._failure_rate = 0.0
+
+    def success(self, mechanism, side, username, authzid, duration):
+        """Record a successful exchange.
+
+        :Parameters:
+            - `mechanism`: the mechanism name
+            - `side`: ``"client"`` or ``"server"``
+            - `username`: the authenticated user name
+            - `authzid`: the authorization id requested
+            - `duration`: the exchange duration (in seconds)
+        """
+        rate = self._success_rate
+        if rate < 1.0 and (rate <= 0.0 or random.random() >= rate):
+            return
+        self._record(AuditEvent(time.time(), mechanism, side, username,
+                                        authzid, SUCCESS, None, duration))
+
+    def failure(self, mechanism, side, username, authzid, exception,
+                                                                duration):
+        """Record a failed exchange.
+
+        :Parameters:
+            - `mechanism`: the mechanism name
+            - `side`: ``"client"`` or ``"server"``
+            - `username`: the user name, if already known
+            - `authzid`: the authorization id, if already known
+            - `exception`: the exception raised
+            - `duration`: the exchange duration (in seconds)
+        """
+        rate = self._failure_rate
+        if rate < 1.0 and (rate <= 0.0 or random.random() >= rate):
+            return
+        self._record(AuditEvent(time.time(), mechanism, side, username,
+                        authzid, FAILURE, exception.__class__.__name__,
+                        duration))
+
+    def _record(self, event):
+        """Append an event to the ring buffer."""
+        buf = self._buffer
+        with self._record_lock:
+            if len(buf) >= self.capacity:
+                self.dropped += 1
+            buf.append(event)
+            self.recorded += 1
+
+    def _run(self):
+        """The drain thread loop."""
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        """Pass the buffered events to the sinks now.
+
+        :return: number of events passed
+        :returntype: `int`
+        """
+        # pylint: disable=W0703
+        with self._flush_lock:
+            buf = self._buffer
+            events = []
+            try:
+                while True:
+                    events.append(buf.popleft())
+            except IndexError:
+                pass
+            if not events:
+                return 0
+            for sink in self.sinks:
+                try:
+                    sink.emit(events)
+                except Exception:
+                    logger.exception("Audit sink %r failed", sink)
+            return len(events)
+
+    def close(self):
+        """Stop the drain thread, drain the remaining events and close the
+        sinks."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join()
+        for sink in self.sinks:
+            sink.close()
+
+    def stats(self):
+        """Return the audit log statistics.
+
+        :return: dictionary with 'recorded', 'dropped' and 'buffered'
+            event counts
+        :returntype: `dict`
+        """
+        with self._record_lock:
+            return {"recorded": self.recorded, "dropped": self.dropped,
+                                            "buffered": len(self._buffer)}
@@ -0,0 +1,269 @@
+"""Processing of many server-side SCRAM exchanges at once.
+
+`SCRAMServerBatch` drives a group of `SCRAMServerAuthenticator` objects
+through their steps together:
+
+  - the password database is queried once for all the users, with its
+    ``get_passwords`` method if it has one,
+  - identical Hi() computations (same hash, password, salt and iteration
+    count) are done only once -- plain passwords and the dummy credentials
+    of unknown users get a random salt per exchange, so this happens only
+    when a fixed ``"SCRAM-salt"`` property is given,
+  - the remaining Hi() computations are spread over an executor.
+
+The result for every exchange, including exceptions raised, is the same as
+from the `SCRAMServerAuthenticator.response` method. An exception raised
+for one exchange (e.g. by its Hi() computation) fails only that exchange
+(and the ones sharing the computation).
+
+The exchanges are reported to the instrumentation and the audit log given
+in their properties like by `SCRAMServerAuthenticator.response`, except
+that the ``"lookup"`` and ``"kdf"`` phases, shared by the whole batch, are
+not timed.
+
+A password database supporting bulk lookups provides::
+
+    get_passwords(usernames, formats, properties_list)
+
+returning a list of ``(password, pformat)`` pairs, one for each user name,
+where ``properties_list`` contains the properties the ``get_password``
+method would get for each of the users.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+__docformat__ = "restructuredtext en"
+
+import logging
+
+from collections import namedtuple
+from functools import partial
+
+from . import kdf
+from .audit import redact_message
+from .scram import SCRAMServerAuthenticator
+
+logger = logging.getLogger("pyxmpp2_scram.batch")
+
+class BatchResult(namedtuple("BatchResult", "authenticator result error")):
+    """Result of a single exchange step of a batch.
+
+    :Ivariables:
+        - `authenticator`: the authenticator of the exchange
+        - `result`: the value returned by `SCRAMServerAuthenticator.response`,
+          or `None` on error
+        - `error`: the exception raised, or `None`
+    """
+    # pylint: disable=R0903
+    __slots__ = ()
+
+def _failure(authenticator, error):
+    """Report a failed exchange step and make its result.
+
+    :returntype: `BatchResult`
+    """
+    authenticator._report_failure(error) # pylint: disable=W0212
+    return BatchResult(authenticator, None, error)
+
+class SCRAMServerBatch(object):
+    """Runs the server side of many SCRAM exchanges together.
+
+    :Ivariables:
+        - `hash_name`: hash function name, e.g. ``"SHA-1"``
+        - `channel_binding`: `True` for the -PLUS variant
+        - `password_database`: the password database
+        - `executor`: executor for the Hi() computations
+    """
+    # pylint: disable=R0913
+    def __init__(self, hash_name, channel_binding, password_database,
+                                        executor = None, kdf_backend = None):
+        """Initialize the batch processor.
+
+        :Parameters:
+            - `hash_name`: hash function name, e.g. ``"SHA-1"``
+            - `channel_binding`: `True` to enable channel binding
+            - `password_database`: the password database
+            - `executor`: a `concurrent.futures.Executor` for the Hi()
+              computations, `None` to create one with `kdf.create_executor`
+            - `kdf_backend`: Hi() implementation, `None` for the default
+        :Types:
+            - `hash_name`: `unicode`
+            - `channel_binding`: `bool`
+            - `kdf_backend`: `unicode` or `kdf.KDFBackend`
+        """
+        self.hash_name = hash_name
+        self.channel_binding = channel_binding
+        self.password_database = password_database
+        self.kdf_backend = kdf.get_backend(kdf_backend)
+        self._own_executor = executor is None
+        if executor is None:
+            executor = kdf.create_executor(self.kdf_backend)
+        self.executor = executor
+
+    def shutdown(self, wait = True):
+        """Shut down the executor, if created by this object."""
+        if self._own_executor:
+            self.executor.shutdown(wait)
+
+    def start(self, exchanges):
+        """Start new exchanges.
+
+        :Parameters:
+            - `exchanges`: ``(properties, initial_response)`` pairs, as for
+              `SCRAMServerAuthenticator.start`
+        :Types:
+            - `exchanges`: iterable of (`dict`, `bytes`)
+
+        :return: the results, in the order of `exchanges`
+        :returntype: `list` of `BatchResult`
+        """
+        items = []
+        results = []
+        for properties, initial_response in exchanges:
+            authenticator = SCRAMServerAuthenticator(self.hash_name,
+                                    self.channel_binding,
+                                    self.password_database, self.kdf_backend)
+            authenticator._reset(properties)
+            if initial_response:
+                items.append((len(results), authenticator, initial_response))
+                results.append(None)
+            else:
+                results.append(BatchResult(authenticator, b"", None))
+        for (index, _, _), result in zip(items,
+                        self.responses([item[1:] for item in items])):
+            results[index] = result
+        return results
+
+    def responses(self, exchanges):
+        """Process client responses of started exchanges.
+
+        Both first and final client messages may be mixed in one call.
+
+        :Parameters:
+            - `exchanges`: ``(authenticator, response)`` pairs
+        :Types:
+            - `exchanges`: iterable of (`SCRAMServerAuthenticator`, `bytes`)
+
+        :return: the results, in the order of `exchanges`
+        :returntype: `list` of `BatchResult`
+        """
+        # pylint: disable=W0212,W0703
+        results = []
+        first = []
+        for authenticator, response in exchanges:
+            if authenticator._client_first_message_bare:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Client final message: %r",
+                                                redact_message(response))
+                try:
+                    result = authenticator._timed("verify",
+                            authenticator._handle_final_response, response)
+                except Exception as err:
+                    results.append(_failure(authenticator, err))
+                    continue
+                authenticator._report_success()
+                results.append(BatchResult(authenticator, result, None))
+                continue
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Client first message: %r",
+                                                redact_message(response))
+            try:
+                username, properties = authenticator._timed("parse",
+                            authenticator._parse_first_response, response)
+            except Exception as err:
+                results.append(_failure(authenticator, err))
+                continue
+            first.append((len(results), authenticator, username, properties))
+            results.append(None)
+        if first:
+            for index, result in self._handle_first_responses(first):
+                results[index] = result
+        return results
+
+    def _get_passwords(self, lookups):
+        """Query the password database for all users.
+
+        :Parameters:
+            - `lookups`: (authenticator, username, properties) tuples
+        :return: ``(password, pformat)`` for each lookup, or the exception
+            raised by the password database
+        """
+        # pylint: disable=W0703
+        by_formats = {}
+        for index, (authenticator, username, properties) in enumerate(lookups):
+            formats = authenticator._password_formats # pylint: disable=W0212
+            by_formats.setdefault(formats, []).append(
+                                                (index, username, properties))
+        passwords = [None] * len(lookups)
+        bulk = getattr(self.password_database, "get_passwords", None)
+        for formats, group in by_formats.items():
+            if bulk is not None:
+                try:
+                    group_result = bulk([item[1] for item in group], formats,
+                                                [item[2] for item in group])
+                except Exception as err:
+                    group_result = [err] * len(group)
+            else:
+                group_result = []
+                for _, username, properties in group:
+                    try:
+                        group_result.append(
+                                self.password_database.get_password(
+                                            username, formats, properties))
+                    except Exception as err:
+                        group_result.append(err)
+            for (index, _, _), password in zip(group, group_result):
+                passwords[index] = password
+        return passwords
+
+    def _handle_first_responses(self, first):
+        """Finish processing of the client first messages.
+
+        :Parameters:
+            - `first`: (index, authenticator, username, properties) tuples
+              for the parsed messages
+
+        :return: (index, result) pairs
+        """
+        # pylint: disable=W0212,W0703
+        passwords = self._get_passwords([item[1:] for item in first])
+        prepared = []
+        jobs = {}
+        for (index, authenticator, username, _), lookup in zip(first,
+                                                                passwords):
+            try:
+                if isinstance(lookup, Exception):
+                    raise lookup
+                password, pformat = lookup
+                pending = authenticator._prepare_keys(username, password,
+                                                                    pformat)
+            except Exception as err:
+                yield index, _failure(authenticator, err)
+                continue
+            if pending.password is not None:
+                job = (authenticator.digest_name, pending.password,
+                                    pending.salt, pending.iteration_count)
+                jobs.setdefault(job, None)
+            else:
+                job = None
+            prepared.append((index, authenticator, pending, job))
+
+        if jobs:
+            if kdf.is_process_pool(self.executor):
+                derive = partial(kdf.pbkdf2, backend = self.kdf_backend.name)
+            else:
+                derive = self.kdf_backend.derive
+            for job in jobs:
+                jobs[job] = self.executor.submit(derive, *job)
+
+        for index, authenticator, pending, job in prepared:
+            try:
+                if job is not None:
+                    # raises the exception of a failed computation
+                    pending.set_salted_password(authenticator,
+                                                        jobs[job].result())
+                result = authenticator._build_server_first_message(pending)
+            except Exception as err:
+                yield index, _failure(authenticator, err)
+                continue
+            yield index, BatchResult(authenticator, result, None)
@@ -0,0 +1,334 @@
+"""TLS channel binding data for the SCRAM-*-PLUS mechanisms.
+
+The ``"channel-binding"`` property of the authenticators maps channel
+binding types to their data for the current TLS connection. The functions
+here build it from an `ssl.SSLSocket` or `ssl.SSLObject`:
+
+  - ``tls-unique`` (RFC 5929) -- from `ssl.SSLSocket.get_channel_binding`
+    (not defined for TLS 1.3),
+  - ``tls-exporter`` (RFC 9266) -- if the TLS object provides
+    ``export_keying_material`` (the standard library `ssl` module does not),
+  - ``tls-server-end-point`` (RFC 5929) -- the hash of the server
+    certificate, with the hash function chosen by the certificate signature
+    algorithm. It is computed once per certificate.
+
+The result is a `ChannelBindingData` dictionary, which also keeps the base64
+``c=`` attribute values the client sends, so the server checks the client
+final message with a single comparison and the client does not encode them
+on every login. For ``tls-server-end-point`` the values are shared by all
+the connections using the same certificate.
+
+Server::
+
+    binding = ServerChannelBinding(certificate_der)
+    ...
+    properties["channel-binding"] = binding.for_connection(ssl_socket)
+
+Client::
+
+    properties["channel-binding"] = client_channel_binding(ssl_socket)
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+__docformat__ = "restructuredtext en"
+
+import ssl
+import hashlib
+import logging
+
+from base64 import standard_b64encode
+
+logger = logging.getLogger("pyxmpp2_scram.binding")
+
+# hashlib names of the hashes used by certificate signature algorithms
+_SIGNATURE_HASHES = {
+    "1.2.840.113549.1.1.4": "md5",          # md5WithRSAEncryption
+    "1.2.840.113549.1.1.5": "sha1",         # sha1WithRSAEncryption
+    "1.2.840.113549.1.1.14": "sha224",      # sha224WithRSAEncryption
+    "1.2.840.113549.1.1.11": "sha256",      # sha256WithRSAEncryption
+    "1.2.840.113549.1.1.12": "sha384",      # sha384WithRSAEncryption
+    "1.2.840.113549.1.1.13": "sha512",      # sha512WithRSAEncryption
+    "1.2.840.10045.4.1": "sha1",            # ecdsa-with-SHA1
+    "1.2.840.10045.4.3.1": "sha224",        # ecdsa-with-SHA224
+    "1.2.840.10045.4.3.2": "sha256",        # ecdsa-with-SHA256
+    "1.2.840.10045.4.3.3": "sha384",        # ecdsa-with-SHA384
+    "1.2.840.10045.4.3.4": "sha512",        # ecdsa-with-SHA512
+    "1.2.840.10040.4.3": "sha1",            # dsa-with-sha1
+    "2.16.840.1.101.3.4.3.1": "sha224",     # dsa-with-sha224
+    "2.16.840.1.101.3.4.3.2": "sha256",     # dsa-with-sha256
+    }
+
+# hash algorithm identifiers (used in the RSASSA-PSS parameters)
+_HASHES = {
+    "1.3.14.3.2.26": "sha1",
+    "2.16.840.1.101.3.4.2.4": "sha224",
+    "2.16.840.1.101.3.4.2.1": "sha256",
+    "2.16.840.1.101.3.4.2.2": "sha384",
+    "2.16.840.1.101.3.4.2.3": "sha512",
+    }
+
+_RSASSA_PSS = "1.2.840.113549.1.1.10"
+
+_SEQUENCE = 0x30
+_OID = 0x06
+_PSS_HASH_ALGORITHM = 0xa0
+
+EXPORTER_LABEL = b"EXPORTER-Channel-Binding"
+
+def _read_tlv(data, pos):
+    """Read a DER tag and length.
+
+    :return: the tag, the start and the end of the value
+    :returntype: (`int`, `int`, `int`)
+    :raises ValueError: on malformed data
+    """
+    if pos + 2 > len(data):
+        raise ValueError("Truncated DER data")
+    tag = bytearray(data[pos:pos + 2])
+    length = tag[1]
+    pos += 2
+    if length & 0x80:
+        count = length & 0x7f
+        if not 0 < count <= 4 or pos + count > len(data):
+            raise ValueError("Bad DER length")
+        length = 0
+        for byte in bytearray(data[pos:pos + count]):
+            length = (length << 8) | byte
+        pos += count
+    if pos + length > len(data):
+        raise ValueError("Truncated DER data")
+    return tag[0], pos, pos + length
+
+def _decode_oid(data):
+    """Decode DER object identifier contents to the dotted notation."""
+    data = bytearray(data)
+    if not data:
+        raise ValueError("Empty object identifier")
+    arcs = [min(data[0] // 40, 2), 0]
+    arcs[1] = data[0] - 40 * arcs[0]
+    value = 0
+    for byte in data[1:]:
+        value = (value << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            arcs.append(value)
+            value = 0
+    return ".".join(str(arc) for arc in arcs)
+
+def _read_algorithm(data, pos):
+    """Read an AlgorithmIdentifier.
+
+    :return: the algorithm OID, the start and the end of the parameters
+    :returntype: (`unicode`, `int`, `int`)
+    """
+    tag, start, end = _read_tlv(data, pos)
+    if tag != _SEQUENCE:
+        raise ValueError("AlgorithmIdentifier expected")
+    tag, oid_start, oid_end = _read_tlv(data, start)
+    if tag != _OID:
+        raise ValueError("Object identifier expected")
+    return _decode_oid(data[oid_start:oid_end]), oid_end, end
+
+def certificate_hash_name(certificate):
+    """Choose the hash for the ``tls-server-end-point`` channel binding of
+    a certificate.
+
+    As required by RFC 5929, this is the hash used by the certificate
+    signature algorithm, except that SHA-256 is used instead of MD5 and
+    SHA-1. SHA-256 is also used for signature algorithms with no single hash
+    (e.g. Ed25519).
+
+    :Parameters:
+        - `certificate`: the certificate, DER-encoded
+    :Types:
+        - `certificate`: `bytes`
+
+    :return: `hashlib` name of the hash
+    :returntype: `unicode`
+    :raises ValueError: if the certificate cannot be parsed
+    """
+    tag, start, _ = _read_tlv(certificate, 0)
+    if tag != _SEQUENCE:
+        raise ValueError("Not a DER-encoded certificate")
+    # skip tbsCertificate
+    _, _, tbs_end = _read_tlv(certificate, start)
+    algorithm, params_start, params_end = _read_algorithm(certificate,
+                                                                    tbs_end)
+    if algorithm == _RSASSA_PSS:
+        # the default hash of RSASSA-PSS is SHA-1
+        hash_name = "sha1"
+        if params_start < params_end:
+            tag, start, end = _read_tlv(certificate, params_start)
+        else:
+            tag = None
+        if tag == _SEQUENCE and start < end:
+            tag, start, _ = _read_tlv(certificate, start)
+            if tag == _PSS_HASH_ALGORITHM:
+                hash_name = _HASHES.get(_read_algorithm(certificate,
+                                                            start)[0])
+    else:
+        hash_name = _SIGNATURE_HASHES.get(algorithm)
+    if hash_name is None:
+        logger.debug("No hash for signature algorithm %s, using SHA-256",
+                                                                algorithm)
+        return "sha256"
+    if hash_name in ("md5", "sha1"):
+        return "sha256"
+    return hash_name
+
+# ``tls-server-end-point`` data by certificate
+_end_points = {}
+_MAX_END_POINTS = 64
+
+def tls_server_end_point(certificate):
+    """Compute the ``tls-server-end-point`` channel binding data.
+
+    The result is cached per certificate.
+
+    :Parameters:
+        - `certificate`: the server certificate, DER-encoded
+    :Types:
+        - `certificate`: `bytes`
+
+    :returntype: `bytes`
+    """
+    data = _end_points.get(certificate)
+    if data is None:
+        data = hashlib.new(certificate_hash_name(certificate),
+                                                    certificate).digest()
+        if len(_end_points) >= _MAX_END_POINTS:
+            _end_points.clear()
+        _end_points[certificate] = data
+    return data
+
+def tls_exporter(ssl_object):
+    """Get the ``tls-exporter`` channel binding data, if the TLS object
+    supports keying material export.
+
+    :returntype: `bytes` or `None`
+    """
+    export = getattr(ssl_object, "export_keying_material", None)
+    if export is None:
+        return None
+    return export(EXPORTER_LABEL, 32, b"")
+
+class ChannelBindingData(dict):
+    """Channel binding data by channel binding type, with the base64 'c='
+    attribute values cached.
+
+    May be used as the ``"channel-binding"`` property of the authenticators
+    like a plain dictionary.
+    """
+    def __init__(self, data = (), shared_values = None):
+        """Initialize the channel binding data.
+
+        :Parameters:
+            - `data`: channel binding data by type
+            - `shared_values`: cached 'c=' values to share with other
+              connections, by channel binding type. The values are
+              cached by the GS2 header and the channel binding data, so
+              connections with different data may share them.
+        :Types:
+            - `data`: `dict`
+            - `shared_values`: `dict` of `dict`
+        """
+        dict.__init__(self, data)
+        self._values = shared_values if shared_values is not None else {}
+
+    def cb_value(self, cb_type, gs2_header):
+        """Get the base64 value of the client final message 'c=' attribute.
+
+        :Parameters:
+            - `cb_type`: the channel binding type
+            - `gs2_header`: the GS2 header of the exchange
+        :Types:
+            - `cb_type`: `unicode`
+            - `gs2_header`: `bytes`
+
+        :returntype: `bytes`
+        """
+        values = self._values.get(cb_type)
+        if values is None:
+            values = self._values.setdefault(cb_type, {})
+        data = self[cb_type]
+        key = (gs2_header, data)
+        value = values.get(key)
+        if value is None:
+            value = standard_b64encode(gs2_header + data)
+            if len(values) >= 16:
+                values.clear()
+            values[key] = value
+        return value
+
+def _connection_data(ssl_object):
+    """Get the connection-specific channel binding data."""
+    data = {}
+    # tls-unique is not defined for TLS 1.3 (RFC 9266), though OpenSSL
+    # returns some data
+    if ssl_object.version() == "TLSv1.3":
+        unique = None
+    else:
+        try:
+            unique = ssl_object.get_channel_binding("tls-unique")
+        except ValueError:
+            unique = None
+    if unique:
+        data["tls-unique"] = unique
+    exporter = tls_exporter(ssl_object)
+    if exporter:
+        data["tls-exporter"] = exporter
+    return data
+
+class ServerChannelBinding(object):
+    """Server-side channel binding data for a server certificate.
+
+    :Ivariables:
+        - `end_point`: the ``tls-server-end-point`` data
+    """
+    # pylint: disable=R0903
+    def __init__(self, certificate):
+        """Compute the certificate channel binding data.
+
+        :Parameters:
+            - `certificate`: the server certificate, DER or PEM encoded
+        :Types:
+            - `certificate`: `bytes` or `unicode`
+        """
+        if not isinstance(certificate, bytes) \
+                                or certificate.startswith(b"-----BEGIN"):
+            if isinstance(certificate, bytes):
+                certificate = certificate.decode("ascii")
+            certificate = ssl.PEM_cert_to_DER_cert(certificate)
+        self.end_point = tls_server_end_point(certificate)
+        self._end_point_values = {}
+
+    def for_connection(self, ssl_object):
+        """Get the channel binding data for a connection.
+
+        :Parameters:
+            - `ssl_object`: the TLS connection
+        :Types:
+            - `ssl_object`: `ssl.SSLSocket` or `ssl.SSLObject`
+
+        :returntype: `ChannelBindingData`
+        """
+        data = _connection_data(ssl_object)
+        data["tls-server-end-point"] = self.end_point
+        return ChannelBindingData(data,
+                        {"tls-server-end-point": self._end_point_values})
+
+def client_channel_binding(ssl_object):
+    """Get the client-side channel binding data for a connection.
+
+    :Parameters:
+        - `ssl_object`: the TLS connection
+    :Types:
+        - `ssl_object`: `ssl.SSLSocket` or `ssl.SSLObject`
+
+    :returntype: `ChannelBindingData`
+    """
+    data = _connection_data(ssl_object)
+    certificate = ssl_object.getpeercert(True)
+    if certificate:
+        data["tls-server-end-point"] = tls_server_end_point(certificate)
+    return ChannelBindingData(data)
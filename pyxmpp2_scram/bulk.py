@@ -0,0 +1,195 @@
+"""Bulk SCRAM key derivation.
+
+Deriving the credentials of many users (e.g. when importing a legacy
+password database) one `SCRAMOperations.Hi` call at a time leaves all but
+one CPU idle. `BulkDeriver` takes a stream of (hash name, password, salt,
+iteration count) jobs, groups them into batches (so the per-job executor
+overhead and, for process pools, the inter-process communication is paid
+once per batch) and runs the batches on all CPUs, yielding the
+(SaltedPassword, StoredKey, ServerKey) results in input order.
+
+Only a bounded number of batches is in progress at any time, so the input
+may be an arbitrarily large iterator (e.g. rows read from a database
+cursor) -- it is consumed only as fast as the results are.
+
+The keys are computed with the same `SCRAMOperations` code as in
+a SCRAM exchange, so they are identical to the ones a server would compute
+from the plain-text password.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+__docformat__ = "restructuredtext en"
+
+import os
+
+from collections import deque
+
+from . import kdf
+from .scram import SCRAMOperations, derive_keys
+
+def derive_batch(jobs, backend = None):
+    """Compute SaltedPassword, StoredKey and ServerKey for a batch of
+    passwords.
+
+    :Parameters:
+        - `jobs`: (hash_name, password, salt, iteration_count) tuples
+        - `backend`: KDF backend name or instance, `None` for the default
+          one. Only a registered backend name may be passed to another
+          process.
+    :Types:
+        - `jobs`: `list`
+        - `backend`: `unicode` or `kdf.KDFBackend`
+
+    :return: (salted_password, stored_key, server_key) for each job
+    :returntype: `list` of `tuple` of `bytes`
+    """
+    operations = {}
+    results = []
+    for hash_name, password, salt, iteration_count in jobs:
+        ops = operations.get(hash_name)
+        if ops is None:
+            ops = SCRAMOperations(hash_name, backend)
+            operations[hash_name] = ops
+        salted_password = ops.Hi(ops.Normalize(password), salt,
+                                                            iteration_count)
+        client_key, server_key = derive_keys(ops, salted_password)
+        results.append((salted_password, ops.H(client_key), server_key))
+    return results
+
+class BulkDeriver(object):
+    """Derives SCRAM keys for many passwords in parallel.
+
+    :Ivariables:
+        - `kdf_backend`: the `kdf.KDFBackend` used
+        - `batch_size`: number of jobs sent to a worker at once
+        - `max_pending`: maximum number of batches in progress
+    """
+    def __init__(self, executor = None, kdf_backend = None,
+                                    batch_size = 64, max_pending = None):
+        """Initialize the deriver.
+
+        :Parameters:
+            - `executor`: a `concurrent.futures.Executor`, `None` to create
+              one with `kdf.create_executor` for every `derive` call
+            - `kdf_backend`: Hi() implementation, `None` for the default
+            - `batch_size`: number of jobs sent to a worker at once
+            - `max_pending`: maximum number of batches in progress, `None`
+              for twice the number of CPUs
+        :Types:
+            - `executor`: `concurrent.futures.Executor`
+            - `kdf_backend`: `unicode` or `kdf.KDFBackend`
+            - `batch_size`: `int`
+            - `max_pending`: `int`
+        """
+        self.kdf_backend = kdf.get_backend(kdf_backend)
+        self.batch_size = batch_size
+        if max_pending is None:
+            max_pending = 2 * kdf.cpu_count()
+        self.max_pending = max_pending
+        self._executor = executor
+
+    def derive(self, jobs):
+        """Derive the keys for a stream of jobs.
+
+        :Parameters:
+            - `jobs`: (hash_name, password, salt, iteration_count) tuples
+        :Types:
+            - `jobs`: iterable
+
+        :return: generator of (salted_password, stored_key, server_key)
+            tuples, in the order of `jobs`
+        """
+        executor = self._executor
+        own_executor = executor is None
+        if own_executor:
+            executor = kdf.create_executor(self.kdf_backend)
+        if kdf.is_process_pool(executor):
+            backend = self.kdf_backend.name
+        else:
+            backend = self.kdf_backend
+        pending = deque()
+        try:
+            jobs = iter(jobs)
+            while True:
+                batch = []
+                for job in jobs:
+                    batch.append(job)
+                    if len(batch) >= self.batch_size:
+                        break
+                if batch:
+                    pending.append(executor.submit(derive_batch, batch,
+                                                                    backend))
+                if not pending:
+                    break
+                if batch and len(pending) < self.max_pending:
+                    continue
+                for result in pending.popleft().result():
+                    yield result
+        finally:
+            for future in pending:
+                future.cancel()
+            if own_executor:
+                executor.shutdown()
+
+    def derive_hash(self, hash_name, items):
+        """Derive the keys for passwords for a single hash.
+
+        :Parameters:
+            - `hash_name`: SCRAM hash name, e.g. ``"SHA-1"``
+            - `items`: (password, salt, iteration_count) tuples
+        :Types:
+            - `hash_name`: `unicode`
+            - `items`: iterable
+
+        :return: generator of (salted_password, stored_key, server_key)
+            tuples, in the order of `items`
+        """
+        return self.derive((hash_name, password, salt, iteration_count)
+                            for password, salt, iteration_count in items)
+
+def derive_users(deriver, items, hash_names, iteration_counts, salt_size):
+    """Derive the credentials of users for several hashes, with fresh
+    random salts.
+
+    :Parameters:
+        - `deriver`: the deriver to use
+        - `items`: (username, password) pairs
+        - `hash_names`: SCRAM hash names
+        - `iteration_counts`: iteration count for each hash name
+        - `salt_size`: size of the generated salts
+    :Types:
+        - `deriver`: `BulkDeriver`
+        - `items`: iterable
+        - `hash_names`: sequence of `unicode`
+        - `iteration_counts`: `dict`
+        - `salt_size`: `int`
+
+    :return: generator of (username, credentials) pairs, where the
+        credentials map hash names to (salt, iteration_count, stored_key,
+        server_key) tuples
+    """
+    # pylint: disable=R0913
+    hash_names = tuple(hash_names)
+    in_progress = deque()
+    def jobs():
+        """Generate the jobs, remembering the users and salts."""
+        for username, password in items:
+            salts = [os.urandom(salt_size) for _ in hash_names]
+            in_progress.append((username, salts))
+            for hash_name, salt in zip(hash_names, salts):
+                yield (hash_name, password, salt, iteration_counts[hash_name])
+    results = deriver.derive(jobs())
+    while True:
+        credentials = {}
+        for hash_name in hash_names:
+            try:
+                _, stored_key, server_key = next(results)
+            except StopIteration:
+                return
+            if not credentials:
+                username, salts = in_progress.popleft()
+            credentials[hash_name] = (salts[len(credentials)],
+                                        iteration_counts[hash_name],
+                                        stored_key, server_key)
+        yield username, credentials
@@ -0,0 +1,306 @@
+"""Cache of keys derived from passwords by SCRAM clients.
+
+The ClientKey and ServerKey of a client depend only on the password, the
+salt and the iteration count, which stay the same as long as the server
+credentials do not change.  A `KeyCache` remembers them, so reconnecting
+clients do not have to repeat the expensive Hi() computation.
+
+The cache is opt-in: pass a `KeyCache` as the ``"SCRAM-key-cache"``
+property to `SCRAMClientAuthenticator.start`, or enable a process-wide one
+with `enable_process_key_cache`.
+
+`LRUCache`, the bounded LRU cache with expiry `KeyCache` is built on, is
+also used by the other caches of the package.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+__docformat__ = "restructuredtext en"
+
+import os
+import time
+import hmac
+import hashlib
+import threading
+
+from collections import OrderedDict
+
+_clock = getattr(time, "monotonic", time.time)
+
+class LRUCache(object):
+    """Bounded, thread-safe LRU cache with optional expiry.
+
+    The building block of the caches in this package. Expired entries are
+    dropped when they are looked up and, from the least recently used end,
+    when new ones are added.
+
+    :Ivariables:
+        - `max_size`: maximum number of entries
+        - `ttl`: default time (in seconds) after which entries expire,
+          `None` for no expiry
+        - `hits`: number of lookups answered from the cache
+        - `misses`: number of lookups not answered from the cache
+        - `evictions`: number of entries removed because of size or age
+    """
+    def __init__(self, max_size = 1024, ttl = None):
+        """Initialize the cache.
+
+        :Parameters:
+            - `max_size`: maximum number of entries
+            - `ttl`: entry lifetime in seconds or `None`
+        :Types:
+            - `max_size`: `int`
+            - `ttl`: `float`
+        """
+        if max_size < 1:
+            raise ValueError("Cache size must be positive")
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, key, now):
+        """Find a valid entry. Must be called with the lock held."""
+        try:
+            expires, value = self._entries[key]
+        except KeyError:
+            return None
+        if expires is not None and expires <= now:
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        self._entries[key] = self._entries.pop(key)
+        return value
+
+    def _store(self, key, value, now, ttl):
+        """Add an entry. Must be called with the lock held."""
+        entries = self._entries
+        expires = now + ttl if ttl is not None else None
+        entries.pop(key, None)
+        entries[key] = (expires, value)
+        while len(entries) > self.max_size:
+            entries.popitem(last = False)
+            self.evictions += 1
+        while entries:
+            oldest = next(iter(entries))
+            oldest_expires = entries[oldest][0]
+            if oldest_expires is None or oldest_expires > now:
+                break
+            del entries[oldest]
+            self.evictions += 1
+
+    def get(self, key, count_miss = True):
+        """Get a cached value.
+
+        :Parameters:
+            - `key`: the key
+            - `count_miss`: `False` to leave a miss uncounted, so it may be
+              counted with `add_miss` only if the lookup is not answered
+              otherwise
+        :Types:
+            - `count_miss`: `bool`
+
+        :return: the value or `None` if not found or expired
+        """
+        with self._lock:
+            value = self._lookup(key, _clock())
+            if value is not None:
+                self.hits += 1
+            elif count_miss:
+                self.misses += 1
+            return value
+
+    def add_miss(self):
+        """Count a miss of a `get` called with ``count_miss = False``."""
+        with self._lock:
+            self.misses += 1
+
+    def put(self, key, value, ttl = None):
+        """Store a value, dropping the least recently used ones above
+        `max_size`.
+
+        :Parameters:
+            - `key`: the key
+            - `value`: the value, not `None`
+            - `ttl`: lifetime of the entry (in seconds), `None` for `ttl`
+        :Types:
+            - `ttl`: `float`
+        """
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._store(key, value, _clock(), ttl)
+
+    def pop(self, key):
+        """Remove a value from the cache and return it.
+
+        :return: the value or `None` if not found or expired
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires is not None and expires <= _clock():
+            return None
+        return value
+
+    def remove_if(self, predicate):
+        """Remove the entries with matching keys.
+
+        :Parameters:
+            - `predicate`: function called with a key, returning `True` if
+              its entry should be removed
+
+        :return: number of entries removed
+        :returntype: `int`
+        """
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return the cache counters.
+
+        :returntype: `dict`
+        """
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size,
+                        "hits": self.hits, "misses": self.misses,
+                        "evictions": self.evictions}
+
+class KeyCache(LRUCache):
+    """Bounded LRU cache of (ClientKey, ServerKey) pairs with optional
+    expiry.
+
+    Entries are keyed by (hash name, username, password fingerprint, salt,
+    iteration count). The password fingerprint is a HMAC keyed with a random
+    per-cache secret, so the cache keys can not be used to verify password
+    guesses offline.
+
+    Concurrent lookups of the same missing key compute the value only once,
+    the other threads wait for the result.
+    """
+    def __init__(self, max_size = 1024, ttl = None):
+        """Initialize the cache.
+
+        :Parameters:
+            - `max_size`: maximum number of entries
+            - `ttl`: entry lifetime in seconds or `None`
+        :Types:
+            - `max_size`: `int`
+            - `ttl`: `float`
+        """
+        LRUCache.__init__(self, max_size, ttl)
+        self._secret = os.urandom(32)
+        self._pending = {}
+
+    def make_key(self, hash_name, username, password, salt, iteration_count):
+        """Build a cache key.
+
+        :Parameters:
+            - `hash_name`: SCRAM hash name, e.g. ``"SHA-1"``
+            - `username`: the user name
+            - `password`: the normalized password
+            - `salt`: the salt
+            - `iteration_count`: the iteration count
+        :Types:
+            - `hash_name`: `unicode`
+            - `username`: `unicode`
+            - `password`: `bytes`
+            - `salt`: `bytes`
+            - `iteration_count`: `int`
+        """
+        # pylint: disable=R0913
+        fingerprint = hmac.new(self._secret, password,
+                                                hashlib.sha256).digest()
+        return (hash_name, username, fingerprint, salt, iteration_count)
+
+    def get_or_compute(self, key, compute):
+        """Get a cached value or compute and store it.
+
+        :Parameters:
+            - `key`: key created by `make_key`
+            - `compute`: function returning the value
+        """
+        with self._lock:
+            while True:
+                value = self._lookup(key, _clock())
+                if value is not None:
+                    self.hits += 1
+                    return value
+                event = self._pending.get(key)
+                if event is None:
+                    break
+                self._lock.release()
+                try:
+                    event.wait()
+                finally:
+                    self._lock.acquire()
+            self.misses += 1
+            event = threading.Event()
+            self._pending[key] = event
+        try:
+            value = compute()
+            with self._lock:
+                self._store(key, value, _clock(), self.ttl)
+        finally:
+            with self._lock:
+                del self._pending[key]
+            event.set()
+        return value
+
+    def invalidate(self, hash_name = None, username = None):
+        """Remove entries for a user and/or hash.
+
+        :Parameters:
+            - `hash_name`: SCRAM hash name or `None` for any
+            - `username`: user name or `None` for any
+
+        :return: number of entries removed
+        :returntype: `int`
+        """
+        return self.remove_if(lambda key:
+                            (hash_name is None or key[0] == hash_name)
+                            and (username is None or key[1] == username))
+
+_process_key_cache = None
+
+def enable_process_key_cache(max_size = 1024, ttl = None):
+    """Enable the process-wide key cache used by SCRAM clients which do not
+    have the ``"SCRAM-key-cache"`` property set.
+
+    :return: the cache (an existing one, if already enabled)
+    :returntype: `KeyCache`
+    """
+    # pylint: disable=W0603
+    global _process_key_cache
+    if _process_key_cache is None:
+        _process_key_cache = KeyCache(max_size, ttl)
+    return _process_key_cache
+
+def disable_process_key_cache():
+    """Disable and drop the process-wide key cache."""
+    # pylint: disable=W0603
+    global _process_key_cache
+    _process_key_cache = None
+
+def get_process_key_cache():
+    """Get the process-wide key cache.
+
+    :returntype: `KeyCache` or `None`
+    """
+    return _process_key_cache
@@ -1,9 +1,157 @@
-import uuid
+import os
+import weakref
+import threading
 
-def default_nonce_factory():
-    """Generate a random string for digest authentication challenges.
-    The string should be cryptographicaly secure random pattern.
-    :return: the string generated.
-    :returntype: `bytes`
+from binascii import hexlify, unhexlify, b2a_base64
+
+class NonceFactory(object):
+    """Generator of random strings for authentication challenges.
+
+    Random bytes are read from `os.urandom` in large chunks and base64
+    encoded at once; every nonce is a slice of the encoded buffer, so it is
+    printable (contains only SCRAM 'value' characters) without further
+    checks or encoding. The buffer is discarded in a child process after
+    `os.fork`, so parent and child never produce the same nonces. The
+    factory may be called from many threads at once.
+
+    :Ivariables:
+        - `entropy`: random bytes per nonce
+        - `length`: length of the generated nonces
+        - `printable`: always `True` -- the nonces need no encoding
     """
-    return uuid.uuid4().hex.encode("us-ascii")
+    printable = True
+    def __init__(self, entropy = 18, buffer_size = 4095):
+        """Initialize the factory.
+
+        :Parameters:
+            - `entropy`: number of random bytes in a nonce
+            - `buffer_size`: number of random bytes read from `os.urandom`
+              at once
+        :Types:
+            - `entropy`: `int`
+            - `buffer_size`: `int`
+        """
+        if entropy < 1:
+            raise ValueError("Nonce entropy must be positive")
+        self.entropy = entropy
+        # 6 bits per base64 character
+        self.length = (entropy * 8 + 5) // 6
+        # a multiple of 3 bytes, so there is no padding in the encoded buffer
+        self._buffer_size = max(buffer_size, entropy) // 3 * 3 + 3
+        self._lock = threading.Lock()
+        self._pid = None
+        self._buffer = b""
+        self._offset = 0
+        if hasattr(os, "register_at_fork"):
+            ref = weakref.ref(self)
+            def after_fork():
+                """Drop the parent's random data in a forked child."""
+                factory = ref()
+                if factory is not None:
+                    factory._after_fork()  # pylint: disable=W0212
+            # pylint: disable=E1101
+            os.register_at_fork(after_in_child = after_fork)
+
+    def _after_fork(self):
+        """Reset the state in a forked child process."""
+        self._lock = threading.Lock()
+        self._pid = None
+        self._buffer = b""
+        self._offset = 0
+
+    def __call__(self):
+        """Generate a nonce.
+
+        :returntype: `bytes`
+        """
+        length = self.length
+        with self._lock:
+            offset = self._offset
+            if offset + length > len(self._buffer) \
+                                                or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._buffer = b2a_base64(os.urandom(self._buffer_size)
+                                                                    ).rstrip()
+                offset = 0
+            self._offset = offset + length
+            return self._buffer[offset:offset + length]
+
+default_nonce_factory = NonceFactory()
+
+if hasattr(int, "from_bytes"):
+    def bytes_to_int(data):
+        """Convert a big-endian byte string to an integer.
+
+        :returntype: `int`
+        """
+        return int.from_bytes(data, "big")
+
+    def int_to_bytes(value, length):
+        """Convert an integer to a big-endian byte string.
+
+        :returntype: `bytes`
+        """
+        return value.to_bytes(length, "big")
+else:
+    def bytes_to_int(data):
+        """Convert a big-endian byte string to an integer.
+
+        :returntype: `int`
+        """
+        if not data:
+            return 0
+        return int(hexlify(data), 16)
+
+    def int_to_bytes(value, length):
+        """Convert an integer to a big-endian byte string.
+
+        :returntype: `bytes`
+        """
+        return unhexlify("{0:0{1}x}".format(value, 2 * length))
+
+_TRANS_36 = bytes(bytearray(byte ^ 0x36 for byte in range(256)))
+_TRANS_5C = bytes(bytearray(byte ^ 0x5C for byte in range(256)))
+
+class PrecomputedHMAC(object):
+    """HMAC with a fixed key.
+
+    The hash states after processing the inner and outer padded key are
+    computed once and copied for every message, which saves two hash
+    block computations per HMAC.
+
+    :Ivariables:
+        - `inner`: hash object with the inner padded key processed
+        - `outer`: hash object with the outer padded key processed
+    """
+    # pylint: disable=R0903
+    __slots__ = ("inner", "outer")
+    def __init__(self, key, hash_factory):
+        """Prepare HMAC computations with a key.
+
+        :Parameters:
+            - `key`: the HMAC key
+            - `hash_factory`: hash constructor, e.g. `hashlib.sha1`
+        :Types:
+            - `key`: `bytes`
+        """
+        inner = hash_factory()
+        outer = hash_factory()
+        block_size = inner.block_size
+        if len(key) > block_size:
+            key = hash_factory(key).digest()
+        key = key.ljust(block_size, b"\0")
+        inner.update(key.translate(_TRANS_36))
+        outer.update(key.translate(_TRANS_5C))
+        self.inner = inner
+        self.outer = outer
+
+    def __call__(self, data):
+        """Compute HMAC(key, data).
+
+        :returntype: `bytes`
+        """
+        inner = self.inner.copy()
+        inner.update(data)
+        outer = self.outer.copy()
+        outer.update(inner.digest())
+        return outer.digest()
@@ -0,0 +1,153 @@
+"""Reusable SCRAM client credentials.
+
+A client opening many sessions for the same account may create one
+`ClientProfile` and pass it as the ``"SCRAM-client-profile"`` property to
+`SCRAMClientAuthenticator.start` instead of the ``"username"``,
+``"password"`` and ``"authzid"`` properties. The profile keeps the
+normalized password, the escaped identity, the GS2 headers and the keys
+derived for every (hash, salt, iteration count) seen, so the authenticators
+only generate a nonce and compute the per-exchange signatures.
+
+A profile may be shared by authenticators running in different threads.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+__docformat__ = "restructuredtext en"
+
+import threading
+
+from .cache import KeyCache
+from .scram import SCRAMOperations, derive_keys
+
+class ClientKeys(object):
+    """Keys derived from a password for a salt and iteration count.
+
+    :Ivariables:
+        - `client_key`: ClientKey
+        - `server_key`: ServerKey
+        - `stored_key_hmac`: HMAC(StoredKey, ...) function
+        - `server_key_hmac`: HMAC(ServerKey, ...) function
+    """
+    # pylint: disable=R0903
+    __slots__ = ("client_key", "server_key", "stored_key_hmac",
+                                                        "server_key_hmac")
+    def __init__(self, operations, salted_password):
+        """Compute the keys.
+
+        :Parameters:
+            - `operations`: object providing the SCRAM functions
+            - `salted_password`: the result of Hi()
+        :Types:
+            - `operations`: `SCRAMOperations`
+            - `salted_password`: `bytes`
+        """
+        self.client_key, self.server_key = derive_keys(operations,
+                                                            salted_password)
+        self.stored_key_hmac = operations.keyed_HMAC(
+                                            operations.H(self.client_key))
+        self.server_key_hmac = operations.keyed_HMAC(self.server_key)
+
+class ClientProfile(object):
+    """SCRAM client credentials of an account, shared by authenticators.
+
+    :Ivariables:
+        - `username`: the user name
+        - `authzid`: the authorization identity (empty for none)
+        - `password`: the normalized password
+        - `username_attribute`: the escaped 'n=' attribute
+        - `authzid_attribute`: the escaped 'a=' attribute (empty for no
+          authzid)
+    """
+    def __init__(self, username, password, authzid = None, max_keys = 16):
+        """Initialize the profile.
+
+        :Parameters:
+            - `username`: the user name
+            - `password`: the password
+            - `authzid`: the authorization identity
+            - `max_keys`: number of (hash, salt, iteration count)
+              combinations to remember the keys for
+        :Types:
+            - `username`: `unicode`
+            - `password`: `unicode`
+            - `authzid`: `unicode`
+            - `max_keys`: `int`
+        """
+        self.username = username
+        self.authzid = authzid or ""
+        self.password = SCRAMOperations.Normalize(password)
+        self.username_attribute = b"n=" + SCRAMOperations.escape(
+                                                    username.encode("utf-8"))
+        if self.authzid:
+            self.authzid_attribute = b"a=" + SCRAMOperations.escape(
+                                                self.authzid.encode("utf-8"))
+        else:
+            self.authzid_attribute = b""
+        self._gs2_headers = {}
+        self._keys = KeyCache(max_keys)
+        self._lock = threading.Lock()
+
+    def gs2_header(self, cb_flag):
+        """Get the GS2 header for a channel binding flag.
+
+        :Parameters:
+            - `cb_flag`: the channel binding flag, e.g. ``b"n"`` or
+              ``b"p=tls-unique"``
+        :Types:
+            - `cb_flag`: `bytes`
+
+        :returntype: `bytes`
+        """
+        header = self._gs2_headers.get(cb_flag)
+        if header is None:
+            header = cb_flag + b"," + self.authzid_attribute + b","
+            with self._lock:
+                self._gs2_headers[cb_flag] = header
+        return header
+
+    def lookup_keys(self, hash_name, salt, iteration_count):
+        """Get the keys derived before.
+
+        :returntype: `ClientKeys` or `None`
+        """
+        return self._keys.get((hash_name, salt, iteration_count))
+
+    def add_keys(self, hash_name, salt, iteration_count, keys):
+        """Remember the derived keys.
+
+        :Parameters:
+            - `hash_name`: the hash name
+            - `salt`: the salt
+            - `iteration_count`: the iteration count
+            - `keys`: the keys
+        :Types:
+            - `keys`: `ClientKeys`
+        """
+        self._keys.put((hash_name, salt, iteration_count), keys)
+
+    def get_keys(self, operations, salt, iteration_count):
+        """Get the keys for a salt and iteration count, deriving them if
+        needed (once, even when called from many threads at once).
+
+        :Parameters:
+            - `operations`: object providing the SCRAM functions
+            - `salt`: the salt
+            - `iteration_count`: the iteration count
+        :Types:
+            - `operations`: `SCRAMOperations`
+            - `salt`: `bytes`
+            - `iteration_count`: `int`
+
+        :return: the keys and `True` if they were derived before
+        :returntype: (`ClientKeys`, `bool`)
+        """
+        computed = []
+        def compute():
+            """Derive the keys."""
+            computed.append(True)
+            return ClientKeys(operations, operations.Hi(self.password, salt,
+                                                            iteration_count))
+        keys = self._keys.get_or_compute((operations.hash_function_name,
+                                            salt, iteration_count), compute)
+        return keys, not computed
@@ -0,0 +1,498 @@
+"""Read-only memory-mapped SCRAM credential files.
+
+A credential file holds precomputed SCRAM credentials (salt, iteration
+count, StoredKey and ServerKey for each of a set of hash functions) for many
+users, together with a hash index, so a user can be found with a single
+probe in the common case. `CredentialFile` maps it into memory and
+implements the password database protocol used by `SCRAMServerAuthenticator`.
+As the file is mapped read-only, any number of processes can use it through
+the page cache without copying it.
+
+`CredentialFileBuilder` writes such files incrementally, keeping only the
+index (12 bytes per user) in memory, and installs them atomically by
+renaming them over the target, so readers may switch to the new file with
+`CredentialFile.reload` at any time. On Python 2, where `os.replace` is
+missing, `os.rename` is used, which replaces the target only on POSIX
+systems.
+
+File layout (all integers little-endian)::
+
+    header:   magic "SCRAMCRD", version (u32), hash count (u32),
+              slot count (u64), record count (u64), index offset (u64)
+    hashes:   for each hash: name length (u8), name (ASCII)
+    records:  username length (u16), username (UTF-8), and for each hash:
+              salt length (u8), salt, iteration count (u32, 0 if missing),
+              StoredKey, ServerKey
+    index:    slot count slots of: record offset (u64, 0 if empty),
+              CRC-32 of the username (u32)
+
+The index uses open addressing with linear probing.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+__docformat__ = "restructuredtext en"
+
+import os
+import mmap
+import time
+import struct
+import zlib
+import logging
+import threading
+import tempfile
+
+from array import array
+
+from .bulk import BulkDeriver, derive_batch, derive_users
+from .scram import HASH_FACTORIES
+
+logger = logging.getLogger("pyxmpp2_scram.credfile")
+
+MAGIC = b"SCRAMCRD"
+VERSION = 1
+
+_HEADER = struct.Struct(str("<8sIIQQQ"))
+_SLOT = struct.Struct(str("<QI"))
+_U8 = struct.Struct(str("<B"))
+_U16 = struct.Struct(str("<H"))
+_U32 = struct.Struct(str("<I"))
+
+# atomic rename over an existing file; os.rename does it on POSIX only
+_replace = getattr(os, "replace", os.rename)
+
+def _name_hash(username):
+    """Hash used in the index."""
+    return zlib.crc32(username) & 0xffffffff
+
+class _MappedFile(object):
+    """A single mapping of a credential file."""
+    # pylint: disable=R0903
+    __slots__ = ("data", "stat", "hash_names", "digest_sizes", "slot_count",
+                                                "record_count", "index_offset")
+    def __init__(self, path):
+        with open(path, "rb") as stream:
+            self.stat = os.fstat(stream.fileno())
+            self.data = mmap.mmap(stream.fileno(), 0, access = mmap.ACCESS_READ)
+        data = self.data
+        if len(data) < _HEADER.size:
+            raise ValueError("File too short")
+        (magic, version, hash_count, self.slot_count, self.record_count,
+                            self.index_offset) = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a SCRAM credential file")
+        if version != VERSION:
+            raise ValueError("Unsupported credential file version: {0}"
+                                                            .format(version))
+        if self.slot_count & (self.slot_count - 1):
+            raise ValueError("Bad slot count: {0}".format(self.slot_count))
+        if self.index_offset + self.slot_count * _SLOT.size > len(data):
+            raise ValueError("Truncated credential file")
+        offset = _HEADER.size
+        hash_names = []
+        for _ in range(hash_count):
+            length = _U8.unpack_from(data, offset)[0]
+            offset += 1
+            hash_names.append(data[offset:offset + length].decode("ascii"))
+            offset += length
+        self.hash_names = tuple(hash_names)
+        self.digest_sizes = tuple(HASH_FACTORIES[name]().digest_size
+                                                        for name in hash_names)
+
+    def find(self, username):
+        """Find the record of a user.
+
+        :Parameters:
+            - `username`: UTF-8 encoded user name
+        :return: offset of the first hash entry of the record or `None`
+        :raises ValueError: if the index has no empty slot
+        """
+        if not self.slot_count:
+            return None
+        data = self.data
+        tag = _name_hash(username)
+        mask = self.slot_count - 1
+        slot = tag & mask
+        length = len(username)
+        for _ in range(self.slot_count):
+            offset, slot_tag = _SLOT.unpack_from(data,
+                                        self.index_offset + slot * _SLOT.size)
+            if not offset:
+                return None
+            if slot_tag == tag:
+                name_length = _U16.unpack_from(data, offset)[0]
+                if name_length == length and \
+                                data[offset + 2:offset + 2 + length] == username:
+                    return offset + 2 + length
+            slot = (slot + 1) & mask
+        raise ValueError("Corrupted credential file index: no empty slot")
+
+    def read_entry(self, offset, hash_index):
+        """Read credentials for one hash from a record.
+
+        :return: (salt, iteration_count, stored_key, server_key) or `None`
+        """
+        data = self.data
+        for index in range(hash_index + 1):
+            salt_length = _U8.unpack_from(data, offset)[0]
+            digest_size = self.digest_sizes[index]
+            if index == hash_index:
+                salt_end = offset + 1 + salt_length
+                iteration_count = _U32.unpack_from(data, salt_end)[0]
+                if not iteration_count:
+                    return None
+                key_start = salt_end + 4
+                return (data[offset + 1:salt_end], iteration_count,
+                            data[key_start:key_start + digest_size],
+                            data[key_start + digest_size:
+                                                key_start + 2 * digest_size])
+            offset += 1 + salt_length + 4 + 2 * digest_size
+        return None
+
+    def close(self):
+        """Unmap the file."""
+        self.data.close()
+
+class CredentialFile(object):
+    """Memory-mapped credential file, usable as the
+    `SCRAMServerAuthenticator` password database.
+
+    :Ivariables:
+        - `path`: path of the file
+        - `check_interval`: if not `None`, the number of seconds after which
+          a lookup checks if the file was replaced and reloads it
+    """
+    def __init__(self, path, check_interval = None):
+        """Open a credential file.
+
+        :Parameters:
+            - `path`: path of the file
+            - `check_interval`: seconds between automatic checks for a new
+              file, `None` to reload only on explicit `reload` calls
+        :Types:
+            - `path`: `unicode`
+            - `check_interval`: `float`
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self._mapped = _MappedFile(path)
+        self._lock = threading.Lock()
+        self._checked = time.time()
+
+    @property
+    def hash_names(self):
+        """Names of the hash functions with credentials in the file."""
+        return self._mapped.hash_names
+
+    def __len__(self):
+        return self._mapped.record_count
+
+    def reload(self, force = False):
+        """Switch to a new version of the file, if it was replaced.
+
+        The old mapping is not closed explicitly, as lookups in other
+        threads may still be using it; it is unmapped when garbage collected,
+        after the last of them finishes.
+
+        :return: `True` if a new file was loaded
+        :returntype: `bool`
+        """
+        with self._lock:
+            self._checked = time.time()
+            if not force:
+                try:
+                    stat = os.stat(self.path)
+                except OSError:
+                    return False
+                old = self._mapped.stat
+                if (stat.st_ino, stat.st_dev, stat.st_mtime, stat.st_size) \
+                        == (old.st_ino, old.st_dev, old.st_mtime, old.st_size):
+                    return False
+            self._mapped = _MappedFile(self.path)
+        logger.debug("Reloaded credential file %r", self.path)
+        return True
+
+    def _current(self):
+        """Return the current mapping, reloading it if it is time to check.
+        """
+        if self.check_interval is not None and \
+                            time.time() - self._checked >= self.check_interval:
+            self.reload()
+        return self._mapped
+
+    def get_keys(self, username, hash_name):
+        """Get stored credentials of a user.
+
+        :return: (salt, iteration_count, stored_key, server_key) or `None`
+        """
+        mapped = self._current()
+        try:
+            hash_index = mapped.hash_names.index(hash_name)
+        except ValueError:
+            return None
+        offset = mapped.find(username.encode("utf-8"))
+        if offset is None:
+            return None
+        return mapped.read_entry(offset, hash_index)
+
+    def get_password(self, username, formats, properties):
+        """Get the credentials of a user in one of the requested formats.
+
+        Only the ``"SCRAM-<hash>-Keys"`` formats are supported.
+
+        :return: the credentials and their format or ``(None, None)``
+        :returntype: (`tuple`, `unicode`)
+        """
+        # pylint: disable=W0613
+        mapped = self._current()
+        offset = mapped.find(username.encode("utf-8"))
+        if offset is None:
+            return None, None
+        for pformat in formats:
+            if not pformat.startswith("SCRAM-") \
+                                            or not pformat.endswith("-Keys"):
+                continue
+            try:
+                hash_index = mapped.hash_names.index(pformat[6:-5])
+            except ValueError:
+                continue
+            entry = mapped.read_entry(offset, hash_index)
+            if entry is not None:
+                return entry, pformat
+        return None, None
+
+    def get_credentials(self, username, formats, properties):
+        """Get the credentials of a user in all the requested formats at
+        once.
+
+        Only the ``"SCRAM-<hash>-Keys"`` formats are supported.
+
+        :return: the credentials by format
+        :returntype: `dict`
+        """
+        # pylint: disable=W0613
+        mapped = self._current()
+        offset = mapped.find(username.encode("utf-8"))
+        if offset is None:
+            return {}
+        result = {}
+        for pformat in formats:
+            if not pformat.startswith("SCRAM-") \
+                                            or not pformat.endswith("-Keys"):
+                continue
+            try:
+                hash_index = mapped.hash_names.index(pformat[6:-5])
+            except ValueError:
+                continue
+            entry = mapped.read_entry(offset, hash_index)
+            if entry is not None:
+                result[pformat] = entry
+        return result
+
+class CredentialFileBuilder(object):
+    """Writes a new credential file.
+
+    Records are streamed to a temporary file next to the target; only
+    the index is kept in memory. `commit` writes the index and atomically
+    replaces the target file, `abort` removes the temporary file.
+
+    Used as a context manager, the builder commits when the block exits
+    normally and aborts when it raises. A builder neither committed nor
+    aborted removes its temporary file when garbage-collected.
+
+    :Ivariables:
+        - `path`: path of the target file
+        - `hash_names`: hash functions stored in the file
+    """
+    def __init__(self, path, hash_names = ("SHA-1", "SHA-256")):
+        """Start building a credential file.
+
+        :Parameters:
+            - `path`: path of the target file
+            - `hash_names`: SCRAM hash names, e.g. ``("SHA-1", "SHA-256")``
+        """
+        self.path = path
+        self.hash_names = tuple(hash_names)
+        self._digest_sizes = tuple(HASH_FACTORIES[name]().digest_size
+                                                    for name in self.hash_names)
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, self._temp_path = tempfile.mkstemp(prefix = ".credfile-",
+                                                        dir = directory)
+        self._stream = os.fdopen(fd, "w+b")
+        self._finished = False
+        self._offsets = array(str("Q"))
+        self._tags = array(str("I"))
+        header = _HEADER.pack(MAGIC, VERSION, len(self.hash_names), 0, 0, 0)
+        self._stream.write(header)
+        for name in self.hash_names:
+            name = name.encode("ascii")
+            self._stream.write(_U8.pack(len(name)) + name)
+        self._position = self._stream.tell()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._finished:
+            return
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+    def __del__(self):
+        if not getattr(self, "_finished", True):
+            self.abort()
+
+    def add(self, username, credentials):
+        """Add a user.
+
+        :Parameters:
+            - `username`: the user name
+            - `credentials`: mapping of hash names to (salt, iteration_count,
+              stored_key, server_key) tuples; missing hashes are allowed
+        :Types:
+            - `username`: `unicode`
+            - `credentials`: `dict`
+
+        :raises ValueError: for values that do not fit in the file format
+        """
+        username = username.encode("utf-8")
+        if len(username) > 0xffff:
+            raise ValueError("User name too long")
+        parts = [_U16.pack(len(username)), username]
+        for name, digest_size in zip(self.hash_names, self._digest_sizes):
+            entry = credentials.get(name)
+            if entry is None:
+                parts.append(_U8.pack(0) + _U32.pack(0)
+                                                + b"\0" * (2 * digest_size))
+                continue
+            salt, iteration_count, stored_key, server_key = entry
+            if len(stored_key) != digest_size or len(server_key) != digest_size:
+                raise ValueError("Bad key length for {0}".format(name))
+            if len(salt) > 0xff:
+                raise ValueError("Salt too long for {0}".format(name))
+            if not 1 <= iteration_count <= 0xffffffff:
+                raise ValueError("Bad iteration count for {0}: {1}"
+                                                .format(name, iteration_count))
+            parts += [_U8.pack(len(salt)), salt, _U32.pack(iteration_count),
+                                                        stored_key, server_key]
+        record = b"".join(parts)
+        self._offsets.append(self._position)
+        self._tags.append(_name_hash(username))
+        self._stream.write(record)
+        self._position += len(record)
+
+    def add_password(self, username, password, iteration_count = 4096,
+                                                            salt_size = 16):
+        """Compute credentials of a user for all the hashes and add them."""
+        jobs = [(name, password, os.urandom(salt_size), iteration_count)
+                                                for name in self.hash_names]
+        credentials = {}
+        for (name, _, salt, _), (_, stored_key, server_key) in zip(jobs,
+                                                        derive_batch(jobs)):
+            credentials[name] = (salt, iteration_count, stored_key,
+                                                                server_key)
+        self.add(username, credentials)
+
+    def abort(self):
+        """Discard the file being built."""
+        self._finished = True
+        self._stream.close()
+        try:
+            os.unlink(self._temp_path)
+        except OSError:
+            pass
+
+    def _check_duplicate(self, data, offset1, offset2):
+        """Raise `ValueError` if two records are for the same user."""
+        length1 = _U16.unpack_from(data, offset1)[0]
+        length2 = _U16.unpack_from(data, offset2)[0]
+        if length1 == length2 and data[offset1 + 2:offset1 + 2 + length1] \
+                                    == data[offset2 + 2:offset2 + 2 + length2]:
+            raise ValueError("Duplicate user: {0!r}".format(
+                    data[offset1 + 2:offset1 + 2 + length1].decode("utf-8")))
+
+    def commit(self):
+        """Write the index and install the file at its target path."""
+        if self._finished:
+            raise ValueError("Credential file already committed or aborted")
+        try:
+            record_count = len(self._offsets)
+            slot_count = 1
+            while slot_count < 2 * record_count:
+                slot_count *= 2
+            if not record_count:
+                slot_count = 0
+            self._stream.flush()
+            slots = array(str("Q"), [0]) * slot_count
+            slot_tags = array(str("I"), [0]) * slot_count
+            if record_count:
+                data = mmap.mmap(self._stream.fileno(), 0,
+                                                access = mmap.ACCESS_READ)
+                try:
+                    mask = slot_count - 1
+                    for offset, tag in zip(self._offsets, self._tags):
+                        slot = tag & mask
+                        while slots[slot]:
+                            if slot_tags[slot] == tag:
+                                self._check_duplicate(data, slots[slot],
+                                                                    offset)
+                            slot = (slot + 1) & mask
+                        slots[slot] = offset
+                        slot_tags[slot] = tag
+                finally:
+                    data.close()
+            self._stream.seek(self._position)
+            chunk = []
+            for offset, tag in zip(slots, slot_tags):
+                chunk.append(_SLOT.pack(offset, tag))
+                if len(chunk) >= 65536:
+                    self._stream.write(b"".join(chunk))
+                    chunk = []
+            self._stream.write(b"".join(chunk))
+            self._stream.seek(0)
+            self._stream.write(_HEADER.pack(MAGIC, VERSION,
+                                    len(self.hash_names), slot_count,
+                                    record_count, self._position))
+            self._stream.flush()
+            os.fsync(self._stream.fileno())
+            self._stream.close()
+            os.chmod(self._temp_path, 0o644)
+            _replace(self._temp_path, self.path)
+        except BaseException:
+            self.abort()
+            raise
+        self._finished = True
+
+def build_credential_file(path, items, hash_names = ("SHA-1", "SHA-256"),
+                        iteration_count = 4096, executor = None,
+                        chunk_size = 64):
+    """Build a credential file from (username, password) pairs.
+
+    The keys are computed in parallel by a `bulk.BulkDeriver`, the input is
+    consumed only as fast as the records are written.
+
+    :Parameters:
+        - `path`: path of the target file
+        - `items`: (username, password) pairs
+        - `hash_names`: SCRAM hash names
+        - `iteration_count`: the iteration count
+        - `executor`: a `concurrent.futures.Executor`, `None` to create one
+          with `kdf.create_executor`
+        - `chunk_size`: number of keys computed by a worker at once
+
+    :return: number of users written
+    :returntype: `int`
+    """
+    # pylint: disable=R0913
+    deriver = BulkDeriver(executor, batch_size = chunk_size)
+    iteration_counts = dict((hash_name, iteration_count)
+                                                for hash_name in hash_names)
+    count = 0
+    with CredentialFileBuilder(path, hash_names) as builder:
+        for username, credentials in derive_users(deriver, items,
+                            builder.hash_names, iteration_counts, 16):
+            builder.add(username, credentials)
+            count += 1
+    return count
@@ -0,0 +1,110 @@
+"""Decoy credentials for unknown users.
+
+When the password database does not know a user, the server must still
+answer the client first message with a salt and an iteration count, and
+take as long to do it as for an existing user, or it tells the client that
+the user does not exist. By default `SCRAMServerAuthenticator` computes Hi()
+of an empty password with a random salt, which costs as much CPU as a real
+login with a plain-text password, and the salt changes with every attempt
+(while the salt of an existing user does not).
+
+A `DecoyCredentials` object given as the ``"SCRAM-decoy-credentials"``
+property replaces that: for an unknown user it derives a salt and fake
+StoredKey and ServerKey from a server secret, the user name and the hash,
+with a few HMAC computations (cached). The salt is the same on every
+attempt and differs between the hashes, like the salts of the credentials
+in `store.SCRAMCredentialStore`. The exchange then proceeds exactly as for
+a user with precomputed ``"SCRAM-<hash>-Keys"`` credentials, failing at
+the proof verification.
+
+The secret must be the same on all servers (and across restarts), or the
+salt of an unknown user changes when the client connects to a different
+server. The `salt_size` should be the one used for real credentials (e.g.
+`store.SCRAMCredentialStore.salt_size`).
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+__docformat__ = "restructuredtext en"
+
+import os
+import hmac
+import struct
+import hashlib
+
+from .cache import LRUCache
+from .scram import HASH_FACTORIES
+
+_ITERATION_COUNT = struct.Struct(str("!I"))
+
+class DecoyCredentials(object):
+    """Derives stable fake credentials for unknown users.
+
+    :Ivariables:
+        - `salt_size`: length of the salts
+    """
+    def __init__(self, secret = None, salt_size = 16, max_size = 10000):
+        """Initialize the decoy credential generator.
+
+        :Parameters:
+            - `secret`: the server secret (at least 16 random bytes), `None`
+              to generate one (valid for this object only)
+            - `salt_size`: length of the salts (at most 32)
+            - `max_size`: number of users to cache the credentials of
+        :Types:
+            - `secret`: `bytes`
+            - `salt_size`: `int`
+            - `max_size`: `int`
+        """
+        if secret is None:
+            secret = os.urandom(32)
+        elif len(secret) < 16:
+            raise ValueError("Decoy credential secret too short")
+        if not 0 < salt_size <= 32:
+            raise ValueError("Bad decoy salt size")
+        self.salt_size = salt_size
+        self._cache = LRUCache(max_size)
+        self._key = hmac.new(secret, b"SCRAM decoy credentials",
+                                                    hashlib.sha256).digest()
+
+    def get_keys(self, hash_name, username, iteration_count):
+        """Get the decoy credentials for a user.
+
+        The salt depends only on the user name and the hash, so it does not
+        change when the iteration count does.
+
+        :Parameters:
+            - `hash_name`: SCRAM hash name, e.g. ``"SHA-1"``
+            - `username`: the user name
+            - `iteration_count`: the iteration count to report
+        :Types:
+            - `hash_name`: `unicode`
+            - `username`: `unicode`
+            - `iteration_count`: `int`
+
+        :return: (salt, iteration_count, stored_key, server_key), like
+            a ``"SCRAM-<hash>-Keys"`` password database entry
+        :returntype: `tuple`
+        """
+        key = (hash_name, username, iteration_count)
+        result = self._cache.get(key)
+        if result is None:
+            result = self._derive(hash_name, username, iteration_count)
+            self._cache.put(key, result)
+        return result
+
+    def _derive(self, hash_name, username, iteration_count):
+        """Compute the decoy credentials."""
+        user_key = hmac.new(self._key, username.encode("utf-8"),
+                                                    hashlib.sha256).digest()
+        hash_name_bytes = hash_name.encode("ascii")
+        salt = hmac.new(user_key, b"salt " + hash_name_bytes,
+                                                    hashlib.sha256).digest()
+        info = hash_name_bytes + _ITERATION_COUNT.pack(iteration_count)
+        hash_factory = HASH_FACTORIES[hash_name]
+        stored_key = hmac.new(user_key, b"StoredKey " + info,
+                                                    hash_factory).digest()
+        server_key = hmac.new(user_key, b"ServerKey " + info,
+                                                    hash_factory).digest()
+        return (salt[:self.salt_size], iteration_count, stored_key,
+                                                                server_key)
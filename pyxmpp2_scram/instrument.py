@@ -0,0 +1,211 @@
+"""Instrumentation hooks for the SCRAM authenticators.
+
+An `Instrumentation` object passed as the ``"SCRAM-instrumentation"``
+property to `SCRAMClientAuthenticator.start` or
+`SCRAMServerAuthenticator.start` is notified about the exchange progress:
+
+  - `Instrumentation.phase` -- time spent in an exchange phase: ``"parse"``,
+    ``"nonce"``, ``"lookup"`` (password database, server only), ``"kdf"``,
+    ``"proof"`` (client only), ``"build"`` (server only) and ``"verify"``;
+    the phases do not overlap, so their times may be summed,
+  - `Instrumentation.kdf` -- a Hi() computation and its iteration count,
+  - `Instrumentation.cache` -- a client key cache lookup,
+  - `Instrumentation.failure` -- an exception raised by the authenticator,
+  - `Instrumentation.success` -- a successfully finished exchange.
+
+Without the property the authenticators only check for `None` before each
+phase.
+
+`LoggingInstrumentation` and `PrometheusInstrumentation` adapt these events
+to the `logging` module and a Prometheus client registry.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+__docformat__ = "restructuredtext en"
+
+import time
+import logging
+
+try:
+    # pylint: disable=F0401
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+timer = getattr(time, "perf_counter", time.time)
+
+class Instrumentation(object):
+    """Base class of SCRAM instrumentation sinks. All the methods do
+    nothing.
+
+    The `mechanism` arguments are mechanism names (e.g.
+    ``"SCRAM-SHA-1-PLUS"``), the `side` arguments are ``"client"`` or
+    ``"server"``.
+    """
+    # pylint: disable=W0613,R0201
+    def phase(self, mechanism, side, phase, seconds):
+        """Called after an exchange phase completes.
+
+        :Parameters:
+            - `mechanism`: the mechanism name
+            - `side`: ``"client"`` or ``"server"``
+            - `phase`: the phase name
+            - `seconds`: time spent in the phase
+        """
+        pass
+
+    def kdf(self, mechanism, side, iteration_count, seconds):
+        """Called after a Hi() computation.
+
+        :Parameters:
+            - `mechanism`: the mechanism name
+            - `side`: ``"client"`` or ``"server"``
+            - `iteration_count`: the iteration count used
+            - `seconds`: time spent
+        """
+        pass
+
+    def cache(self, mechanism, hit):
+        """Called after a client key cache lookup.
+
+        :Parameters:
+            - `mechanism`: the mechanism name
+            - `hit`: `True` if the keys were found in the cache
+        """
+        pass
+
+    def failure(self, mechanism, side, exception):
+        """Called when an authenticator raises an exception.
+
+        :Parameters:
+            - `mechanism`: the mechanism name
+            - `side`: ``"client"`` or ``"server"``
+            - `exception`: the exception raised
+        """
+        pass
+
+    def success(self, mechanism, side):
+        """Called when an exchange completes successfully.
+
+        :Parameters:
+            - `mechanism`: the mechanism name
+            - `side`: ``"client"`` or ``"server"``
+        """
+        pass
+
+class LoggingInstrumentation(Instrumentation):
+    """Logs the instrumentation events.
+
+    :Ivariables:
+        - `logger`: the logger used
+        - `level`: the log level used for the events
+    """
+    def __init__(self, logger = None, level = logging.DEBUG):
+        if logger is None:
+            logger = logging.getLogger("pyxmpp2_scram.instrument")
+        self.logger = logger
+        self.level = level
+
+    def phase(self, mechanism, side, phase, seconds):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, "%s %s %s: %.6fs", mechanism, side,
+                                                            phase, seconds)
+
+    def kdf(self, mechanism, side, iteration_count, seconds):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, "%s %s Hi(): %d iterations, %.6fs",
+                                mechanism, side, iteration_count, seconds)
+
+    def cache(self, mechanism, hit):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, "%s client key cache %s", mechanism,
+                                                    "hit" if hit else "miss")
+
+    def failure(self, mechanism, side, exception):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, "%s %s failure: %s", mechanism, side,
+                                                exception.__class__.__name__)
+
+    def success(self, mechanism, side):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, "%s %s success", mechanism, side)
+
+class PrometheusInstrumentation(Instrumentation):
+    """Records the instrumentation events as Prometheus metrics.
+
+    The metrics are created with the `prometheus_client` package, or with
+    other counter and histogram factories with its interface (callables
+    accepting name, documentation, label names and the ``registry`` keyword
+    argument, returning objects with ``labels(...).inc()`` and
+    ``labels(...).observe(value)`` methods).
+
+    Metrics (with the default ``"scram"`` prefix):
+
+      - ``scram_phase_seconds`` histogram, labels: mechanism, side, phase
+      - ``scram_kdf_seconds`` histogram, labels: mechanism, side
+      - ``scram_kdf_iterations_total`` counter, labels: mechanism, side
+      - ``scram_key_cache_total`` counter, labels: mechanism, result
+      - ``scram_failures_total`` counter, labels: mechanism, side, exception
+      - ``scram_successes_total`` counter, labels: mechanism, side
+    """
+    # pylint: disable=R0913
+    def __init__(self, registry = None, prefix = "scram",
+                            counter_factory = None, histogram_factory = None):
+        """Create the metrics.
+
+        :Parameters:
+            - `registry`: registry to create the metrics in, `None` for the
+              factories' default
+            - `prefix`: metric name prefix
+            - `counter_factory`: counter constructor, `None` for
+              `prometheus_client.Counter`
+            - `histogram_factory`: histogram constructor, `None` for
+              `prometheus_client.Histogram`
+        """
+        if counter_factory is None or histogram_factory is None:
+            if prometheus_client is None:
+                raise ImportError("prometheus_client is required for"
+                                                " PrometheusInstrumentation")
+            if counter_factory is None:
+                counter_factory = prometheus_client.Counter
+            if histogram_factory is None:
+                histogram_factory = prometheus_client.Histogram
+        kwargs = {}
+        if registry is not None:
+            kwargs["registry"] = registry
+        self.phase_seconds = histogram_factory(prefix + "_phase_seconds",
+                    "Time spent in SCRAM exchange phases",
+                    ["mechanism", "side", "phase"], **kwargs)
+        self.kdf_seconds = histogram_factory(prefix + "_kdf_seconds",
+                    "Time spent in SCRAM Hi() computations",
+                    ["mechanism", "side"], **kwargs)
+        self.kdf_iterations = counter_factory(prefix + "_kdf_iterations",
+                    "Hi() iterations computed", ["mechanism", "side"],
+                    **kwargs)
+        self.key_cache = counter_factory(prefix + "_key_cache",
+                    "SCRAM client key cache lookups",
+                    ["mechanism", "result"], **kwargs)
+        self.failures = counter_factory(prefix + "_failures",
+                    "Failed SCRAM exchanges", ["mechanism", "side",
+                                                    "exception"], **kwargs)
+        self.successes = counter_factory(prefix + "_successes",
+                    "Successful SCRAM exchanges", ["mechanism", "side"],
+                    **kwargs)
+
+    def phase(self, mechanism, side, phase, seconds):
+        self.phase_seconds.labels(mechanism, side, phase).observe(seconds)
+
+    def kdf(self, mechanism, side, iteration_count, seconds):
+        self.kdf_seconds.labels(mechanism, side).observe(seconds)
+        self.kdf_iterations.labels(mechanism, side).inc(iteration_count)
+
+    def cache(self, mechanism, hit):
+        self.key_cache.labels(mechanism, "hit" if hit else "miss").inc()
+
+    def failure(self, mechanism, side, exception):
+        self.failures.labels(mechanism, side,
+                                    exception.__class__.__name__).inc()
+
+    def success(self, mechanism, side):
+        self.successes.labels(mechanism, side).inc()
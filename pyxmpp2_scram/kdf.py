@@ -0,0 +1,336 @@
+"""Key derivation backends for the SCRAM Hi() function.
+
+Hi() is PBKDF2 (:RFC:`2898`) with HMAC as the pseudo-random function and
+a single output block, so any PBKDF2 implementation can compute it.  This
+module provides several such implementations ("backends"):
+
+  - ``"hashlib"`` -- `hashlib.pbkdf2_hmac`, implemented in C by OpenSSL
+    (or CPython itself) and running without the GIL,
+  - ``"cryptography"`` -- the PBKDF2HMAC primitive of the optional
+    `cryptography` package,
+  - ``"python"`` -- the plain loop from the RFC, always available.
+
+Native backends are checked against the ``"python"`` one before they are
+used for a given digest; if the check fails (or the digest is not
+supported, e.g. MD5 on a FIPS system) the pure Python loop is used instead.
+
+Digests are identified by their `hashlib` names (``"sha1"``,
+``"sha256"``...), as returned by the ``name`` attribute of hash objects.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+__docformat__ = "restructuredtext en"
+
+import hashlib
+import logging
+import threading
+
+from collections import OrderedDict
+
+from .core import bytes_to_int, int_to_bytes, PrecomputedHMAC
+
+try:
+    # pylint: disable=F0401
+    from cryptography.hazmat.backends import default_backend \
+                                                as _cryptography_backend
+    from cryptography.hazmat.primitives import hashes as _cryptography_hashes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC \
+                                                as _CryptographyPBKDF2HMAC
+    from cryptography.exceptions import UnsupportedAlgorithm \
+                                                as _UnsupportedAlgorithm
+except ImportError:
+    _cryptography_hashes = None
+    _UnsupportedAlgorithm = None
+
+logger = logging.getLogger("pyxmpp2_scram.kdf")
+
+# exceptions raised by the backends for digests they do not support
+_UNSUPPORTED_DIGEST_ERRORS = (ValueError, TypeError, AttributeError)
+if _UnsupportedAlgorithm is not None:
+    _UNSUPPORTED_DIGEST_ERRORS += (_UnsupportedAlgorithm,)
+
+# input used to verify native backends against the pure Python one
+_SELF_TEST_INPUT = (b"pencil", b"\x41\x25\xc2\x47\xe4\x3a\xb1\xe9"
+                                b"\x3c\x6d\xff\x76", 3)
+
+class KDFBackend(object):
+    """Base class for Hi() implementations.
+
+    :Ivariables:
+        - `name`: backend name used in `get_backend`
+        - `releases_gil`: `True` if the derivation runs without the GIL, so
+          it may be usefully run in a thread pool
+    """
+    name = None
+    releases_gil = False
+    def __init__(self):
+        self._supported = {}
+        self._lock = threading.Lock()
+
+    def is_available(self):
+        """Check if the backend can be used at all in this environment."""
+        # pylint: disable=R0201
+        return True
+
+    def _derive(self, digest_name, password, salt, iterations):
+        """Compute Hi() without any checks. To be implemented in subclasses.
+        """
+        raise NotImplementedError
+
+    def supports(self, digest_name):
+        """Check if the backend gives correct results for a digest.
+
+        The result of the check is remembered.
+
+        :Parameters:
+            - `digest_name`: `hashlib` name of the digest
+        :Types:
+            - `digest_name`: `unicode`
+
+        :returntype: `bool`
+        """
+        try:
+            return self._supported[digest_name]
+        except KeyError:
+            pass
+        with self._lock:
+            if digest_name not in self._supported:
+                self._supported[digest_name] = self._self_test(digest_name)
+        return self._supported[digest_name]
+
+    def _self_test(self, digest_name):
+        """Compare the backend output with the `PythonKDFBackend`."""
+        try:
+            result = self._derive(digest_name, *_SELF_TEST_INPUT)
+        except _UNSUPPORTED_DIGEST_ERRORS as err:
+            logger.debug("KDF backend %r does not support %r: %s",
+                                                self.name, digest_name, err)
+            return False
+        expected = PYTHON_BACKEND._derive(digest_name, *_SELF_TEST_INPUT)
+        if result != expected:
+            logger.warning("KDF backend %r gives wrong results for %r,"
+                                " not using it", self.name, digest_name)
+            return False
+        return True
+
+    def derive(self, digest_name, password, salt, iterations):
+        """Compute Hi(password, salt, iterations).
+
+        Falls back to the pure Python implementation when the digest is not
+        supported by this backend.
+
+        :Parameters:
+            - `digest_name`: `hashlib` name of the digest
+            - `password`: the normalized password
+            - `salt`: the salt
+            - `iterations`: iteration count
+        :Types:
+            - `digest_name`: `unicode`
+            - `password`: `bytes`
+            - `salt`: `bytes`
+            - `iterations`: `int`
+
+        :returntype: `bytes`
+        :raises ValueError: if `iterations` is lower than 1
+        """
+        if iterations < 1:
+            raise ValueError("Iteration count must be positive: {0!r}"
+                                                        .format(iterations))
+        if self.supports(digest_name):
+            return self._derive(digest_name, password, salt, iterations)
+        return PYTHON_BACKEND._derive(digest_name, password, salt, iterations)
+
+    def __repr__(self):
+        return "<{0} {1!r}>".format(self.__class__.__name__, self.name)
+
+class PythonKDFBackend(KDFBackend):
+    """The Hi() loop, as defined in the RFC, in pure Python."""
+    name = "python"
+    def supports(self, digest_name):
+        return True
+
+    def _derive(self, digest_name, password, salt, iterations):
+        # pylint: disable=C0103
+        prf = PrecomputedHMAC(password, getattr(hashlib, digest_name))
+        inner, outer = prf.inner, prf.outer
+        Uj = prf(salt + b"\000\000\000\001") # U1
+        # U1 XOR U2 XOR ... accumulated as an integer
+        result = bytes_to_int(Uj)
+        for _ in range(2, iterations + 1):
+            # Uj = HMAC(str, Uj-1), with PrecomputedHMAC.__call__ inlined
+            inner_hash = inner.copy()
+            inner_hash.update(Uj)
+            outer_hash = outer.copy()
+            outer_hash.update(inner_hash.digest())
+            Uj = outer_hash.digest()
+            result ^= bytes_to_int(Uj)
+        return int_to_bytes(result, len(Uj))
+
+class HashlibKDFBackend(KDFBackend):
+    """Hi() computed by `hashlib.pbkdf2_hmac`."""
+    name = "hashlib"
+    releases_gil = True
+    def is_available(self):
+        return hasattr(hashlib, "pbkdf2_hmac")
+
+    def _derive(self, digest_name, password, salt, iterations):
+        # pylint: disable=E1101
+        return hashlib.pbkdf2_hmac(digest_name, password, salt, iterations)
+
+class CryptographyKDFBackend(KDFBackend):
+    """Hi() computed by the PBKDF2HMAC primitive of the `cryptography`
+    package."""
+    name = "cryptography"
+    releases_gil = True
+    def is_available(self):
+        return _cryptography_hashes is not None
+
+    def _derive(self, digest_name, password, salt, iterations):
+        algorithm = getattr(_cryptography_hashes, digest_name.upper())()
+        kdf = _CryptographyPBKDF2HMAC(algorithm=algorithm,
+                                        length=algorithm.digest_size,
+                                        salt=salt, iterations=iterations,
+                                        backend=_cryptography_backend())
+        return kdf.derive(password)
+
+PYTHON_BACKEND = PythonKDFBackend()
+
+_BACKENDS = OrderedDict((backend.name, backend) for backend in (
+                                                HashlibKDFBackend(),
+                                                CryptographyKDFBackend(),
+                                                PYTHON_BACKEND,
+                                                ))
+
+_default_backend = None
+
+def available_backends():
+    """List names of the backends usable in this environment, the preferred
+    one first.
+
+    :returntype: `list` of `unicode`
+    """
+    return [name for name, backend in _BACKENDS.items()
+                                                if backend.is_available()]
+
+def get_backend(name = None):
+    """Get a backend by name.
+
+    :Parameters:
+        - `name`: backend name or `None` for the default backend. A
+          `KDFBackend` instance is returned unchanged.
+    :Types:
+        - `name`: `unicode` or `KDFBackend`
+
+    :returntype: `KDFBackend`
+    :raises: `ValueError` if the backend is unknown or not available
+    """
+    if isinstance(name, KDFBackend):
+        return name
+    if name is None:
+        return get_default_backend()
+    try:
+        backend = _BACKENDS[name]
+    except KeyError:
+        raise ValueError("Unknown KDF backend: {0!r}".format(name))
+    if not backend.is_available():
+        raise ValueError("KDF backend {0!r} is not available".format(name))
+    return backend
+
+def get_default_backend():
+    """Get the backend used by `SCRAMOperations` objects by default.
+
+    :returntype: `KDFBackend`
+    """
+    if _default_backend is None:
+        return _BACKENDS[available_backends()[0]]
+    return _default_backend
+
+def set_default_backend(name):
+    """Select the backend used by new `SCRAMOperations` objects by default.
+
+    :Parameters:
+        - `name`: backend name, `KDFBackend` instance or `None` to restore
+          the automatic selection
+    :Types:
+        - `name`: `unicode` or `KDFBackend`
+    """
+    # pylint: disable=W0603
+    global _default_backend
+    if name is None:
+        _default_backend = None
+    else:
+        _default_backend = get_backend(name)
+
+def pbkdf2(digest_name, password, salt, iterations, backend = None):
+    """Compute Hi(password, salt, iterations) with the selected backend.
+
+    This is a module-level function, so it may be submitted to
+    a process pool.
+
+    :Parameters:
+        - `digest_name`: `hashlib` name of the digest
+        - `password`: the normalized password
+        - `salt`: the salt
+        - `iterations`: iteration count
+        - `backend`: backend name, `None` for the default one
+    :Types:
+        - `digest_name`: `unicode`
+        - `password`: `bytes`
+        - `salt`: `bytes`
+        - `iterations`: `int`
+        - `backend`: `unicode`
+
+    :returntype: `bytes`
+    """
+    return get_backend(backend).derive(digest_name, password, salt,
+                                                                iterations)
+
+def create_executor(backend = None, max_workers = None):
+    """Create an executor suitable for running `pbkdf2` in parallel.
+
+    A thread pool is returned if the backend releases the GIL, a process
+    pool otherwise. Only backend names can be passed to worker processes,
+    so a thread pool is also returned for a backend not registered under
+    its name. Requires the `concurrent.futures` module.
+
+    :Parameters:
+        - `backend`: backend name, `None` for the default one
+        - `max_workers`: number of workers, `None` for the number of CPUs
+    :Types:
+        - `backend`: `unicode` or `KDFBackend`
+        - `max_workers`: `int`
+
+    :returntype: `concurrent.futures.Executor`
+    """
+    # pylint: disable=F0401
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+    if max_workers is None:
+        max_workers = cpu_count()
+    backend = get_backend(backend)
+    if backend.releases_gil or _BACKENDS.get(backend.name) is not backend:
+        return ThreadPoolExecutor(max_workers)
+    return ProcessPoolExecutor(max_workers)
+
+def is_process_pool(executor):
+    """Check if an executor runs its jobs in other processes, so only
+    picklable arguments (e.g. backend names) may be passed to it.
+
+    Works without the `concurrent.futures` module.
+
+    :returntype: `bool`
+    """
+    try:
+        # pylint: disable=F0401
+        from concurrent.futures import ProcessPoolExecutor
+    except ImportError:
+        return False
+    return isinstance(executor, ProcessPoolExecutor)
+
+def cpu_count():
+    """Return the number of CPUs, 1 if unknown."""
+    import multiprocessing
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
@@ -0,0 +1,294 @@
+"""Parsers of the SCRAM messages.
+
+The functions in this module accept exactly the same messages as the
+`scram.CLIENT_FIRST_MESSAGE_RE`, `scram.SERVER_FIRST_MESSAGE_RE`,
+`scram.CLIENT_FINAL_MESSAGE_RE` and `scram.SERVER_FINAL_MESSAGE_RE` regular
+expressions (including their quirks, like the ``$`` matching before
+a trailing newline), but split the message on commas once and validate the
+attribute values with `bytes.strip`, instead of backtracking over the
+whole message.
+
+Each parser returns a message object or `None` when the message does not
+match the syntax, so the callers may treat the result like a regular
+expression match.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+__docformat__ = "restructuredtext en"
+
+def _char_range(first, last):
+    """Return bytes `first` to `last` (inclusive)."""
+    return bytes(bytearray(range(first, last + 1)))
+
+# printable ASCII except ","
+VALUE_CHARS = _char_range(0x21, 0x2B) + _char_range(0x2D, 0x7E)
+BASE64_CHARS = (_char_range(0x41, 0x5A) + _char_range(0x61, 0x7A)
+                                            + _char_range(0x30, 0x39) + b"/+=")
+DIGITS = _char_range(0x30, 0x39)
+# "A-z" (sic) as in the original regular expression
+CB_NAME_CHARS = _char_range(0x41, 0x7A) + DIGITS + b".-"
+
+# The attribute names and "=" belong to `VALUE_CHARS` and `BASE64_CHARS`,
+# so whole ``<name>=<value>`` attributes are checked against these without
+# slicing the value first.
+
+def _valid(value, chars):
+    """Check if `value` is non-empty and consists only of `chars`."""
+    # strip() is faster than translate(None, chars) for short values
+    return bool(value) and not value.strip(chars)
+
+def _parse_mext(message, start, next_attr):
+    """Find the end of the 'm' extension (``m=[^\\0=]+,``) starting at
+    `start` and followed by the `next_attr` attribute.
+
+    The extension value may contain commas, so it cannot be found by
+    splitting the message.
+
+    :return: offset of the `next_attr` attribute or -1
+    """
+    equals = message.find(b"=", start + 2)
+    if equals < start + 5 or message[equals - 2:equals] != b"," + next_attr:
+        return -1
+    if b"\0" in message[start + 2:equals]:
+        return -1
+    return equals - 1
+
+class ClientFirstMessage(object):
+    """Parsed SCRAM client first message.
+
+    :Ivariables:
+        - `message`: the message (without a trailing newline)
+        - `bare_offset`: offset of the client-first-message-bare in the
+          `message`
+        - `cb_name`: channel binding type requested or `None`
+        - `authzid`: the authorization identity (escaped) or `None`
+        - `mext`: the 'm' extension with a trailing comma or `None`
+        - `username`: the user name (escaped)
+        - `nonce`: the client nonce
+    """
+    # pylint: disable=R0903,R0913
+    __slots__ = ("message", "bare_offset", "cb_name", "authzid", "mext",
+                                                        "username", "nonce")
+    def __init__(self, message, bare_offset, cb_name, authzid, mext,
+                                                            username, nonce):
+        self.message = message
+        self.bare_offset = bare_offset
+        self.cb_name = cb_name
+        self.authzid = authzid
+        self.mext = mext
+        self.username = username
+        self.nonce = nonce
+
+    @property
+    def gs2_header(self):
+        """The GS2 header, including the final comma."""
+        return self.message[:self.bare_offset]
+
+    @property
+    def client_first_bare(self):
+        """The client-first-message-bare part of the message."""
+        return self.message[self.bare_offset:]
+
+def parse_client_first_message(message):
+    """Parse the client first message.
+
+    :Parameters:
+        - `message`: the message
+    :Types:
+        - `message`: `bytes`
+
+    :returntype: `ClientFirstMessage` or `None`
+    """
+    # pylint: disable=R0911,R0912
+    if message.endswith(b"\n"):
+        message = message[:-1]
+    parts = message.split(b",")
+    if len(parts) < 4:
+        return None
+    gs2_cbind_flag, authzid = parts[0], parts[1]
+    bare_offset = len(gs2_cbind_flag) + len(authzid) + 2
+    if gs2_cbind_flag == b"n" or gs2_cbind_flag == b"y":
+        cb_name = None
+    elif gs2_cbind_flag[:2] == b"p=" \
+                            and _valid(gs2_cbind_flag[2:], CB_NAME_CHARS):
+        cb_name = gs2_cbind_flag[2:]
+    else:
+        return None
+    if not authzid:
+        authzid = None
+    elif authzid[:2] == b"a=" and len(authzid) > 2 \
+                                        and not authzid.strip(VALUE_CHARS):
+        authzid = authzid[2:]
+    else:
+        return None
+    if parts[2][:2] == b"m=":
+        end = _parse_mext(message, bare_offset, b"n")
+        if end < 0:
+            return None
+        mext = message[bare_offset:end]
+        rest = message[end:]
+        parts = [None, None] + rest.split(b",")
+        if len(parts) < 4:
+            return None
+    else:
+        mext = None
+        rest = message
+    if rest.find(b"\n") >= 0:
+        return None
+    username, nonce = parts[2], parts[3]
+    if username[:2] != b"n=" or len(username) < 3 \
+                                            or username.strip(VALUE_CHARS):
+        return None
+    if nonce[:2] != b"r=" or len(nonce) < 3 or nonce.strip(VALUE_CHARS):
+        return None
+    return ClientFirstMessage(message, bare_offset, cb_name, authzid, mext,
+                                                    username[2:], nonce[2:])
+
+class ServerFirstMessage(object):
+    """Parsed SCRAM server first message.
+
+    :Ivariables:
+        - `message`: the message (without a trailing newline)
+        - `mext`: the 'm' extension with a trailing comma or `None`
+        - `nonce`: the nonce
+        - `salt`: the salt (base64-encoded)
+        - `iteration_count`: the iteration count (decimal digits)
+    """
+    # pylint: disable=R0903,R0913
+    __slots__ = ("message", "mext", "nonce", "salt", "iteration_count")
+    def __init__(self, message, mext, nonce, salt, iteration_count):
+        self.message = message
+        self.mext = mext
+        self.nonce = nonce
+        self.salt = salt
+        self.iteration_count = iteration_count
+
+def parse_server_first_message(message):
+    """Parse the server first message.
+
+    :Parameters:
+        - `message`: the message
+    :Types:
+        - `message`: `bytes`
+
+    :returntype: `ServerFirstMessage` or `None`
+    """
+    # pylint: disable=R0911
+    if message.endswith(b"\n"):
+        message = message[:-1]
+    if message[:2] == b"m=":
+        end = _parse_mext(message, 0, b"r")
+        if end < 0:
+            return None
+        mext = message[:end]
+        rest = message[end:]
+    else:
+        mext = None
+        rest = message
+    if rest.find(b"\n") >= 0:
+        return None
+    parts = rest.split(b",")
+    if len(parts) < 3:
+        return None
+    nonce, salt, iteration_count = parts[:3]
+    if nonce[:2] != b"r=" or len(nonce) < 3 or nonce.strip(VALUE_CHARS):
+        return None
+    if salt[:2] != b"s=" or len(salt) < 3 or salt.strip(BASE64_CHARS):
+        return None
+    if iteration_count[:2] != b"i=" \
+                            or not _valid(iteration_count[2:], DIGITS):
+        return None
+    return ServerFirstMessage(message, mext, nonce[2:], salt[2:],
+                                                        iteration_count[2:])
+
+class ClientFinalMessage(object):
+    """Parsed SCRAM client final message.
+
+    :Ivariables:
+        - `message`: the message (without a trailing newline)
+        - `proof_offset`: offset of the comma preceding the proof in the
+          `message`
+        - `cb`: the channel binding attribute value (base64-encoded)
+        - `nonce`: the nonce
+        - `proof`: the client proof (base64-encoded)
+    """
+    # pylint: disable=R0903,R0913
+    __slots__ = ("message", "proof_offset", "cb", "nonce", "proof")
+    def __init__(self, message, proof_offset, cb, nonce, proof):
+        self.message = message
+        self.proof_offset = proof_offset
+        self.cb = cb
+        self.nonce = nonce
+        self.proof = proof
+
+    @property
+    def without_proof(self):
+        """The client-final-message-without-proof part of the message."""
+        return self.message[:self.proof_offset]
+
+def parse_client_final_message(message):
+    """Parse the client final message.
+
+    :Parameters:
+        - `message`: the message
+    :Types:
+        - `message`: `bytes`
+
+    :returntype: `ClientFinalMessage` or `None`
+    """
+    if message.endswith(b"\n"):
+        message = message[:-1]
+    if message.find(b"\n") >= 0:
+        return None
+    parts = message.split(b",")
+    if len(parts) < 3:
+        return None
+    cb, nonce, proof = parts[0], parts[1], parts[-1]
+    if cb[:2] != b"c=" or len(cb) < 3 or cb.strip(BASE64_CHARS):
+        return None
+    if nonce[:2] != b"r=" or len(nonce) < 3 or nonce.strip(VALUE_CHARS):
+        return None
+    if proof[:2] != b"p=" or len(proof) < 3 or proof.strip(BASE64_CHARS):
+        return None
+    return ClientFinalMessage(message, len(message) - len(proof) - 1, cb[2:],
+                                                        nonce[2:], proof[2:])
+
+class ServerFinalMessage(object):
+    """Parsed SCRAM server final message.
+
+    :Ivariables:
+        - `error`: the server error or `None`
+        - `verifier`: the server signature (base64-encoded) or `None`
+    """
+    # pylint: disable=R0903
+    __slots__ = ("error", "verifier")
+    def __init__(self, error = None, verifier = None):
+        self.error = error
+        self.verifier = verifier
+
+def parse_server_final_message(message):
+    """Parse the server final message.
+
+    :Parameters:
+        - `message`: the message
+    :Types:
+        - `message`: `bytes`
+
+    :returntype: `ServerFinalMessage` or `None`
+    """
+    if message[:2] == b"e=":
+        # [^,]+ -- a newline is a part of the error
+        error = message[2:]
+        if not error or b"," in error:
+            return None
+        return ServerFinalMessage(error = error)
+    if message.endswith(b"\n"):
+        message = message[:-1]
+    if message.find(b"\n") >= 0:
+        return None
+    verifier = message.split(b",", 1)[0]
+    if verifier[:2] != b"v=" or len(verifier) < 3 \
+                                            or verifier.strip(BASE64_CHARS):
+        return None
+    return ServerFinalMessage(verifier = verifier[2:])
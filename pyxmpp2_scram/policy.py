@@ -0,0 +1,219 @@
+"""Iteration count policy for SCRAM servers.
+
+An `IterationPolicy` measures the speed of the Hi() implementation and
+chooses, for every hash, the iteration count for which one Hi() computation
+costs about `IterationPolicy.target_time` seconds of CPU time. The
+measurement takes several Hi() computations, so it is done at startup (by
+the constructor or `IterationPolicy.calibrate`) or when
+`store.SCRAMCredentialStore` derives credentials, never by the
+authenticators: until a hash is calibrated they use the minimum iteration
+count for it. Pass it as the ``"SCRAM-iteration-policy"`` property to `SCRAMServerAuthenticator.start`
+(or to `store.SCRAMCredentialStore`) and:
+
+  - credentials derived by the server use the calibrated iteration count,
+  - a successful exchange using stored credentials with a lower iteration
+    count sets the ``"SCRAM-upgrade-needed"`` output property, so the
+    application may re-derive them (e.g. from a legacy plain-text password
+    database or on the next password change),
+  - the Hi() computation done for unknown users (to make them
+    indistinguishable from existing ones) is rate-limited by
+    `IterationPolicy.dummy_limiter`, so a flood of logins with invalid
+    user names cannot keep all the CPUs busy. Above the limit the
+    computation is skipped, which makes the response faster.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+__docformat__ = "restructuredtext en"
+
+import time
+import logging
+import threading
+
+from . import kdf
+from .scram import HASH_DIGEST_NAMES
+
+logger = logging.getLogger("pyxmpp2_scram.policy")
+
+_clock = getattr(time, "monotonic", time.time)
+
+try:
+    _cpu_clock = time.process_time
+except AttributeError:
+    # Python 2
+    _cpu_clock = time.clock # pylint: disable=E1101
+
+# lower bound of a measured Hi() time, for clocks too coarse to measure it
+_MIN_ELAPSED = 1e-6
+
+class RateLimiter(object):
+    """Token bucket rate limiter.
+
+    :Ivariables:
+        - `rate`: tokens added per second
+        - `burst`: maximum number of tokens
+    """
+    def __init__(self, rate, burst = None):
+        """Initialize the limiter.
+
+        :Parameters:
+            - `rate`: number of allowed events per second
+            - `burst`: number of events allowed at once, `None` for `rate`
+        :Types:
+            - `rate`: `float`
+            - `burst`: `float`
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1)
+        self._tokens = self.burst
+        self._updated = _clock()
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Check if an event is allowed now, and count it if so.
+
+        :returntype: `bool`
+        """
+        with self._lock:
+            now = _clock()
+            self._tokens = min(self.burst,
+                        self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+class IterationPolicy(object):
+    """Chooses iteration counts by Hi() cost.
+
+    :Ivariables:
+        - `target_time`: target Hi() time (in seconds)
+        - `min_iterations`: minimum iteration count
+        - `max_iterations`: maximum iteration count
+        - `kdf_backend`: the measured `kdf.KDFBackend`
+        - `iteration_counts`: iteration counts by hash name
+        - `dummy_limiter`: `RateLimiter` for unknown user Hi() computations
+          or `None`
+    """
+    # pylint: disable=R0913
+    def __init__(self, target_time = 0.05, min_iterations = 4096,
+                            max_iterations = 10000000, kdf_backend = None,
+                            dummy_rate = None, hash_names = None):
+        """Initialize the policy.
+
+        The iteration counts are calibrated for `hash_names` at once, or
+        later by `calibrate`. Authenticators never calibrate: until
+        a hash is calibrated they use `min_iterations` for it and do not
+        ask for credential upgrades.
+
+        :Parameters:
+            - `target_time`: target Hi() time (in seconds)
+            - `min_iterations`: minimum iteration count (4096 is the minimum
+              recommended by RFC 5802)
+            - `max_iterations`: maximum iteration count
+            - `kdf_backend`: Hi() implementation, `None` for the default
+            - `dummy_rate`: maximum number of Hi() computations for unknown
+              users per second, `None` for no limit
+            - `hash_names`: the hashes to calibrate now, `None` for none
+        :Types:
+            - `target_time`: `float`
+            - `min_iterations`: `int`
+            - `max_iterations`: `int`
+            - `kdf_backend`: `unicode` or `kdf.KDFBackend`
+            - `dummy_rate`: `float`
+            - `hash_names`: sequence of `unicode`
+        """
+        self.target_time = target_time
+        self.min_iterations = min_iterations
+        self.max_iterations = max_iterations
+        self.kdf_backend = kdf.get_backend(kdf_backend)
+        self.iteration_counts = {}
+        if dummy_rate is not None:
+            self.dummy_limiter = RateLimiter(dummy_rate)
+        else:
+            self.dummy_limiter = None
+        self._lock = threading.Lock()
+        if hash_names is not None:
+            self.calibrate(hash_names)
+
+    def _measure(self, hash_name, iterations):
+        """Measure the CPU time of a Hi() computation."""
+        digest_name = HASH_DIGEST_NAMES[hash_name]
+        best = None
+        for _ in range(3):
+            start = _cpu_clock()
+            self.kdf_backend.derive(digest_name, b"password", b"salt" * 4,
+                                                                    iterations)
+            elapsed = _cpu_clock() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        return max(best, _MIN_ELAPSED)
+
+    def calibrate(self, hash_names = ("SHA-1", "SHA-256", "SHA-512"),
+                                                    sample_iterations = 4096):
+        """Measure Hi() and choose the iteration counts.
+
+        :Parameters:
+            - `hash_names`: the hashes to calibrate
+            - `sample_iterations`: iteration count used for measurement
+        :Types:
+            - `hash_names`: sequence of `unicode`
+            - `sample_iterations`: `int`
+
+        :return: the iteration counts by hash name
+        :returntype: `dict`
+        """
+        for hash_name in hash_names:
+            elapsed = self._measure(hash_name, sample_iterations)
+            count = int(self.target_time * sample_iterations / elapsed)
+            # round down to two significant digits
+            scale = 10 ** max(len(str(count)) - 2, 0)
+            count = count // scale * scale
+            count = max(self.min_iterations, min(self.max_iterations, count))
+            logger.debug("%s Hi() with %s backend: %.1f us per iteration,"
+                        " using %d iterations", hash_name,
+                        self.kdf_backend.name,
+                        elapsed / sample_iterations * 1000000, count)
+            with self._lock:
+                self.iteration_counts[hash_name] = count
+        return dict(self.iteration_counts)
+
+    def iteration_count(self, hash_name, calibrate = False):
+        """Get the iteration count for a hash.
+
+        :Parameters:
+            - `hash_name`: SCRAM hash name, e.g. ``"SHA-1"``
+            - `calibrate`: `True` to calibrate the hash if needed, `False`
+              to return `min_iterations` for a hash not calibrated yet
+        :Types:
+            - `hash_name`: `unicode`
+            - `calibrate`: `bool`
+
+        :returntype: `int`
+        """
+        count = self.iteration_counts.get(hash_name)
+        if count is None:
+            if not calibrate:
+                return self.min_iterations
+            count = self.calibrate((hash_name,))[hash_name]
+        return count
+
+    def needs_upgrade(self, hash_name, iteration_count):
+        """Check if credentials with an iteration count are below policy.
+
+        Always `False` for a hash not calibrated yet.
+
+        :returntype: `bool`
+        """
+        count = self.iteration_counts.get(hash_name)
+        return count is not None and iteration_count < count
+
+    def allow_dummy(self):
+        """Check if a Hi() computation for an unknown user is allowed now.
+
+        :returntype: `bool`
+        """
+        if self.dummy_limiter is None:
+            return True
+        return self.dummy_limiter.allow()
@@ -0,0 +1,166 @@
+"""Registry of the server-side SCRAM mechanisms offered together.
+
+A server usually offers several SCRAM variants (SCRAM-SHA-512, SCRAM-SHA-256,
+SCRAM-SHA-1, each with and without -PLUS). `SCRAMMechanismRegistry` builds
+the shared `scram.SCRAMServerConfig` of every variant once, reports the
+mechanism names in order of preference and creates the per-connection
+authenticators from the prepared configuration.
+
+Password databases may implement, in addition to ``get_password``, the
+``get_credentials(username, formats, properties)`` method, returning
+a dictionary of the user's credentials in all the requested formats
+available. `SCRAMMechanismRegistry.get_credentials` uses it to fetch the
+keys for every hash in a single call (`store.SCRAMCredentialStore` and
+`credfile.CredentialFile` implement it).
+
+Authenticators created by the registry for such a database look the user up
+with `SCRAMMechanismRegistry.get_credentials`. When the exchange properties
+contain a dictionary as ``"SCRAM-credentials"`` (e.g. one per connection),
+the fetched credentials are kept there by user name, so further exchanges
+with it (another mechanism after a failure, re-authentication) use them
+without querying the database again.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+__docformat__ = "restructuredtext en"
+
+from collections import OrderedDict
+
+from .scram import SCRAMServerAuthenticator, get_server_config
+
+class _RegistryDatabase(object):
+    """Password database of the authenticators created by a registry,
+    fetching the credentials for all the hashes at once."""
+    # pylint: disable=R0903
+    __slots__ = ("registry",)
+    def __init__(self, registry):
+        self.registry = registry
+
+    def get_password(self, username, formats, properties):
+        """Get the credentials of a user in one of the requested formats,
+        from the ``"SCRAM-credentials"`` property if already fetched."""
+        prefetched = properties.get("SCRAM-credentials")
+        credentials = None
+        if prefetched is not None:
+            credentials = prefetched.get(username)
+        if credentials is None:
+            credentials = self.registry.get_credentials(username, properties)
+            if prefetched is not None:
+                prefetched[username] = credentials
+        for pformat in formats:
+            password = credentials.get(pformat)
+            if password is not None:
+                return password, pformat
+        return None, None
+
+class SCRAMMechanismRegistry(object):
+    """Server-side SCRAM mechanisms with a common password database.
+
+    :Ivariables:
+        - `password_database`: the password database
+        - `hash_names`: the hash names, in order of preference
+        - `configs`: mechanism configurations by name, in order of
+          preference (-PLUS variants first)
+        - `formats`: password formats of all the mechanisms, in order of
+          preference
+        - `authenticator_class`: class of the created authenticators
+    """
+    # pylint: disable=R0913
+    def __init__(self, password_database,
+                            hash_names = ("SHA-512", "SHA-256", "SHA-1"),
+                            channel_binding = True, kdf_backend = None,
+                            authenticator_class = SCRAMServerAuthenticator):
+        """Build the mechanism configurations.
+
+        :Parameters:
+            - `password_database`: the password database
+            - `hash_names`: SCRAM hash names, in order of preference
+            - `channel_binding`: `True` to offer the -PLUS variants too
+            - `kdf_backend`: Hi() implementation, `None` for the default
+            - `authenticator_class`: `SCRAMServerAuthenticator` or
+              a subclass
+        :Types:
+            - `hash_names`: sequence of `unicode`
+            - `channel_binding`: `bool`
+            - `kdf_backend`: `unicode` or `kdf.KDFBackend`
+        """
+        self.password_database = password_database
+        self.hash_names = tuple(hash_names)
+        self.authenticator_class = authenticator_class
+        self.configs = OrderedDict()
+        for plus in ((True, False) if channel_binding else (False,)):
+            for hash_name in self.hash_names:
+                config = get_server_config(hash_name, plus, kdf_backend)
+                self.configs[config.name] = config
+        plain_configs = [config for config in self.configs.values()
+                                            if not config.channel_binding]
+        self.formats = tuple([config.k_pformat for config in plain_configs]
+                        + [config.s_pformat for config in plain_configs]
+                        + ["plain"])
+        if hasattr(password_database, "get_credentials"):
+            self._database = _RegistryDatabase(self)
+        else:
+            self._database = password_database
+
+    def mechanisms(self, channel_binding = True):
+        """Get the names of the mechanisms to offer, in order of preference.
+
+        :Parameters:
+            - `channel_binding`: `False` if there is no channel binding data
+              for the connection (no -PLUS mechanisms will be returned)
+        :Types:
+            - `channel_binding`: `bool`
+
+        :returntype: `list` of `unicode`
+        """
+        return [name for name, config in self.configs.items()
+                                if channel_binding or not config.channel_binding]
+
+    def create(self, name):
+        """Create an authenticator for a new exchange.
+
+        :Parameters:
+            - `name`: the mechanism name, as selected by the client
+        :Types:
+            - `name`: `unicode`
+
+        :returntype: `SCRAMServerAuthenticator`
+        :raises ValueError: for mechanisms not in the registry
+        """
+        config = self.configs.get(name)
+        if config is None:
+            raise ValueError("Unsupported mechanism: {0!r}".format(name))
+        return self.authenticator_class.from_config(config, self._database)
+
+    def get_credentials(self, username, properties = None):
+        """Get the credentials of a user for all the hashes.
+
+        Uses a single ``get_credentials`` call of the password database,
+        if supported, one ``get_password`` call per hash otherwise.
+
+        :Parameters:
+            - `username`: the user name
+            - `properties`: authentication properties
+        :Types:
+            - `username`: `unicode`
+            - `properties`: `dict`
+
+        :return: the credentials by password format
+        :returntype: `dict`
+        """
+        if properties is None:
+            properties = {"username": username}
+        database = self.password_database
+        if hasattr(database, "get_credentials"):
+            return database.get_credentials(username, self.formats,
+                                                                properties)
+        result = {}
+        for config in self.configs.values():
+            if config.channel_binding:
+                continue
+            password, pformat = database.get_password(username,
+                                        config.password_formats, properties)
+            if pformat is not None and password is not None:
+                result[pformat] = password
+        return result
@@ -0,0 +1,205 @@
+"""Detection of replayed SCRAM exchanges.
+
+A client final message is valid only for the exchange it was computed for.
+An authenticator accepts it once, but when the exchange state is suspended
+and restored (see `resume`), or shared between workers, a captured final
+message could be accepted again. A `NonceRegistry` given as the
+``"SCRAM-nonce-registry"`` property of `SCRAMServerAuthenticator` remembers
+the combined client and server nonces of the successful exchanges for
+a time window and makes the server reject an exchange with a nonce seen
+before.
+
+The registry is a set of Bloom filters, each collecting the nonces of one
+period of time; the oldest one is cleared and reused when a new period
+starts. Memory use is fixed (see `NonceRegistry.size`) and does not depend
+on the number of logins, at the price of false positives: with the
+probability of about `NonceRegistry.error_rate` (as long as no more than
+`NonceRegistry.capacity` exchanges per `NonceRegistry.window` seconds are
+registered) a valid exchange is rejected as a replay.
+
+With ``shared = True`` the filters are kept in anonymous shared memory, so
+a registry created before forking worker processes is shared by all of
+them.
+
+This module requires Python 3.6 or newer (for `hashlib.blake2b` and the
+integer indexing of `mmap` objects) and is not imported by the package
+``__init__``.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+__docformat__ = "restructuredtext en"
+
+import os
+import math
+import mmap
+import time
+import struct
+import hashlib
+import threading
+
+_PERIOD = struct.Struct(str("<q"))
+_HASH = struct.Struct(str("<QQ"))
+
+class NonceRegistry(object):
+    """Time-windowed set of nonces, in rotating Bloom filters.
+
+    :Ivariables:
+        - `capacity`: number of nonces per `window` the filters are sized
+          for
+        - `window`: minimum time (in seconds) a nonce is remembered for
+        - `error_rate`: target false positive rate (per filter)
+        - `generations`: number of filters
+        - `period`: time (in seconds) covered by a single filter
+        - `bits`: number of bits per filter
+        - `hash_count`: number of bits set per nonce
+        - `size`: memory used by the filters (in bytes)
+        - `lookups`: number of `add` calls (in this process)
+        - `replays`: number of nonces found (in this process)
+    """
+    # pylint: disable=R0902,R0913
+    def __init__(self, capacity = 1000000, window = 300, error_rate = 1e-6,
+                                        generations = 3, shared = False):
+        """Initialize the registry.
+
+        :Parameters:
+            - `capacity`: expected maximum number of nonces registered per
+              `window`
+            - `window`: minimum time (in seconds) a nonce is remembered for
+            - `error_rate`: target false positive rate
+            - `generations`: number of filters (at least 2); a nonce is
+              remembered for `window` to ``window * generations /
+              (generations - 1)`` seconds
+            - `shared`: `True` to keep the filters in memory shared with
+              the child processes forked later
+        :Types:
+            - `capacity`: `int`
+            - `window`: `float`
+            - `error_rate`: `float`
+            - `generations`: `int`
+            - `shared`: `bool`
+        """
+        if generations < 2:
+            raise ValueError("At least two generations needed")
+        self.capacity = capacity
+        self.window = window
+        self.error_rate = error_rate
+        self.generations = generations
+        self.period = window / (generations - 1)
+        per_filter = max(1, int(math.ceil(capacity / (generations - 1))))
+        bits = -per_filter * math.log(error_rate) / (math.log(2) ** 2)
+        self.bits = max(64, int(math.ceil(bits / 64)) * 64)
+        self.hash_count = max(1, int(round(self.bits / per_filter
+                                                        * math.log(2))))
+        self._filter_size = self.bits // 8
+        self._header_size = _PERIOD.size * generations
+        self.size = self._header_size + self._filter_size * generations
+        self.lookups = 0
+        self.replays = 0
+        if shared:
+            # anonymous mappings are shared with the forked children
+            import multiprocessing
+            self._buffer = mmap.mmap(-1, self.size)
+            self._lock = multiprocessing.Lock()
+        else:
+            self._buffer = bytearray(self.size)
+            self._lock = threading.Lock()
+        for generation in range(generations):
+            _PERIOD.pack_into(self._buffer, generation * _PERIOD.size, -1)
+        self._key = os.urandom(16)
+
+    def _positions(self, nonce):
+        """Compute the bit positions for a nonce."""
+        digest = hashlib.blake2b(nonce, digest_size = 16,
+                                                    key = self._key).digest()
+        hash1, hash2 = _HASH.unpack(digest)
+        hash2 |= 1
+        bits = self.bits
+        return [(hash1 + i * hash2) % bits for i in range(self.hash_count)]
+
+    def _rotate(self, current):
+        """Clear the filter of the current period, if it holds an older
+        one. Must be called with the lock held."""
+        generation = current % self.generations
+        offset = generation * _PERIOD.size
+        if _PERIOD.unpack_from(self._buffer, offset)[0] == current:
+            return
+        start = self._header_size + generation * self._filter_size
+        self._buffer[start:start + self._filter_size] = \
+                                                    bytes(self._filter_size)
+        _PERIOD.pack_into(self._buffer, offset, current)
+
+    def add(self, nonce, now = None):
+        """Register a nonce.
+
+        :Parameters:
+            - `nonce`: the combined client and server nonce
+            - `now`: current time, `None` for `time.time()`
+        :Types:
+            - `nonce`: `bytes`
+            - `now`: `float`
+
+        :return: `False` if the nonce was (probably) registered before
+        :returntype: `bool`
+        """
+        positions = self._positions(nonce)
+        if now is None:
+            now = time.time()
+        current = int(now // self.period)
+        buf = self._buffer
+        header_size = self._header_size
+        filter_size = self._filter_size
+        with self._lock:
+            self.lookups += 1
+            self._rotate(current)
+            for generation in range(self.generations):
+                period = _PERIOD.unpack_from(buf, generation * _PERIOD.size)[0]
+                if period <= current - self.generations or period > current:
+                    continue
+                start = header_size + generation * filter_size
+                for position in positions:
+                    if not buf[start + (position >> 3)] & 1 << (position & 7):
+                        break
+                else:
+                    self.replays += 1
+                    return False
+            start = header_size + (current % self.generations) * filter_size
+            for position in positions:
+                buf[start + (position >> 3)] |= 1 << (position & 7)
+        return True
+
+    def false_positive_rate(self, now = None):
+        """Estimate the current false positive rate, from the number of bits
+        set in the filters in use.
+
+        :returntype: `float`
+        """
+        if now is None:
+            now = time.time()
+        current = int(now // self.period)
+        miss = 1.0
+        with self._lock:
+            for generation in range(self.generations):
+                period = _PERIOD.unpack_from(self._buffer,
+                                            generation * _PERIOD.size)[0]
+                if period <= current - self.generations or period > current:
+                    continue
+                start = self._header_size + generation * self._filter_size
+                data = bytes(self._buffer[start:start + self._filter_size])
+                ones = 0
+                for chunk in range(0, len(data), 65536):
+                    ones += bin(int.from_bytes(data[chunk:chunk + 65536],
+                                                    "little")).count("1")
+                miss *= 1.0 - (ones / self.bits) ** self.hash_count
+        return 1.0 - miss
+
+    def stats(self):
+        """Return the registry statistics.
+
+        :return: dictionary with 'size' (bytes), 'lookups' and 'replays'
+            (in this process) and the estimated 'false_positive_rate'
+        :returntype: `dict`
+        """
+        return {"size": self.size, "lookups": self.lookups,
+                    "replays": self.replays,
+                    "false_positive_rate": self.false_positive_rate()}
@@ -0,0 +1,287 @@
+"""Resumable server-side SCRAM exchanges.
+
+Between the server first and the client final message a
+`SCRAMServerAuthenticator` holds the exchange state. Normally the final
+message must reach the same authenticator object, so the same process.
+`SCRAMServerAuthenticator.suspend` turns the state into an opaque token
+and `SCRAMServerAuthenticator.resume` re-creates the authenticator from the
+token in any process, so the final message may be handled by any worker or
+node.
+
+Two codecs are provided:
+
+  - `ExchangeTokenCodec` -- the state is in the token itself, encrypted and
+    authenticated with a secret shared by all the servers. Nothing is
+    stored, but a token may be used more than once until it expires.
+  - `ExchangeStoreCodec` -- the state is kept in an `ExchangeStore` shared
+    by the servers and the token is only a random key. A token can be used
+    once. `MemoryExchangeStore` is a local, in-process implementation (for
+    a single process or for testing); shared stores (memcached, Redis,
+    a database) need only to implement `ExchangeStore.put` and
+    `ExchangeStore.pop`.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+__docformat__ = "restructuredtext en"
+
+import os
+import time
+import hmac
+import struct
+import hashlib
+
+from .cache import LRUCache
+from .core import bytes_to_int, int_to_bytes
+from .exceptions import NotAuthorizedException
+
+_NONE_LENGTH = 0xffff
+_LENGTH = struct.Struct(str("!H"))
+_TOKEN_HEADER = struct.Struct(str("!BQ"))
+_TOKEN_VERSION = 1
+_TOKEN_NONCE_SIZE = 16
+_TOKEN_MAC_SIZE = 32
+
+def pack_fields(fields):
+    """Serialize a sequence of byte strings (or `None` values).
+
+    :returntype: `bytes`
+    """
+    result = []
+    for field in fields:
+        if field is None:
+            result.append(_LENGTH.pack(_NONE_LENGTH))
+            continue
+        if len(field) >= _NONE_LENGTH:
+            raise ValueError("Exchange state field too long")
+        result.append(_LENGTH.pack(len(field)))
+        result.append(field)
+    return b"".join(result)
+
+def unpack_fields(data):
+    """Deserialize data serialized with `pack_fields`.
+
+    :returntype: `list` of `bytes`
+    :raises ValueError: on malformed data
+    """
+    fields = []
+    pos = 0
+    while pos < len(data):
+        if pos + _LENGTH.size > len(data):
+            raise ValueError("Truncated exchange state")
+        length = _LENGTH.unpack_from(data, pos)[0]
+        pos += _LENGTH.size
+        if length == _NONE_LENGTH:
+            fields.append(None)
+            continue
+        if pos + length > len(data):
+            raise ValueError("Truncated exchange state")
+        fields.append(data[pos:pos + length])
+        pos += length
+    return fields
+
+class ExchangeTokenCodec(object):
+    """Stores the exchange state in self-contained tokens.
+
+    The serialized state is encrypted with a HMAC-SHA256 key stream
+    (the state contains the StoredKey and ServerKey, which must not leak)
+    and the token is authenticated with HMAC-SHA256. Both keys are derived
+    from the `secret`, which must be shared by all servers resuming the
+    exchanges.
+
+    A token can be used until it expires, so an intercepted client final
+    message can be replayed together with its token within `ttl`.
+    Use `ExchangeStoreCodec` if that is not acceptable.
+
+    :Ivariables:
+        - `ttl`: token lifetime in seconds
+    """
+    def __init__(self, secret, ttl = 60):
+        """Initialize the codec.
+
+        :Parameters:
+            - `secret`: secret key shared by the servers (at least 16
+              random bytes)
+            - `ttl`: token lifetime in seconds
+        :Types:
+            - `secret`: `bytes`
+            - `ttl`: `int`
+        """
+        if len(secret) < 16:
+            raise ValueError("Exchange token secret too short")
+        self.ttl = ttl
+        self._encryption_key = hmac.new(secret,
+                    b"SCRAM exchange token encryption", hashlib.sha256).digest()
+        self._mac_key = hmac.new(secret, b"SCRAM exchange token MAC",
+                                                    hashlib.sha256).digest()
+
+    def _key_stream(self, nonce, length):
+        """Generate `length` bytes of the key stream for a token nonce."""
+        blocks = []
+        for counter in range((length + 31) // 32):
+            blocks.append(hmac.new(self._encryption_key,
+                                    nonce + _LENGTH.pack(counter),
+                                    hashlib.sha256).digest())
+        return b"".join(blocks)[:length]
+
+    def _crypt(self, nonce, data):
+        """Encrypt or decrypt data."""
+        if not data:
+            return data
+        key_stream = self._key_stream(nonce, len(data))
+        return int_to_bytes(bytes_to_int(data) ^ bytes_to_int(key_stream),
+                                                                    len(data))
+
+    def dump(self, fields):
+        """Create a token.
+
+        :Parameters:
+            - `fields`: the exchange state
+        :Types:
+            - `fields`: sequence of `bytes`
+
+        :returntype: `bytes`
+        """
+        nonce = os.urandom(_TOKEN_NONCE_SIZE)
+        header = _TOKEN_HEADER.pack(_TOKEN_VERSION,
+                                            int(time.time()) + self.ttl)
+        body = header + nonce + self._crypt(nonce, pack_fields(fields))
+        return body + hmac.new(self._mac_key, body, hashlib.sha256).digest()
+
+    def load(self, token):
+        """Decode a token.
+
+        :Parameters:
+            - `token`: the token created by `dump`
+        :Types:
+            - `token`: `bytes`
+
+        :returntype: `list` of `bytes`
+        :raises NotAuthorizedException: for invalid or expired tokens
+        """
+        min_length = _TOKEN_HEADER.size + _TOKEN_NONCE_SIZE + _TOKEN_MAC_SIZE
+        if len(token) < min_length:
+            raise NotAuthorizedException("Bad exchange token")
+        body = token[:-_TOKEN_MAC_SIZE]
+        mac = hmac.new(self._mac_key, body, hashlib.sha256).digest()
+        if not hmac.compare_digest(mac, token[-_TOKEN_MAC_SIZE:]):
+            raise NotAuthorizedException("Bad exchange token")
+        version, expires = _TOKEN_HEADER.unpack_from(body)
+        if version != _TOKEN_VERSION:
+            raise NotAuthorizedException("Bad exchange token")
+        if expires < time.time():
+            raise NotAuthorizedException("Exchange token expired")
+        nonce = body[_TOKEN_HEADER.size:_TOKEN_HEADER.size + _TOKEN_NONCE_SIZE]
+        data = self._crypt(nonce, body[_TOKEN_HEADER.size
+                                                    + _TOKEN_NONCE_SIZE:])
+        try:
+            return unpack_fields(data)
+        except ValueError:
+            raise NotAuthorizedException("Bad exchange token")
+
+class ExchangeStore(object):
+    """Base class of shared stores of the suspended exchange state."""
+    def put(self, key, value, ttl):
+        """Store a value.
+
+        :Parameters:
+            - `key`: the key
+            - `value`: the value
+            - `ttl`: time (in seconds) after which the value may be dropped
+        :Types:
+            - `key`: `bytes`
+            - `value`: `bytes`
+            - `ttl`: `int`
+        """
+        raise NotImplementedError
+
+    def pop(self, key):
+        """Remove a value from the store and return it.
+
+        :Parameters:
+            - `key`: the key
+        :Types:
+            - `key`: `bytes`
+
+        :return: the value or `None` if not found or expired
+        :returntype: `bytes`
+        """
+        raise NotImplementedError
+
+class MemoryExchangeStore(ExchangeStore):
+    """In-process `ExchangeStore`.
+
+    Expired entries are dropped when new ones are added, from the oldest
+    end, so a long `ttl` entry may keep shorter ones behind it alive (though
+    they are never returned).
+
+    :Ivariables:
+        - `max_size`: maximum number of entries, oldest are dropped first
+    """
+    def __init__(self, max_size = 100000):
+        self.max_size = max_size
+        self._cache = LRUCache(max_size)
+
+    def __len__(self):
+        return len(self._cache)
+
+    def put(self, key, value, ttl):
+        self._cache.put(key, value, ttl)
+
+    def pop(self, key):
+        return self._cache.pop(key)
+
+class ExchangeStoreCodec(object):
+    """Keeps the exchange state in an `ExchangeStore`; the tokens are random
+    keys, usable once.
+
+    :Ivariables:
+        - `store`: the store
+        - `ttl`: state lifetime in seconds
+    """
+    def __init__(self, store, ttl = 60):
+        """Initialize the codec.
+
+        :Parameters:
+            - `store`: the store
+            - `ttl`: state lifetime in seconds
+        :Types:
+            - `store`: `ExchangeStore`
+            - `ttl`: `int`
+        """
+        self.store = store
+        self.ttl = ttl
+
+    def dump(self, fields):
+        """Store the exchange state.
+
+        :Parameters:
+            - `fields`: the exchange state
+        :Types:
+            - `fields`: sequence of `bytes`
+
+        :return: the token
+        :returntype: `bytes`
+        """
+        key = os.urandom(16)
+        self.store.put(key, pack_fields(fields), self.ttl)
+        return key
+
+    def load(self, token):
+        """Retrieve (and remove) the exchange state.
+
+        :Parameters:
+            - `token`: the token returned by `dump`
+        :Types:
+            - `token`: `bytes`
+
+        :returntype: `list` of `bytes`
+        :raises NotAuthorizedException: for unknown or expired tokens
+        """
+        data = self.store.pop(token)
+        if data is None:
+            raise NotAuthorizedException("Unknown or expired exchange token")
+        try:
+            return unpack_fields(data)
+        except ValueError:
+            raise NotAuthorizedException("Bad exchange state")
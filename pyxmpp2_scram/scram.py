@@ -24,16 +24,26 @@ from __future__ import absolute_import, division, unicode_literals
 
 __docformat__ = "restructuredtext en"
 
-import sys
 import re
+import time
+import struct
 import logging
 import hashlib
 import hmac
 
+from collections import namedtuple
 from binascii import a2b_base64
 from base64 import standard_b64encode
 
-from .core import default_nonce_factory
+from . import kdf
+from .cache import KeyCache, get_process_key_cache
+from .audit import redact_message
+from .instrument import timer
+from .parser import parse_client_first_message, \
+        parse_server_first_message, parse_client_final_message, \
+        parse_server_final_message
+from .core import default_nonce_factory, bytes_to_int, int_to_bytes, \
+        PrecomputedHMAC
 from .exceptions import BadChallengeException, \
         ExtraChallengeException, ServerScramError, BadSuccessException, \
         NotAuthorizedException
@@ -50,7 +60,35 @@ HASH_FACTORIES = {
         "MD-5": hashlib.md5,        # pylint: disable=E1101
         }
 
+# `hashlib` names of the hashes; ``hash_obj.name`` is upper-case on
+# Python 2.7, which `hashlib.new` and the KDF backends do not accept
+HASH_DIGEST_NAMES = {
+        "SHA-1": "sha1",
+        "SHA-224": "sha224",
+        "SHA-256": "sha256",
+        "SHA-384": "sha384",
+        "SHA-512": "sha512",
+        "MD-5": "md5",
+        }
+
 VALUE_CHARS_RE = re.compile(br"^[\x21-\x2B\x2D-\x7E]+$")
+
+# GS2 headers without authzid, by the channel binding flag, and the 'c='
+# attribute values for them (when no channel binding data follows)
+_GS2_HEADERS = {b"n": b"n,,", b"y": b"y,,"}
+_CB_VALUES = dict((header, standard_b64encode(header))
+                                        for header in _GS2_HEADERS.values())
+_CB_ATTRIBUTES = dict((header, b"c=" + value)
+                                    for header, value in _CB_VALUES.items())
+
+# maximum number of encoded ',s=...,i=...' fragments kept per mechanism
+_MAX_SALT_FRAGMENTS = 4096
+
+# wall clock start time of a suspended exchange, in its state
+_START_TIME = struct.Struct(str("!d"))
+
+# The message syntax. The messages are parsed with the equivalent functions
+# from the `parser` module.
 _QUOTED_VALUE_RE = br"(?:[\x21-\x2B\x2D-\x7E]|=2C|=3D)+"
 
 CLIENT_FIRST_MESSAGE_RE = re.compile(
@@ -83,11 +121,19 @@ SERVER_FINAL_MESSAGE_RE = re.compile(
 class SCRAMOperations(object):
     """Functions used during SCRAM authentication and defined in the RFC.
 
+    :Ivariables:
+        - `kdf_backend`: the `kdf.KDFBackend` used to compute Hi()
     """
-    def __init__(self, hash_function_name):
+    __slots__ = ("hash_function_name", "hash_factory", "digest_size",
+                                                "digest_name", "kdf_backend")
+    _side = None
+    _instrumentation = None
+    def __init__(self, hash_function_name, kdf_backend = None):
         self.hash_function_name = hash_function_name
         self.hash_factory = HASH_FACTORIES[hash_function_name]
         self.digest_size = self.hash_factory().digest_size
+        self.digest_name = HASH_DIGEST_NAMES[hash_function_name]
+        self.kdf_backend = kdf.get_backend(kdf_backend)
 
     @staticmethod
     def Normalize(str_):
@@ -106,34 +152,74 @@ class SCRAMOperations(object):
         # pylint: disable=C0103
         return hmac.new(key, str_, self.hash_factory).digest()
 
+    def keyed_HMAC(self, key):
+        """Prepare HMAC(key, str) computations for a key used more than once.
+
+        :return: function computing HMAC(key, str) for a `str` argument
+        :returntype: `core.PrecomputedHMAC`
+        """
+        # pylint: disable=C0103
+        return PrecomputedHMAC(key, self.hash_factory)
+
     def H(self, str_):
         """The H(str) function."""
         # pylint: disable=C0103
         return self.hash_factory(str_).digest()
 
-    if sys.version_info.major >= 3:
-        @staticmethod
-        # pylint: disable=C0103
-        def XOR(str1, str2):
-            """The XOR operator for two byte strings."""
-            return bytes(a ^ b for a, b in zip(str1, str2))
-    else:
-        @staticmethod
+    @staticmethod
+    def XOR(str1, str2):
+        """The XOR operator for two byte strings.
+
+        The strings are XORed as big integers; the result is as long as the
+        shorter argument."""
         # pylint: disable=C0103
-        def XOR(str1, str2):
-            """The XOR operator for two byte strings."""
-            return "".join(chr(ord(a) ^ ord(b)) for a, b in zip(str1, str2))
+        length = min(len(str1), len(str2))
+        return int_to_bytes(bytes_to_int(str1[:length])
+                                ^ bytes_to_int(str2[:length]), length)
 
     def Hi(self, str_, salt, i):
-        """The Hi(str, salt, i) function."""
+        """The Hi(str, salt, i) function.
+
+        Computed by the `kdf_backend`."""
         # pylint: disable=C0103
-        Uj = self.HMAC(str_, salt + b"\000\000\000\001") # U1
-        result = Uj
-        for _ in range(2, i + 1):
-            Uj = self.HMAC(str_, Uj)               # Uj = HMAC(str, Uj-1)
-            result = self.XOR(result,  Uj)         # ... XOR Uj-1 XOR Uj
+        instrumentation = self._instrumentation
+        if instrumentation is None:
+            return self.kdf_backend.derive(self.digest_name, str_, salt, i)
+        start = timer()
+        result = self.kdf_backend.derive(self.digest_name, str_, salt, i)
+        self._report_kdf(i, timer() - start)
         return result
 
+    def _report_kdf(self, iteration_count, seconds):
+        """Report a Hi() computation to the instrumentation (if any)."""
+        if self._instrumentation is not None:
+            self._instrumentation.kdf(self.name, self._side, iteration_count,
+                                                                    seconds)
+            self._instrumentation.phase(self.name, self._side, "kdf", seconds)
+
+    def _timed(self, phase, function, *args):
+        """Call a function, reporting the time spent as an exchange phase to
+        the instrumentation (if any)."""
+        instrumentation = self._instrumentation
+        if instrumentation is None:
+            return function(*args)
+        start = timer()
+        try:
+            return function(*args)
+        finally:
+            instrumentation.phase(self.name, self._side, phase,
+                                                            timer() - start)
+
+    def _report_failure(self, exception):
+        """Report an exception to the instrumentation (if any)."""
+        if self._instrumentation is not None:
+            self._instrumentation.failure(self.name, self._side, exception)
+
+    def _report_success(self):
+        """Report a successful exchange to the instrumentation (if any)."""
+        if self._instrumentation is not None:
+            self._instrumentation.success(self.name, self._side)
+
     @staticmethod
     def escape(data):
         """Escape the ',' and '=' characters for 'a=' and 'n=' attributes.
@@ -160,6 +246,25 @@ class SCRAMOperations(object):
         """
         return data.replace(b'=2C', b',').replace(b'=3D', b'=')
 
+def derive_keys(operations, salted_password):
+    """Compute ClientKey and ServerKey from SaltedPassword.
+
+    StoredKey is ``operations.H(client_key)``.
+
+    :Parameters:
+        - `operations`: object providing the SCRAM functions
+        - `salted_password`: the result of Hi()
+    :Types:
+        - `operations`: `SCRAMOperations`
+        - `salted_password`: `bytes`
+
+    :return: ClientKey and ServerKey
+    :returntype: (`bytes`, `bytes`)
+    """
+    salted_password_hmac = operations.keyed_HMAC(salted_password)
+    return (salted_password_hmac(b"Client Key"),
+                                        salted_password_hmac(b"Server Key"))
+
 class SCRAMClientAuthenticator(SCRAMOperations):
     """Provides SCRAM SASL authentication for a client.
 
@@ -167,19 +272,35 @@ class SCRAMClientAuthenticator(SCRAMOperations):
         - `password`: current authentication password
         - `pformat`: current authentication password format
         - `realm`: current authentication realm
+
+    The derived keys are cached in the `cache.KeyCache` given in the
+    ``"SCRAM-key-cache"`` property or, if the property is not set (or
+    `None`), in the process-wide one (if enabled). Any other value raises
+    `TypeError`.
+
+    The exchange is reported to the `instrument.Instrumentation` given in
+    the ``"SCRAM-instrumentation"`` property.
+
+    Instead of the ``"username"``, ``"password"`` and ``"authzid"``
+    properties a `credentials.ClientProfile` may be given in the
+    ``"SCRAM-client-profile"`` property. The identity and the derived keys
+    are then taken from the profile (the key cache is not used).
     """
     # pylint: disable-msg=R0902
-    def __init__(self, hash_name, channel_binding):
+    _side = "client"
+    def __init__(self, hash_name, channel_binding, kdf_backend = None):
         """Initialize a `SCRAMClientAuthenticator` object.
 
         :Parameters:
             - `hash_function_name`: hash function name, e.g. ``"SHA-1"``
             - `channel_binding`: `True` to enable channel binding
+            - `kdf_backend`: Hi() implementation, `None` for the default
         :Types:
             - `hash_function_name`: `unicode`
             - `channel_binding`: `bool`
+            - `kdf_backend`: `unicode` or `kdf.KDFBackend`
         """
-        SCRAMOperations.__init__(self, hash_name)
+        SCRAMOperations.__init__(self, hash_name, kdf_backend)
         self.name = "SCRAM-{0}".format(hash_name)
         if channel_binding:
             self.name += "-PLUS"
@@ -193,19 +314,42 @@ class SCRAMClientAuthenticator(SCRAMOperations):
         self._gs2_header = None
         self._finished = False
         self._auth_message = None
-        self._salted_password = None
+        self._server_key = None
+        self._server_key_hmac = None
         self._cb_data = None
+        self._cb_value = None
+        self._key_cache = None
+        self._profile = None
 
     @classmethod
     def are_properties_sufficient(cls, properties):
+        if "SCRAM-client-profile" in properties:
+            return True
         return "username" in properties and "password" in properties
 
     def start(self, properties):
-        self.username = properties["username"]
-        self.password = properties["password"]
-        self.authzid = properties.get("authzid", "")
-        c_nonce = properties.get("nonce_factory", default_nonce_factory)()
-        if not VALUE_CHARS_RE.match(c_nonce):
+        profile = properties.get("SCRAM-client-profile")
+        self._profile = profile
+        if profile is not None:
+            self.username = profile.username
+            self.authzid = profile.authzid
+        else:
+            self.username = properties["username"]
+            self.password = properties["password"]
+            self.authzid = properties.get("authzid", "")
+        self._instrumentation = properties.get("SCRAM-instrumentation")
+        if profile is None:
+            key_cache = properties.get("SCRAM-key-cache")
+            if key_cache is None:
+                key_cache = get_process_key_cache()
+            elif not isinstance(key_cache, KeyCache):
+                raise TypeError("SCRAM-key-cache must be a KeyCache, not {0}"
+                                            .format(type(key_cache).__name__))
+            self._key_cache = key_cache
+        nonce_factory = properties.get("nonce_factory", default_nonce_factory)
+        c_nonce = self._timed("nonce", nonce_factory)
+        if not getattr(nonce_factory, "printable", False) \
+                                    and not VALUE_CHARS_RE.match(c_nonce):
             c_nonce = standard_b64encode(c_nonce)
         self._c_nonce = c_nonce
 
@@ -215,10 +359,12 @@ class SCRAMClientAuthenticator(SCRAMOperations):
                 raise ValueError("No channel binding data provided")
             if "tls-unique" in cb_data:
                 cb_type = "tls-unique"
+            elif "tls-exporter" in cb_data:
+                cb_type = "tls-exporter"
             elif "tls-server-end-point" in cb_data:
                 cb_type = "tls-server-end-point"
-            elif cb_data:
-                cb_type = cb_data.keys()[0]
+            else:
+                cb_type = next(iter(cb_data))
             self._cb_data = cb_data[cb_type]
             cb_flag = b"p=" + cb_type.encode("utf-8")
         else:
@@ -231,18 +377,27 @@ class SCRAMClientAuthenticator(SCRAMOperations):
             else:
                 cb_flag = b"n"
 
-        if self.authzid:
-            authzid = b"a=" + self.escape(self.authzid.encode("utf-8"))
+        if profile is not None:
+            gs2_header = profile.gs2_header(cb_flag)
+            username = profile.username_attribute
         else:
-            authzid = b""
-        gs2_header = cb_flag + b"," + authzid + b","
+            if self.authzid:
+                authzid = b"a=" + self.escape(self.authzid.encode("utf-8"))
+                gs2_header = b"".join((cb_flag, b",", authzid, b","))
+            else:
+                gs2_header = _GS2_HEADERS.get(cb_flag)
+                if gs2_header is None:
+                    gs2_header = cb_flag + b",,"
+            username = b"n=" + self.escape(self.username.encode("utf-8"))
         self._gs2_header = gs2_header
-        nonce = b"r=" + c_nonce
-        client_first_message_bare = (b"n=" +
-                self.escape(self.username.encode("utf-8")) + b"," + nonce)
+        if self.channel_binding and hasattr(cb_data, "cb_value"):
+            # `binding.ChannelBindingData`
+            self._cb_value = cb_data.cb_value(cb_type, gs2_header)
+        else:
+            self._cb_value = None
+        client_first_message_bare = b"".join((username, b",r=", c_nonce))
         self._client_first_message_bare = client_first_message_bare
-        client_first_message = gs2_header + client_first_message_bare
-        return client_first_message
+        return gs2_header + client_first_message_bare
 
     def challenge(self, challenge):
         """Process a challenge and return the response.
@@ -257,39 +412,56 @@ class SCRAMClientAuthenticator(SCRAMOperations):
         :raises: `BadChallengeException`
         """
         # pylint: disable=R0911
-        if not challenge:
-            raise BadChallengeException('Empty challenge')
+        try:
+            if not challenge:
+                raise BadChallengeException('Empty challenge')
 
-        if self._server_first_message:
-            return self._final_challenge(challenge)
+            if self._server_first_message:
+                return self._timed("verify", self._final_challenge, challenge)
 
-        match = SERVER_FIRST_MESSAGE_RE.match(challenge)
-        if not match:
+            nonce, salt, iteration_count = self._timed("parse",
+                                        self._parse_first_challenge, challenge)
+            return self._make_response(nonce, salt, iteration_count)
+        except Exception as err:
+            self._report_failure(err)
+            raise
+
+    def _parse_first_challenge(self, challenge):
+        """Parse the server first message.
+
+        :return: the nonce, salt and iteration count
+        :returntype: (`bytes`, `bytes`, `int`)
+        :raises: `BadChallengeException`
+        """
+        parsed = parse_server_first_message(challenge)
+        if parsed is None:
             raise BadChallengeException("Bad challenge syntax: {0!r}".format(challenge))
 
         self._server_first_message = challenge
 
-        mext = match.group("mext")
+        mext = parsed.mext
         if mext:
             raise BadChallengeException("Unsupported extension received: {0!r}".format(mext))
 
-        nonce = match.group("nonce")
+        nonce = parsed.nonce
         if not nonce.startswith(self._c_nonce):
             raise BadChallengeException("Nonce does not start with our nonce")
 
-        salt = match.group("salt")
+        salt = parsed.salt
         try:
             salt = a2b_base64(salt)
         except ValueError:
             raise BadChallengeException("Bad base64 encoding for salt: {0!r}".format(salt))
 
-        iteration_count = match.group("iteration_count")
+        iteration_count = parsed.iteration_count
         try:
             iteration_count = int(iteration_count)
         except ValueError:
             raise BadChallengeException("Bad iteration_count: {0!r}".format(iteration_count))
+        if iteration_count < 1:
+            raise BadChallengeException("Bad iteration_count: {0!r}".format(iteration_count))
 
-        return self._make_response(nonce, salt, iteration_count)
+        return nonce, salt, iteration_count
 
     def _make_response(self, nonce, salt, iteration_count):
         """Make a response for the first challenge from the server.
@@ -297,30 +469,85 @@ class SCRAMClientAuthenticator(SCRAMOperations):
         :return: the response
         :returntype: bytes
         """
-        self._salted_password = self.Hi(self.Normalize(self.password), salt,
-                                                            iteration_count)
+        if self._profile is not None:
+            keys, cached = self._profile.get_keys(self, salt, iteration_count)
+            if self._instrumentation is not None:
+                self._instrumentation.cache(self.name, cached)
+            return self._timed("proof", self._make_final_message, nonce,
+                                keys.client_key, keys.server_key,
+                                keys.stored_key_hmac, keys.server_key_hmac)
+        client_key, server_key = self._derive_keys(
+                        self.Normalize(self.password), salt, iteration_count)
         self.password = None # not needed any more
-        if self.channel_binding:
+        return self._timed("proof", self._make_final_message, nonce,
+                                                    client_key, server_key)
+
+    # pylint: disable=R0913
+    def _make_final_message(self, nonce, client_key, server_key,
+                            stored_key_hmac = None, server_key_hmac = None):
+        """Build the client final message from the derived keys.
+
+        :Parameters:
+            - `nonce`: the combined nonce
+            - `client_key`: ClientKey
+            - `server_key`: ServerKey
+            - `stored_key_hmac`: precomputed HMAC(StoredKey, ...), if
+              available
+            - `server_key_hmac`: precomputed HMAC(ServerKey, ...), if
+              available
+
+        :return: the response
+        :returntype: bytes
+        """
+        self._server_key = server_key
+        self._server_key_hmac = server_key_hmac
+        if self._cb_value is not None:
+            channel_binding = b"c=" + self._cb_value
+        elif self.channel_binding:
             channel_binding = b"c=" + standard_b64encode(self._gs2_header +
                                                                 self._cb_data)
         else:
-            channel_binding = b"c=" + standard_b64encode(self._gs2_header)
+            channel_binding = _CB_ATTRIBUTES.get(self._gs2_header)
+            if channel_binding is None:
+                channel_binding = b"c=" + standard_b64encode(self._gs2_header)
 
         # pylint: disable=C0103
-        client_final_message_without_proof = (channel_binding + b",r=" + nonce)
+        client_final_message_without_proof = b"".join((channel_binding,
+                                                            b",r=", nonce))
 
-        client_key = self.HMAC(self._salted_password, b"Client Key")
-        stored_key = self.H(client_key)
-        auth_message = ( self._client_first_message_bare + b"," +
-                                    self._server_first_message + b"," +
-                                        client_final_message_without_proof )
+        auth_message = b"".join((self._client_first_message_bare, b",",
+                                    self._server_first_message, b",",
+                                    client_final_message_without_proof))
         self._auth_message = auth_message
-        client_signature = self.HMAC(stored_key, auth_message)
+        if stored_key_hmac is not None:
+            client_signature = stored_key_hmac(auth_message)
+        else:
+            client_signature = self.HMAC(self.H(client_key), auth_message)
         client_proof = self.XOR(client_key, client_signature)
-        proof = b"p=" + standard_b64encode(client_proof)
-        client_final_message = (client_final_message_without_proof + b"," +
-                                                                    proof)
-        return client_final_message
+        return b"".join((client_final_message_without_proof, b",p=",
+                                            standard_b64encode(client_proof)))
+
+    def _derive_keys(self, password, salt, iteration_count):
+        """Compute ClientKey and ServerKey for the password, using the key
+        cache if available.
+
+        :return: ClientKey and ServerKey
+        :returntype: `tuple` of `bytes`
+        """
+        def compute():
+            """Derive the keys from the password."""
+            return derive_keys(self, self.Hi(password, salt, iteration_count))
+        if self._key_cache is None:
+            return compute()
+        key = self._key_cache.make_key(self.hash_function_name, self.username,
+                                            password, salt, iteration_count)
+        if self._instrumentation is None:
+            return self._key_cache.get_or_compute(key, compute)
+        computed = []
+        keys = self._key_cache.get_or_compute(key,
+                                    lambda: computed.append(1) or compute())
+        self._instrumentation.cache(self.name, not computed)
+        return keys
 
     def _final_challenge(self, challenge):
         """Process the second challenge from the server and return the
@@ -336,24 +563,27 @@ class SCRAMClientAuthenticator(SCRAMOperations):
         if self._finished:
             return ExtraChallengeException()
 
-        match = SERVER_FINAL_MESSAGE_RE.match(challenge)
-        if not match:
+        parsed = parse_server_final_message(challenge)
+        if parsed is None:
             raise BadChallengeException("Bad final message syntax: {0!r}".format(challenge))
 
-        error = match.group("error")
+        error = parsed.error
         if error:
             raise ServerScramError("{0!r}".format(error))
 
-        verifier = match.group("verifier")
+        verifier = parsed.verifier
         if not verifier:
             raise BadSuccessException("No verifier value in the final message")
 
-        server_key = self.HMAC(self._salted_password, b"Server Key")
-        server_signature = self.HMAC(server_key, self._auth_message)
+        if self._server_key_hmac is not None:
+            server_signature = self._server_key_hmac(self._auth_message)
+        else:
+            server_signature = self.HMAC(self._server_key, self._auth_message)
         if server_signature != a2b_base64(verifier):
             raise BadSuccessException("Server verifier does not match")
 
         self._finished = True
+        self._report_success()
 
     def finish(self, data):
         """Process success indicator from the server.
@@ -369,71 +599,458 @@ class SCRAMClientAuthenticator(SCRAMOperations):
         :return: username and authzid
         :returntype: `dict`
         :raises: `BadSuccessException`"""
-        if not self._server_first_message:
-            raise BadSuccessException("Got success too early")
-        if self._finished:
-            return {"username": self.username, "authzid": self.authzid}
-        else:
-            self._final_challenge(data)
+        try:
+            if not self._server_first_message:
+                raise BadSuccessException("Got success too early")
             if self._finished:
-                return {"username": self.username,
-                                                    "authzid": self.authzid}
+                return {"username": self.username, "authzid": self.authzid}
             else:
-                raise BadSuccessException("Something went wrong when processing additional"
+                self._timed("verify", self._final_challenge, data)
+                if self._finished:
+                    return {"username": self.username,
+                                                    "authzid": self.authzid}
+                else:
+                    raise BadSuccessException("Something went wrong when processing additional"
                                                         " data with success?")
+        except Exception as err:
+            self._report_failure(err)
+            raise
+
+class PendingKeys(object):
+    """StoredKey and ServerKey for a server-side exchange, possibly still
+    waiting for the Hi() computation.
+
+    :Ivariables:
+        - `salt`: the salt
+        - `iteration_count`: the iteration count
+        - `stored_key`: StoredKey, `None` until known
+        - `server_key`: ServerKey, `None` until known
+        - `password`: the normalized password to compute Hi() of, `None` if
+          not needed
+        - `known`: `False` when the keys are computed only to hide the fact
+          that the user does not exist
+        - `stored`: `True` when the salt and iteration count come from the
+          stored credentials (and so are worth caching the encoded form of)
+    """
+    # pylint: disable=R0903,R0913
+    __slots__ = ("salt", "iteration_count", "stored_key", "server_key",
+                                            "password", "known", "stored")
+    def __init__(self, salt, iteration_count, stored_key = None,
+                            server_key = None, password = None, known = True,
+                            stored = False):
+        self.salt = salt
+        self.iteration_count = iteration_count
+        self.stored_key = stored_key
+        self.server_key = server_key
+        self.password = password
+        self.known = known
+        self.stored = stored
+
+    def set_salted_password(self, operations, salted_password):
+        """Compute the keys from SaltedPassword.
+
+        :Parameters:
+            - `operations`: object providing the SCRAM functions
+            - `salted_password`: the result of Hi()
+        :Types:
+            - `operations`: `SCRAMOperations`
+            - `salted_password`: `bytes`
+        """
+        client_key, self.server_key = derive_keys(operations,
+                                                            salted_password)
+        self.stored_key = operations.H(client_key)
+        self.password = None
+
+class SCRAMServerConfig(namedtuple("SCRAMServerConfig", "name"
+                            " hash_function_name hash_factory digest_size"
+                            " digest_name kdf_backend channel_binding"
+                            " s_pformat k_pformat password_formats"
+                            " salt_fragments")):
+    """Configuration of a server-side SCRAM mechanism, shared by all its
+    `SCRAMServerAuthenticator` objects.
+
+    The fields are never reassigned, but `salt_fragments` is a mutable
+    cache, filled by the authenticators.
+
+    Use `get_server_config` to get one.
+
+    :Ivariables:
+        - `name`: the mechanism name, e.g. ``"SCRAM-SHA-1-PLUS"``
+        - `hash_function_name`: hash function name, e.g. ``"SHA-1"``
+        - `hash_factory`: the hash constructor
+        - `digest_size`: the hash digest size
+        - `digest_name`: the `hashlib` name of the hash
+        - `kdf_backend`: the `kdf.KDFBackend` used to compute Hi()
+        - `channel_binding`: `True` for the -PLUS variant
+        - `s_pformat`: the ``"SCRAM-<hash>-SaltedPassword"`` password format
+        - `k_pformat`: the ``"SCRAM-<hash>-Keys"`` password format
+        - `password_formats`: password formats requested from the password
+          database, in order of preference
+        - `salt_fragments`: cache of the encoded ``,s=<salt>,i=<count>``
+          server first message fragments, by (salt, iteration count) of the
+          stored credentials
+    """
+    # pylint: disable=R0903
+    __slots__ = ()
+
+_SERVER_CONFIGS = {}
+
+def get_server_config(hash_name, channel_binding, kdf_backend = None):
+    """Get the shared configuration of a server-side SCRAM mechanism.
+
+    Configurations are cached by the hash, the variant and the KDF backend
+    name; a `kdf.KDFBackend` instance other than the one registered under
+    its name gets a new, uncached configuration.
+
+    :Parameters:
+        - `hash_name`: hash function name, e.g. ``"SHA-1"``
+        - `channel_binding`: `True` for the -PLUS variant
+        - `kdf_backend`: Hi() implementation, `None` for the default
+    :Types:
+        - `hash_name`: `unicode`
+        - `channel_binding`: `bool`
+        - `kdf_backend`: `unicode` or `kdf.KDFBackend`
+
+    :returntype: `SCRAMServerConfig`
+    """
+    kdf_backend = kdf.get_backend(kdf_backend)
+    key = (hash_name, bool(channel_binding), kdf_backend.name)
+    config = _SERVER_CONFIGS.get(key)
+    if config is not None and config.kdf_backend is kdf_backend:
+        return config
+    operations = SCRAMOperations(hash_name, kdf_backend)
+    name = "SCRAM-{0}".format(hash_name)
+    if channel_binding:
+        name += "-PLUS"
+    s_pformat = "SCRAM-{0}-SaltedPassword".format(hash_name)
+    k_pformat = "SCRAM-{0}-Keys".format(hash_name)
+    config = SCRAMServerConfig(name, hash_name, operations.hash_factory,
+                        operations.digest_size, operations.digest_name,
+                        kdf_backend, bool(channel_binding), s_pformat,
+                        k_pformat, (k_pformat, s_pformat, "plain"), {})
+    try:
+        registered = kdf.get_backend(kdf_backend.name) is kdf_backend
+    except ValueError:
+        registered = False
+    if not registered:
+        return config
+    return _SERVER_CONFIGS.setdefault(key, config)
+
+def _salt_fragment(config, salt, iteration_count):
+    """Get the ``,s=<salt>,i=<count>`` part of the server first message for
+    stored credentials, encoding it once per credential.
+
+    :returntype: `bytes`
+    """
+    fragments = config.salt_fragments
+    key = (salt, iteration_count)
+    fragment = fragments.get(key)
+    if fragment is None:
+        fragment = b"".join((b",s=", standard_b64encode(salt), b",i=",
+                                        str(iteration_count).encode("ascii")))
+        if len(fragments) >= _MAX_SALT_FRAGMENTS:
+            fragments.clear()
+        fragments[key] = fragment
+    return fragment
 
 class SCRAMServerAuthenticator(SCRAMOperations):
     """Provides SCRAM SASL authentication for a server.
+
+    The exchange is reported to the `instrument.Instrumentation` given in
+    the ``"SCRAM-instrumentation"`` property.
+
+    The iteration count for credentials derived by the server is taken from
+    the ``"SCRAM-iteration-count"`` property or, if not set, from the
+    `policy.IterationPolicy` given in the ``"SCRAM-iteration-policy"``
+    property (4096 if neither is given). With a policy, the
+    ``"SCRAM-upgrade-needed"`` output property is set when the stored
+    credentials use a lower iteration count.
+
+    For users unknown to the password database, the fake credentials from
+    the `decoy.DecoyCredentials` given in the ``"SCRAM-decoy-credentials"``
+    property are used, if set. Otherwise Hi() of an empty password with
+    a random salt is computed.
+
+    With a `replay.NonceRegistry` given in the ``"SCRAM-nonce-registry"``
+    property, a successful exchange is rejected if its nonce was used
+    before.
+
+    Finished exchanges are recorded in the `audit.AuditLog` given in the
+    ``"SCRAM-audit-log"`` property, if any.
+
+    The authenticator keeps only the exchange state, in slots; everything
+    that depends only on the mechanism is in the shared `config`.
+
+    :Ivariables:
+        - `config`: the mechanism configuration
+        - `password_database`: the password database
+        - `properties`: the authentication properties
+        - `out_properties`: the properties established by the exchange
     """
-    def __init__(self, hash_name, channel_binding, password_database):
-        """Initialize a `SCRAMClientAuthenticator` object.
+    __slots__ = ("config", "password_database", "properties",
+                "out_properties", "_instrumentation", "_client_first",
+                "_client_first_message_bare", "_server_first_message",
+                "_cb_name", "_gs2_header", "_stored_key", "_server_key",
+                "_audit", "_started")
+    _side = "server"
+    def __init__(self, hash_name, channel_binding, password_database,
+                                                        kdf_backend = None):
+        """Initialize a `SCRAMServerAuthenticator` object.
 
         :Parameters:
             - `hash_function_name`: hash function name, e.g. ``"SHA-1"``
             - `channel_binding`: `True` to enable channel binding
+            - `kdf_backend`: Hi() implementation, `None` for the default
         :Types:
             - `hash_function_name`: `unicode`
             - `channel_binding`: `bool`
+            - `kdf_backend`: `unicode` or `kdf.KDFBackend`
         """
-        SCRAMOperations.__init__(self, hash_name)
-        self.name = "SCRAM-{0}".format(hash_name)
-        if channel_binding:
-            self.name += "-PLUS"
-        self.channel_binding = channel_binding
+        # pylint: disable=W0231
+        self._configure(get_server_config(hash_name, channel_binding,
+                                            kdf_backend), password_database)
+
+    @classmethod
+    def from_config(cls, config, password_database):
+        """Create an authenticator for a mechanism configuration.
+
+        :Parameters:
+            - `config`: the mechanism configuration
+            - `password_database`: the password database
+        :Types:
+            - `config`: `SCRAMServerConfig`
+
+        :returntype: `SCRAMServerAuthenticator`
+        """
+        # pylint: disable=W0212
+        authenticator = cls.__new__(cls)
+        authenticator._configure(config, password_database)
+        return authenticator
+
+    def _configure(self, config, password_database):
+        """Initialize the authenticator for a mechanism configuration."""
+        self.config = config
+        self.hash_function_name = config.hash_function_name
+        self.hash_factory = config.hash_factory
+        self.digest_size = config.digest_size
+        self.digest_name = config.digest_name
+        self.kdf_backend = config.kdf_backend
+        self.password_database = password_database
         self.properties = None
         self.out_properties = None
-        self.password_database = password_database
+        self._instrumentation = None
+        self._client_first = None
         self._client_first_message_bare = None
+        self._server_first_message = None
+        self._cb_name = None
+        self._gs2_header = None
         self._stored_key = None
         self._server_key = None
+        self._audit = None
+        self._started = None
+
+    @property
+    def name(self):
+        """The mechanism name."""
+        return self.config.name
+
+    @property
+    def channel_binding(self):
+        """`True` for the -PLUS variant."""
+        return self.config.channel_binding
+
+    @property
+    def _password_formats(self):
+        """Password formats requested from the password database."""
+        return self.config.password_formats
 
     def start(self, properties, initial_response):
-        self.properties = properties
-        self._client_first_message_bare = None
-        self.out_properties = {}
+        self._reset(properties)
         if not initial_response:
             return b""
         return self.response(initial_response)
 
-    def response(self, response):
-        if self._client_first_message_bare:
-            logger.debug("Client final message: {0!r}".format(response))
-            return self._handle_final_response(response)
+    def _reset(self, properties):
+        """Prepare for a new exchange."""
+        self.properties = properties
+        self._client_first_message_bare = None
+        self._client_first = None
+        self.out_properties = {}
+        self._instrumentation = properties.get("SCRAM-instrumentation")
+        self._audit = properties.get("SCRAM-audit-log")
+        if self._audit is not None:
+            self._started = timer()
+
+    def suspend(self, codec):
+        """Save the exchange state after the server first message, so the
+        client final message may be processed by an authenticator created
+        with `resume` (possibly in a different process).
+
+        :Parameters:
+            - `codec`: state codec, e.g. a `resume.ExchangeTokenCodec`
+        :Types:
+            - `codec`: `resume.ExchangeTokenCodec` or
+              `resume.ExchangeStoreCodec`
+
+        :return: the token to pass to `resume`
+        :returntype: `bytes`
+        """
+        if not self._client_first_message_bare:
+            raise ValueError("No exchange in progress")
+        authzid = self.out_properties["authzid"]
+        if self._cb_name:
+            cb_name = self._cb_name.encode("utf-8")
+        else:
+            cb_name = None
+        if self._started is not None:
+            # `timer` values are meaningless in other processes
+            started = _START_TIME.pack(time.time()
+                                                - (timer() - self._started))
+        else:
+            started = None
+        return codec.dump((self.config.name.encode("utf-8"),
+                    self._gs2_header, cb_name,
+                    self._client_first_message_bare,
+                    self._server_first_message,
+                    self._stored_key, self._server_key,
+                    self.out_properties["username"].encode("utf-8"),
+                    authzid.encode("utf-8") if authzid is not None else None,
+                    started))
+
+    @classmethod
+    def resume(cls, codec, token, properties, password_database = None,
+                                                        kdf_backend = None):
+        """Re-create an authenticator suspended with `suspend`.
+
+        The `response` method of the new authenticator accepts the client
+        final message. The exchange duration reported to the audit log
+        includes the time it was suspended.
+
+        :Parameters:
+            - `codec`: the state codec used by `suspend`
+            - `token`: the token returned by `suspend`
+            - `properties`: the authentication properties (as passed to
+              `start`)
+            - `password_database`: the password database
+            - `kdf_backend`: Hi() implementation, `None` for the default
+        :Types:
+            - `token`: `bytes`
+            - `properties`: `dict`
+            - `kdf_backend`: `unicode` or `kdf.KDFBackend`
+
+        :returntype: `SCRAMServerAuthenticator`
+        :raises NotAuthorizedException: for invalid or expired tokens
+        """
+        # pylint: disable=W0212
+        fields = codec.load(token)
+        if len(fields) != 10:
+            raise NotAuthorizedException("Bad exchange state")
+        (name, gs2_header, cb_name, client_first_message_bare,
+                server_first_message, stored_key, server_key, username,
+                                                authzid, started) = fields
+        if started is not None and len(started) != _START_TIME.size:
+            raise NotAuthorizedException("Bad exchange state")
+        name = name.decode("utf-8")
+        if not name.startswith("SCRAM-"):
+            raise NotAuthorizedException("Bad exchange state")
+        if name.endswith("-PLUS"):
+            hash_name, channel_binding = name[6:-5], True
         else:
-            logger.debug("Client first message: {0!r}".format(response))
-            return self._handle_first_response(response)
+            hash_name, channel_binding = name[6:], False
+        if hash_name not in HASH_FACTORIES:
+            raise NotAuthorizedException("Bad exchange state")
+        config = get_server_config(hash_name, channel_binding, kdf_backend)
+        authenticator = cls.from_config(config, password_database)
+        authenticator._reset(properties)
+        if started is not None and authenticator._started is not None:
+            authenticator._started = timer() - (time.time()
+                                        - _START_TIME.unpack(started)[0])
+        authenticator._gs2_header = gs2_header
+        if cb_name is not None:
+            authenticator._cb_name = cb_name.decode("utf-8")
+        authenticator._client_first_message_bare = client_first_message_bare
+        authenticator._server_first_message = server_first_message
+        authenticator._stored_key = stored_key
+        authenticator._server_key = server_key
+        authenticator.out_properties["username"] = username.decode("utf-8")
+        if authzid is not None:
+            authzid = authzid.decode("utf-8")
+        authenticator.out_properties["authzid"] = authzid
+        return authenticator
+
+    def response(self, response):
+        try:
+            if self._client_first_message_bare:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Client final message: %r",
+                                                redact_message(response))
+                result = self._timed("verify", self._handle_final_response,
+                                                                    response)
+                self._report_success()
+                return result
+            else:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Client first message: %r",
+                                                redact_message(response))
+                return self._handle_first_response(response)
+        except Exception as err:
+            self._report_failure(err)
+            raise
+
+    def _report_failure(self, exception):
+        """Report an exception to the instrumentation and the audit log (if
+        any)."""
+        SCRAMOperations._report_failure(self, exception)
+        audit = self._audit
+        if audit is not None:
+            out_properties = self.out_properties or {}
+            audit.failure(self.name, self._side,
+                            out_properties.get("username"),
+                            out_properties.get("authzid"), exception,
+                            timer() - self._started)
+
+    def _report_success(self):
+        """Report a successful exchange to the instrumentation and the audit
+        log (if any)."""
+        SCRAMOperations._report_success(self)
+        audit = self._audit
+        if audit is not None:
+            audit.success(self.name, self._side,
+                            self.out_properties["username"],
+                            self.out_properties["authzid"],
+                            timer() - self._started)
 
     def _handle_first_response(self, response):
-        match = CLIENT_FIRST_MESSAGE_RE.match(response)
-        if not match:
+        username, properties = self._timed("parse",
+                                    self._parse_first_response, response)
+        password, pformat = self._timed("lookup",
+                                    self.password_database.get_password,
+                                    username, self._password_formats, properties)
+        pending = self._prepare_keys(username, password, pformat)
+        if pending.password is not None:
+            pending.set_salted_password(self, self.Hi(pending.password,
+                                    pending.salt, pending.iteration_count))
+        return self._build_server_first_message(pending)
+
+    def _parse_first_response(self, response):
+        """Parse the client first message and check its GS2 header.
+
+        Sets the 'username' and 'authzid' `out_properties`.
+
+        :return: the user name and the properties to pass to the password
+            database
+        :returntype: (`unicode`, `dict`)
+        """
+        parsed = parse_client_first_message(response)
+        if parsed is None:
             raise NotAuthorizedException("Bad response syntax: {0!r}".format(response))
 
-        mext = match.group("mext")
+        mext = parsed.mext
         if mext:
             raise NotAuthorizedException("Unsupported extension received: {0!r}".format(mext))
 
-        gs2_header = match.group("gs2_header")
-        cb_name = match.group("cb_name")
+        gs2_header = parsed.gs2_header
+        cb_name = parsed.cb_name
         if self.channel_binding:
             if not cb_name:
                 raise NotAuthorizedException("{0!r} used with no channel-binding"
@@ -452,82 +1069,157 @@ class SCRAMServerAuthenticator(SCRAMOperations):
                 raise NotAuthorizedException("Channel binding requested for {0!r}"
                                                             .format(self.name))
 
-        authzid = match.group("authzid")
+        authzid = parsed.authzid
         if authzid:
             self.out_properties['authzid'] = self.unescape(authzid
                                                             ).decode("utf-8")
         else:
             self.out_properties['authzid'] = None
-        username = self.unescape(match.group("username")).decode("utf-8")
+        username = self.unescape(parsed.username).decode("utf-8")
         self.out_properties['username'] = username
 
-        nonce_factory = self.properties.get("nonce_factory",
-                                                        default_nonce_factory)
+        self._client_first = parsed
+        self._cb_name = cb_name
+        self._gs2_header = gs2_header
 
         properties = dict(self.properties)
         properties.update(self.out_properties)
+        return username, properties
 
-        s_pformat = "SCRAM-{0}-SaltedPassword".format(self.hash_function_name)
-        k_pformat = "SCRAM-{0}-Keys".format(self.hash_function_name)
-        password, pformat = self.password_database.get_password(username,
-                                           (s_pformat, "plain"), properties)
-        if pformat == s_pformat:
-            if password is not None:
-                salt, iteration_count, salted_password = password
-            else:
-                logger.debug("No password for user {0!r}".format(username))
-        elif pformat != k_pformat:
-            salt = self.properties.get("SCRAM-salt")
-            if not salt:
-                salt = nonce_factory()
-            iteration_count = self.properties.get("SCRAM-iteration-count", 4096)
-            if pformat == "plain" and password is not None:
-                salted_password = self.Hi(self.Normalize(password), salt,
-                                                            iteration_count)
-            else:
-                logger.debug("No password for user {0!r}".format(username))
-                password = None
-                # to prevent timing attack, compute the key anyway
-                salted_password = self.Hi(self.Normalize(""), salt,
-                                                            iteration_count)
-        if pformat == k_pformat:
+    def _prepare_keys(self, username, password, pformat):
+        """Decide how to get the StoredKey and ServerKey from the password
+        database result.
+
+        :return: the keys or the Hi() computation needed to get them
+        :returntype: `PendingKeys`
+        """
+        policy = self.properties.get("SCRAM-iteration-policy")
+        if pformat == self.config.k_pformat and password is not None:
             salt, iteration_count, stored_key, server_key = password
-        else:
-            client_key = self.HMAC(salted_password, b"Client Key")
-            stored_key = self.H(client_key)
-            server_key = self.HMAC(salted_password, b"Server Key")
+            self._check_policy(policy, iteration_count)
+            return PendingKeys(salt, iteration_count, stored_key, server_key,
+                                                                stored = True)
+        if pformat == self.config.s_pformat and password is not None:
+            salt, iteration_count, salted_password = password
+            self._check_policy(policy, iteration_count)
+            pending = PendingKeys(salt, iteration_count, stored = True)
+            pending.set_salted_password(self, salted_password)
+            return pending
+        salt = self.properties.get("SCRAM-salt")
+        if not salt:
+            salt = self.properties.get("nonce_factory",
+                                                    default_nonce_factory)()
+        iteration_count = self.properties.get("SCRAM-iteration-count")
+        if iteration_count is None:
+            if policy is not None:
+                iteration_count = policy.iteration_count(
+                                                self.config.hash_function_name)
+            else:
+                iteration_count = 4096
+        if pformat == "plain" and password is not None:
+            return PendingKeys(salt, iteration_count,
+                                        password = self.Normalize(password))
+        logger.debug("No password for user %r", username)
+        decoys = self.properties.get("SCRAM-decoy-credentials")
+        if decoys is not None:
+            salt, iteration_count, stored_key, server_key = decoys.get_keys(
+                    self.config.hash_function_name, username, iteration_count)
+            return PendingKeys(salt, iteration_count, stored_key, server_key,
+                                                                known = False)
+        if policy is not None and not policy.allow_dummy():
+            logger.debug("Unknown user Hi() rate limit exceeded")
+            return PendingKeys(salt, iteration_count, known = False)
+        # to prevent timing attack, compute the key anyway
+        return PendingKeys(salt, iteration_count,
+                                password = self.Normalize(""), known = False)
+
+    def _check_policy(self, policy, iteration_count):
+        """Set the 'SCRAM-upgrade-needed' `out_properties` if the stored
+        credentials use an iteration count below the policy."""
+        if policy is not None and policy.needs_upgrade(
+                            self.config.hash_function_name, iteration_count):
+            self.out_properties["SCRAM-upgrade-needed"] = True
+
+    def _build_server_first_message(self, pending):
+        """Generate the server nonce and build the server first message,
+        reporting the ``"nonce"`` and ``"build"`` phases separately.
+
+        :Parameters:
+            - `pending`: the keys, with Hi() already computed
+        :Types:
+            - `pending`: `PendingKeys`
+
+        :returntype: `bytes`
+        """
+        nonce_factory = self.properties.get("nonce_factory",
+                                                    default_nonce_factory)
+        s_nonce = self._timed("nonce", nonce_factory)
+        if not getattr(nonce_factory, "printable", False) \
+                                    and not VALUE_CHARS_RE.match(s_nonce):
+            s_nonce = standard_b64encode(s_nonce)
+        return self._timed("build", self._make_server_first_message, pending,
+                                                                    s_nonce)
 
-        if password is not None:
-            self._stored_key = stored_key
-            self._server_key = server_key
+    def _make_server_first_message(self, pending, s_nonce):
+        """Build the server first message when the keys are known.
+
+        :Parameters:
+            - `pending`: the keys, with Hi() already computed
+            - `s_nonce`: the server nonce
+        :Types:
+            - `pending`: `PendingKeys`
+            - `s_nonce`: `bytes`
+
+        :returntype: `bytes`
+        """
+        # for unknown users the proof is checked against the decoy or
+        # dummy StoredKey (if any), to take as long as for existing ones
+        self._stored_key = pending.stored_key
+        if pending.known:
+            self._server_key = pending.server_key
         else:
-            self._stored_key = None
             self._server_key = None
 
-        c_nonce = match.group("nonce")
-        s_nonce = nonce_factory()
-        if not VALUE_CHARS_RE.match(s_nonce):
-            s_nonce = standard_b64encode(s_nonce)
-        nonce = c_nonce + s_nonce
-        server_first_message = (
-                            b"r=" + nonce
-                            + b",s=" + standard_b64encode(salt)
-                            + b",i=" + str(iteration_count).encode("utf-8")
-                            )
-        self._nonce = nonce
-        self._cb_name  = cb_name
-        self._gs2_header = gs2_header
-        self._client_first_message_bare = match.group("client_first_bare")
+        client_first = self._client_first
+        self._client_first = None
+        c_nonce = client_first.nonce
+        if pending.stored:
+            fragment = _salt_fragment(self.config, pending.salt,
+                                                    pending.iteration_count)
+        else:
+            # random or decoy salt, not worth caching
+            fragment = b"".join((b",s=", standard_b64encode(pending.salt),
+                        b",i=", str(pending.iteration_count).encode("ascii")))
+        server_first_message = b"".join((b"r=", c_nonce, s_nonce, fragment))
+        self._client_first_message_bare = client_first.client_first_bare
         self._server_first_message = server_first_message
         return server_first_message
 
-    def _handle_final_response(self, response):
-        match = CLIENT_FINAL_MESSAGE_RE.match(response)
-        if not match:
-            raise NotAuthorizedException("Bad response syntax: {0!r}".format(response))
-        if match.group("nonce") != self._nonce:
-            raise NotAuthorizedException("Bad nonce in the final client response")
-        cb_input = a2b_base64(match.group("cb"))
+    def _expected_cb_value(self):
+        """Get the expected client final message 'c=' attribute value, if
+        known without encoding it.
+
+        :returntype: `bytes` or `None`
+        """
+        if not self._cb_name:
+            return _CB_VALUES.get(self._gs2_header)
+        cb_data = self.properties["channel-binding"]
+        if hasattr(cb_data, "cb_value"):
+            # `binding.ChannelBindingData`
+            return cb_data.cb_value(self._cb_name, self._gs2_header)
+        return None
+
+    def _check_channel_binding(self, cb_value):
+        """Check the 'c=' attribute value of the client final message.
+
+        :raises NotAuthorizedException: if it does not match the GS2 header
+            and the channel binding data
+        """
+        try:
+            cb_input = a2b_base64(cb_value)
+        except ValueError:
+            raise NotAuthorizedException("Bad base64 encoding for channel"
+                                            " binding: {0!r}".format(cb_value))
         if not cb_input.startswith(self._gs2_header):
             raise NotAuthorizedException("GS2 header in the final response ({0!r}) doesn't"
                     " match the one sent in the first message ({1!r})"
@@ -537,23 +1229,45 @@ class SCRAMServerAuthenticator(SCRAMOperations):
             if cb_data != self.properties["channel-binding"][self._cb_name]:
                 raise NotAuthorizedException("Channel binding data doesn't match")
 
-        proof = a2b_base64(match.group("proof"))
+    def _handle_final_response(self, response):
+        parsed = parse_client_final_message(response)
+        if parsed is None:
+            raise NotAuthorizedException("Bad response syntax: {0!r}".format(response))
+        # the server first message starts with 'r=<nonce>,'
+        nonce = parsed.nonce
+        server_first_message = self._server_first_message
+        if not server_first_message.startswith(nonce, 2) \
+                or not server_first_message.startswith(b",", 2 + len(nonce)):
+            raise NotAuthorizedException("Bad nonce in the final client response")
+        expected = self._expected_cb_value()
+        if expected is None or not hmac.compare_digest(parsed.cb, expected):
+            self._check_channel_binding(parsed.cb)
 
-        auth_message = (self._client_first_message_bare + b"," +
-                                    self._server_first_message + b"," +
-                                        match.group("without_proof"))
-        if self._stored_key is None:
+        try:
+            proof = a2b_base64(parsed.proof)
+        except ValueError:
+            raise NotAuthorizedException("Bad base64 encoding for proof: {0!r}"
+                                                        .format(parsed.proof))
+
+        auth_message = b"".join((self._client_first_message_bare, b",",
+                                    server_first_message, b",",
+                                    parsed.without_proof))
+        stored_key = self._stored_key
+        if stored_key is None:
             # compute something to prevent timing attack
-            client_signature = self.HMAC(b"", auth_message)
-            client_key = self.XOR(client_signature, proof)
-            self.H(client_key)
-            raise NotAuthorizedException("Authentication failed (bad username)")
-
-        client_signature = self.HMAC(self._stored_key, auth_message)
+            stored_key = b""
+        client_signature = self.HMAC(stored_key, auth_message)
         client_key = self.XOR(client_signature, proof)
-        if self.H(client_key) != self._stored_key:
+        valid = self.H(client_key) == stored_key
+        if self._server_key is None:
+            raise NotAuthorizedException("Authentication failed (bad username)")
+        if not valid:
             raise NotAuthorizedException("Authentication failed")
 
+        nonce_registry = self.properties.get("SCRAM-nonce-registry")
+        if nonce_registry is not None and not nonce_registry.add(nonce):
+            raise NotAuthorizedException("Replayed exchange")
+
         server_signature = self.HMAC(self._server_key, auth_message)
         server_final_message = b"v=" + standard_b64encode(server_signature)
         return (self.out_properties, server_final_message)
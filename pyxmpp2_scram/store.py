@@ -0,0 +1,425 @@
+"""In-memory store of precomputed SCRAM credentials.
+
+`SCRAMCredentialStore` keeps, for every user and every configured hash, the
+salt, iteration count, StoredKey and ServerKey -- everything the server needs
+to verify a SCRAM exchange without knowing the password and without
+computing Hi() at login time.  It implements the password database protocol
+used by `SCRAMServerAuthenticator`, returning entries in the
+``"SCRAM-<hash>-Keys"`` format.
+
+The credentials are kept in fixed-width records packed into `bytearray`
+and `array` buffers, one set per hash, with a single dictionary mapping user
+names to record numbers, so millions of users take little more memory than
+the key material itself.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+__docformat__ = "restructuredtext en"
+
+import os
+import logging
+import threading
+
+from array import array
+
+from . import kdf
+from .bulk import BulkDeriver, derive_batch, derive_users
+from .scram import HASH_FACTORIES
+
+logger = logging.getLogger("pyxmpp2_scram.store")
+
+class _CredentialTable(object):
+    """Fixed-width credential records for a single hash function.
+
+    Record ``n`` occupies ``salt_size`` bytes of `salts`, one item of
+    `iteration_counts` and ``2 * digest_size`` bytes (StoredKey followed by
+    ServerKey) of `keys`. Iteration count 0 marks a missing record.
+    """
+    # pylint: disable=R0903
+    __slots__ = ("hash_name", "pformat", "digest_size", "salt_size",
+                                            "salts", "iteration_counts", "keys")
+    def __init__(self, hash_name, salt_size):
+        self.hash_name = hash_name
+        self.pformat = "SCRAM-{0}-Keys".format(hash_name)
+        self.digest_size = HASH_FACTORIES[hash_name]().digest_size
+        self.salt_size = salt_size
+        self.salts = bytearray()
+        self.iteration_counts = array(str("I"))
+        self.keys = bytearray()
+
+    def grow(self, count):
+        """Add empty records."""
+        self.salts.extend(b"\0" * (self.salt_size * count))
+        self.iteration_counts.extend([0] * count)
+        self.keys.extend(b"\0" * (2 * self.digest_size * count))
+
+    def check(self, salt, iteration_count, stored_key, server_key):
+        """Validate a record before it is stored.
+
+        :raises ValueError: if a field does not fit in the record
+        """
+        if len(salt) != self.salt_size:
+            raise ValueError("Salt must be {0} bytes long"
+                                                    .format(self.salt_size))
+        if not 0 < iteration_count < 2 ** 32:
+            raise ValueError("Bad iteration count: {0!r}"
+                                                    .format(iteration_count))
+        if len(stored_key) != self.digest_size \
+                                or len(server_key) != self.digest_size:
+            raise ValueError("Bad key length for {0}".format(self.hash_name))
+
+    def set(self, row, salt, iteration_count, stored_key, server_key):
+        """Store a record validated by `check`."""
+        # pylint: disable=R0913
+        start = row * self.salt_size
+        self.salts[start:start + self.salt_size] = salt
+        self.iteration_counts[row] = iteration_count
+        start = row * 2 * self.digest_size
+        self.keys[start:start + 2 * self.digest_size] = stored_key + server_key
+
+    def clear(self, row):
+        """Mark a record missing."""
+        self.iteration_counts[row] = 0
+
+    def get(self, row):
+        """Get a record.
+
+        :return: (salt, iteration_count, stored_key, server_key) or `None`
+        """
+        iteration_count = self.iteration_counts[row]
+        if not iteration_count:
+            return None
+        start = row * self.salt_size
+        salt = bytes(self.salts[start:start + self.salt_size])
+        start = row * 2 * self.digest_size
+        middle = start + self.digest_size
+        return (salt, iteration_count, bytes(self.keys[start:middle]),
+                        bytes(self.keys[middle:middle + self.digest_size]))
+
+class SCRAMCredentialStore(object):
+    """Precomputed SCRAM credentials of many users, usable as the
+    `SCRAMServerAuthenticator` password database.
+
+    When a `legacy_database` is given, users missing from the store are
+    looked up there in the ``"plain"`` format, so the server can still
+    authenticate them. Their credentials (and those stored with an
+    iteration count lower than `iteration_count`) are (re)computed by
+    `upgrade`, which the application should call after a successful
+    authentication, possibly in a background thread. This allows lazy
+    migration of existing accounts as users log in, without computing Hi()
+    for every hash on the login path or for unverified passwords.
+
+    With an `iteration_policy` the iteration count for new credentials and
+    the upgrade threshold are chosen per hash by the policy.
+
+    :Ivariables:
+        - `hash_names`: hash functions credentials are stored for
+        - `iteration_count`: iteration count for new credentials
+        - `iteration_policy`: `policy.IterationPolicy` or `None`
+        - `salt_size`: length of generated salts
+        - `legacy_database`: password database with plain passwords or
+          `None`
+    """
+    # pylint: disable=R0913
+    def __init__(self, hash_names = ("SHA-1", "SHA-256"),
+                            iteration_count = 4096, salt_size = 16,
+                            legacy_database = None, kdf_backend = None,
+                            iteration_policy = None):
+        """Initialize an empty store.
+
+        :Parameters:
+            - `hash_names`: SCRAM hash names, e.g. ``("SHA-1", "SHA-256")``
+            - `iteration_count`: iteration count for new credentials
+            - `salt_size`: length of generated (and accepted) salts
+            - `legacy_database`: source of plain passwords for lazy upgrades
+            - `kdf_backend`: Hi() implementation, `None` for the default
+            - `iteration_policy`: iteration count policy overriding
+              `iteration_count`
+        :Types:
+            - `hash_names`: sequence of `unicode`
+            - `iteration_count`: `int`
+            - `salt_size`: `int`
+            - `kdf_backend`: `unicode` or `kdf.KDFBackend`
+            - `iteration_policy`: `policy.IterationPolicy`
+        """
+        self.hash_names = tuple(hash_names)
+        self.iteration_count = iteration_count
+        self.iteration_policy = iteration_policy
+        self.salt_size = salt_size
+        self.legacy_database = legacy_database
+        self.kdf_backend = kdf.get_backend(kdf_backend)
+        self._tables = dict((hash_name, _CredentialTable(hash_name, salt_size))
+                                                for hash_name in self.hash_names)
+        self._pformats = dict((table.pformat, table)
+                                            for table in self._tables.values())
+        self._rows = {}
+        self._free_rows = []
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, username):
+        return username in self._rows
+
+    def usernames(self):
+        """Return the names of the stored users.
+
+        :returntype: `list` of `unicode`
+        """
+        return list(self._rows)
+
+    def _iteration_count(self, hash_name):
+        """Get the iteration count for new credentials."""
+        if self.iteration_policy is not None:
+            return self.iteration_policy.iteration_count(hash_name,
+                                                        calibrate = True)
+        return self.iteration_count
+
+    def _row(self, username):
+        """Find or allocate the record number for a user. Must be called
+        with the lock held."""
+        row = self._rows.get(username)
+        if row is not None:
+            return row
+        if self._free_rows:
+            row = self._free_rows.pop()
+        else:
+            if self._size == len(self._tables[self.hash_names[0]]
+                                                        .iteration_counts):
+                grow_by = max(16, self._size // 4)
+                for table in self._tables.values():
+                    table.grow(grow_by)
+            row = self._size
+            self._size += 1
+        self._rows[username] = row
+        return row
+
+    def set_keys(self, username, hash_name, salt, iteration_count,
+                                                    stored_key, server_key):
+        """Store precomputed credentials of a user for one hash.
+
+        :Parameters:
+            - `username`: the user name
+            - `hash_name`: SCRAM hash name, e.g. ``"SHA-1"``
+            - `salt`: the salt
+            - `iteration_count`: the iteration count
+            - `stored_key`: StoredKey
+            - `server_key`: ServerKey
+
+        :raises ValueError: if the salt, the iteration count or a key does
+            not fit the store
+        """
+        table = self._tables[hash_name]
+        table.check(salt, iteration_count, stored_key, server_key)
+        with self._lock:
+            row = self._row(username)
+            table.set(row, salt, iteration_count, stored_key, server_key)
+
+    def set_password(self, username, password, iteration_count = None):
+        """Compute and store credentials of a user for all hashes.
+
+        :Parameters:
+            - `username`: the user name
+            - `password`: the password
+            - `iteration_count`: iteration count, `None` for the store
+              default
+        :Types:
+            - `username`: `unicode`
+            - `password`: `unicode`
+            - `iteration_count`: `int`
+        """
+        jobs = []
+        for hash_name in self.hash_names:
+            if iteration_count is None:
+                count = self._iteration_count(hash_name)
+            else:
+                count = iteration_count
+            jobs.append((hash_name, password, os.urandom(self.salt_size),
+                                                                    count))
+        keys = derive_batch(jobs, self.kdf_backend)
+        for (hash_name, _, salt, count), (_, stored_key, server_key) \
+                                                        in zip(jobs, keys):
+            self.set_keys(username, hash_name, salt, count, stored_key,
+                                                                    server_key)
+
+    def remove(self, username):
+        """Remove a user from the store."""
+        with self._lock:
+            row = self._rows.pop(username, None)
+            if row is None:
+                return
+            for table in self._tables.values():
+                table.clear(row)
+            self._free_rows.append(row)
+
+    def get_keys(self, username, hash_name):
+        """Get stored credentials of a user.
+
+        :return: (salt, iteration_count, stored_key, server_key) or `None`
+        """
+        table = self._tables[hash_name]
+        with self._lock:
+            row = self._rows.get(username)
+            if row is None:
+                return None
+            return table.get(row)
+
+    def needs_upgrade(self, username, hash_name = None):
+        """Check if credentials of a user are missing or use lower iteration
+        count than configured.
+
+        :Parameters:
+            - `username`: the user name
+            - `hash_name`: hash to check, `None` for all
+        :returntype: `bool`
+        """
+        if hash_name is None:
+            hash_names = self.hash_names
+        else:
+            hash_names = (hash_name,)
+        for name in hash_names:
+            keys = self.get_keys(username, name)
+            if keys is None or keys[1] < self._iteration_count(name):
+                return True
+        return False
+
+    def build(self, items, iteration_count = None, executor = None,
+                                                        chunk_size = 64):
+        """Compute and store credentials of many users, using all CPUs.
+
+        The keys are computed by a `bulk.BulkDeriver`, so `items` may be
+        an arbitrarily long iterator.
+
+        :Parameters:
+            - `items`: (username, password) pairs
+            - `iteration_count`: iteration count, `None` for the store
+              default
+            - `executor`: a `concurrent.futures.Executor`, `None` to create
+              one with `kdf.create_executor`
+            - `chunk_size`: number of keys computed by a worker at once
+        :Types:
+            - `items`: iterable
+            - `iteration_count`: `int`
+            - `executor`: `concurrent.futures.Executor`
+            - `chunk_size`: `int`
+
+        :return: number of users stored
+        :returntype: `int`
+        """
+        iteration_counts = dict((hash_name, iteration_count
+                                    if iteration_count is not None
+                                    else self._iteration_count(hash_name))
+                                            for hash_name in self.hash_names)
+        deriver = BulkDeriver(executor, self.kdf_backend, chunk_size)
+        count = 0
+        for username, credentials in derive_users(deriver, items,
+                            self.hash_names, iteration_counts, self.salt_size):
+            for hash_name, entry in credentials.items():
+                self.set_keys(username, hash_name, *entry)
+            count += 1
+        return count
+
+    def upgrade(self, username, properties = None):
+        """Recompute the credentials of a user from the plain password in the
+        legacy database, if they are missing or use a too low iteration
+        count.
+
+        Computes Hi() for every hash, so it should be called only after
+        a successful authentication, possibly in a background thread.
+
+        :Parameters:
+            - `username`: the user name
+            - `properties`: authentication properties to pass to the legacy
+              database
+        :Types:
+            - `username`: `unicode`
+            - `properties`: `dict`
+
+        :return: `True` if the credentials were recomputed
+        :returntype: `bool`
+        """
+        if self.legacy_database is None or not self.needs_upgrade(username):
+            return False
+        password = self._legacy_password(username, properties or {})
+        if password is None:
+            return False
+        logger.debug("Upgrading SCRAM credentials for %r", username)
+        self.set_password(username, password)
+        return True
+
+    def _legacy_password(self, username, properties):
+        """Get the plain password of a user from the legacy database.
+
+        :returntype: `unicode`
+        """
+        password, pformat = self.legacy_database.get_password(username,
+                                                        ("plain",), properties)
+        if pformat != "plain":
+            return None
+        return password
+
+    def get_password(self, username, formats, properties):
+        """Get the credentials of a user in one of the requested formats.
+
+        Only the ``"SCRAM-<hash>-Keys"`` formats are supported, and the
+        ``"plain"`` format for users missing from the store but present in
+        the legacy database.
+
+        :Parameters:
+            - `username`: the user name
+            - `formats`: acceptable password formats, in order of preference
+            - `properties`: authentication properties
+        :Types:
+            - `username`: `unicode`
+            - `formats`: sequence of `unicode`
+            - `properties`: `dict`
+
+        :return: the credentials and their format or ``(None, None)``
+        :returntype: (`tuple`, `unicode`)
+        """
+        credentials = self.get_credentials(username, formats, properties)
+        for pformat in formats:
+            if pformat in credentials:
+                return credentials[pformat], pformat
+        return None, None
+
+    def get_credentials(self, username, formats, properties):
+        """Get the credentials of a user in all the requested formats at
+        once.
+
+        Only the ``"SCRAM-<hash>-Keys"`` formats are supported, and the
+        ``"plain"`` format for users missing from the store but present in
+        the legacy database.
+
+        :Parameters:
+            - `username`: the user name
+            - `formats`: acceptable password formats
+            - `properties`: authentication properties
+        :Types:
+            - `username`: `unicode`
+            - `formats`: sequence of `unicode`
+            - `properties`: `dict`
+
+        :return: the credentials by format
+        :returntype: `dict`
+        """
+        result = {}
+        with self._lock:
+            row = self._rows.get(username)
+            if row is not None:
+                for pformat in formats:
+                    table = self._pformats.get(pformat)
+                    if table is None:
+                        continue
+                    keys = table.get(row)
+                    if keys is not None:
+                        result[pformat] = keys
+        if not result and self.legacy_database is not None \
+                                                    and "plain" in formats:
+            password = self._legacy_password(username, properties)
+            if password is not None:
+                result["plain"] = password
+        return result
@@ -0,0 +1,33 @@
+"""Helpers shared by the tests."""
+
+from __future__ import absolute_import, division, unicode_literals
+
+from pyxmpp2_scram.scram import SCRAMClientAuthenticator
+
+def login(server, username = "user", password = "pencil", properties = None):
+    """Run an exchange with a server authenticator, using a client with the
+    same hash and no channel binding.
+
+    :Parameters:
+        - `server`: the server authenticator
+        - `username`: the client user name
+        - `password`: the client password
+        - `properties`: the server authentication properties, `None` for
+          16 iterations of Hi()
+    :Types:
+        - `server`: `SCRAMServerAuthenticator`
+        - `username`: `unicode`
+        - `password`: `unicode`
+        - `properties`: `dict`
+
+    :return: the server output properties
+    :raises NotAuthorizedException: when the server rejects the client
+    """
+    if properties is None:
+        properties = {"SCRAM-iteration-count": 16}
+    client = SCRAMClientAuthenticator(server.hash_function_name, False)
+    response = client.start({"username": username, "password": password})
+    response = client.challenge(server.start(properties, response))
+    out_properties, challenge = server.response(response)
+    client.finish(challenge)
+    return out_properties
@@ -0,0 +1,62 @@
+"""Tests of the asyncio authenticators."""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import asyncio
+import unittest
+
+from pyxmpp2_scram import kdf
+from pyxmpp2_scram.aio import KDFExecutor, AsyncSCRAMClientAuthenticator, \
+        AsyncSCRAMServerAuthenticator, get_default_kdf_executor
+
+class PasswordDatabase(object):
+    """Single-user plain-text password database."""
+    # pylint: disable=R0903
+    def get_password(self, username, formats, properties):
+        """Return the password of ``user``."""
+        # pylint: disable=W0613
+        if username == "user":
+            return "pencil", "plain"
+        return None, None
+
+async def exchange():
+    """Run a client <-> server exchange with the default executors."""
+    client = AsyncSCRAMClientAuthenticator("SHA-1", False)
+    server = AsyncSCRAMServerAuthenticator("SHA-1", False,
+                                                        PasswordDatabase())
+    response = await client.start({"username": "user",
+                                                    "password": "pencil"})
+    challenge = await server.start({"SCRAM-iteration-count": 64}, response)
+    response = await client.challenge(challenge)
+    properties, challenge = await server.response(response)
+    await client.finish(challenge)
+    return properties["username"]
+
+class TestKDFExecutor(unittest.TestCase):
+    """Checks the executor shared by several event loops."""
+    def test_two_loops(self):
+        """Contended executor used from two loops in a row."""
+        executor = KDFExecutor(max_concurrency = 1)
+        expected = kdf.pbkdf2("sha1", b"pencil", b"salt", 64)
+        async def derive_many():
+            """Derive more keys at once than the executor runs."""
+            return await asyncio.gather(*[executor.derive("sha1", b"pencil",
+                                                b"salt", 64) for _ in range(4)])
+        try:
+            for _ in range(2):
+                self.assertEqual(asyncio.run(derive_many()), [expected] * 4)
+        finally:
+            executor.shutdown()
+
+    def test_default_executor_two_loops(self):
+        """Exchanges with the default executor from two loops in a row."""
+        async def exchanges():
+            """Run concurrent exchanges."""
+            return await asyncio.gather(*[exchange() for _ in range(
+                            get_default_kdf_executor().max_concurrency + 2)])
+        for _ in range(2):
+            self.assertTrue(all(username == "user"
+                                    for username in asyncio.run(exchanges())))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,237 @@
+"""Tests of the asynchronous password databases."""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import asyncio
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+from pyxmpp2_scram.aiodb import CachingPasswordDatabase, \
+        PooledPasswordDatabase
+
+class SQLiteBackend(object):
+    """A `sqlite3` user table, counting the connections and lookups."""
+    def __init__(self, path):
+        self.path = path
+        self.connections = 0
+        self.lookups = []
+        connection = sqlite3.connect(path)
+        connection.execute("CREATE TABLE users (username, password)")
+        connection.executemany("INSERT INTO users VALUES (?, ?)",
+                        [("user{0}".format(i), "pw{0}".format(i))
+                                                        for i in range(10)])
+        connection.commit()
+        connection.close()
+
+    def connect(self):
+        """Open a connection."""
+        self.connections += 1
+        return sqlite3.connect(self.path, check_same_thread = False)
+
+    def lookup(self, connection, username, formats, properties):
+        """Look a user up, slowly."""
+        # pylint: disable=W0613
+        self.lookups.append(username)
+        time.sleep(0.01)
+        if username == "broken":
+            raise RuntimeError("Backend failure")
+        row = connection.execute("SELECT password FROM users"
+                            " WHERE username = ?", (username,)).fetchone()
+        if row is None:
+            return None, None
+        return row[0], "plain"
+
+class BlockingConnection(object):
+    """Connection whose lookups wait for `release`."""
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.closed = False
+
+    def lookup(self):
+        """Wait for `release`."""
+        self.started.set()
+        self.release.wait(5)
+        return "pencil", "plain"
+
+    def close(self):
+        """Close the connection."""
+        self.closed = True
+
+class TestCancellation(unittest.TestCase):
+    """Checks the connections of cancelled lookups."""
+    def test_cancelled_lookup(self):
+        """A connection of a cancelled lookup is closed once the lookup
+        finishes and never reused."""
+        connections = []
+        def connect():
+            """Make a connection, blocking only the first lookup."""
+            connections.append(BlockingConnection())
+            if len(connections) > 1:
+                connections[-1].release.set()
+            return connections[-1]
+        def lookup(connection, username, formats, properties):
+            """Look a user up."""
+            # pylint: disable=W0613
+            return connection.lookup()
+        pool = PooledPasswordDatabase(connect, lookup, pool_size = 1)
+        self.addCleanup(pool.close)
+        async def cancel():
+            """Cancel a lookup in progress."""
+            task = asyncio.ensure_future(pool.get_password("user",
+                                                            ("plain",), {}))
+            while not connections or not connections[0].started.is_set():
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        asyncio.run(cancel())
+        connection = connections[0]
+        self.assertFalse(connection.closed)
+        connection.release.set()
+        for _ in range(100):
+            if connection.closed:
+                break
+            time.sleep(0.01)
+        self.assertTrue(connection.closed)
+        self.assertEqual(asyncio.run(pool.get_password("user", ("plain",),
+                                                {})), ("pencil", "plain"))
+        self.assertEqual(len(connections), 2)
+
+class TestDatabases(unittest.TestCase):
+    """Checks the pooled and the caching database with `sqlite3`."""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.backend = SQLiteBackend(os.path.join(self.directory, "users.db"))
+        self.pool = PooledPasswordDatabase(self.backend.connect,
+                                        self.backend.lookup, pool_size = 2)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.directory)
+
+    def test_pool_two_loops(self):
+        """The pool is used from two event loops in a row."""
+        async def lookups():
+            """Run more lookups at once than the pool size."""
+            return await asyncio.gather(*[self.pool.get_password(
+                            "user{0}".format(i), ("plain",), {})
+                                                        for i in range(6)])
+        for _ in range(2):
+            self.assertEqual(asyncio.run(lookups()),
+                    [("pw{0}".format(i), "plain") for i in range(6)])
+        self.assertLessEqual(self.backend.connections, 2)
+
+    def test_failed_connection_replaced(self):
+        """A connection which raised an exception is not reused."""
+        async def lookups():
+            """Look up a broken user, then a valid one."""
+            with self.assertRaises(RuntimeError):
+                await self.pool.get_password("broken", ("plain",), {})
+            return await self.pool.get_password("user1", ("plain",), {})
+        self.assertEqual(asyncio.run(lookups()), ("pw1", "plain"))
+        self.assertEqual(self.backend.connections, 2)
+
+    def test_cache(self):
+        """Lookups are cached, coalesced and invalidated."""
+        database = CachingPasswordDatabase(self.pool, negative_ttl = None)
+        async def lookups(username):
+            """Look a user up concurrently."""
+            return await asyncio.gather(*[database.get_password(username,
+                                                ("plain",), {})
+                                                            for _ in range(4)])
+        self.assertEqual(asyncio.run(lookups("user1")), [("pw1", "plain")] * 4)
+        self.assertEqual(asyncio.run(lookups("user1")), [("pw1", "plain")] * 4)
+        self.assertEqual(asyncio.run(lookups("ghost")), [(None, None)] * 4)
+        self.assertEqual(asyncio.run(lookups("ghost")), [(None, None)] * 4)
+        self.assertEqual(self.backend.lookups, ["user1", "ghost"])
+        self.assertEqual(database.coalesced, 6)
+
+        database.invalidate("user1")
+        asyncio.run(lookups("user1"))
+        asyncio.run(lookups("ghost"))
+        self.assertEqual(self.backend.lookups, ["user1", "ghost", "user1"])
+        database.invalidate()
+        asyncio.run(lookups("ghost"))
+        self.assertEqual(self.backend.lookups,
+                                        ["user1", "ghost", "user1", "ghost"])
+
+    def test_invalidate_during_lookup(self):
+        """A lookup in progress during `invalidate` does not cache its
+        (possibly outdated) result."""
+        class Database(object):
+            """Database whose first lookup waits for an invalidation."""
+            # pylint: disable=R0903
+            def __init__(self):
+                self.passwords = ["old", "new"]
+                self.started = asyncio.Event()
+                self.invalidated = asyncio.Event()
+
+            async def get_password(self, username, formats, properties):
+                """Return the next password, the first one after the
+                invalidation."""
+                # pylint: disable=W0613
+                password = self.passwords.pop(0)
+                if password == "old":
+                    self.started.set()
+                    await self.invalidated.wait()
+                return password, "plain"
+        database = Database()
+        caching = CachingPasswordDatabase(database)
+        async def lookups():
+            """Invalidate the user while it is looked up."""
+            task = asyncio.ensure_future(caching.get_password("user",
+                                                            ("plain",), {}))
+            await database.started.wait()
+            caching.invalidate("user")
+            database.invalidated.set()
+            first = await task
+            second = await caching.get_password("user", ("plain",), {})
+            third = await caching.get_password("user", ("plain",), {})
+            return first, second, third
+        self.assertEqual(asyncio.run(lookups()), (("old", "plain"),
+                                        ("new", "plain"), ("new", "plain")))
+        self.assertEqual(caching.stats()["found"]["size"], 1)
+
+    def test_cache_stats(self):
+        """Unknown users answered by the negative cache are not counted as
+        misses of the positive cache."""
+        database = CachingPasswordDatabase(self.pool)
+        async def lookups(usernames):
+            """Look the users up one by one."""
+            for username in usernames:
+                await database.get_password(username, ("plain",), {})
+        asyncio.run(lookups(["user1", "user1", "ghost", "ghost", "ghost"]))
+        stats = database.stats()
+        self.assertEqual((stats["found"]["hits"], stats["found"]["misses"]),
+                                                                    (1, 2))
+        self.assertEqual((stats["unknown"]["hits"],
+                                    stats["unknown"]["misses"]), (2, 2))
+        self.assertEqual(self.backend.lookups, ["user1", "ghost"])
+
+    def test_cache_size_and_expiry(self):
+        """The least recently used users and the expired results are
+        dropped."""
+        database = CachingPasswordDatabase(self.pool, max_size = 2,
+                                                            ttl = 0.05)
+        async def lookups(usernames):
+            """Look the users up one by one."""
+            for username in usernames:
+                await database.get_password(username, ("plain",), {})
+        asyncio.run(lookups(["user1", "user2", "user1", "user3", "user1",
+                                                                    "user2"]))
+        self.assertEqual(self.backend.lookups,
+                                    ["user1", "user2", "user3", "user2"])
+        time.sleep(0.1)
+        asyncio.run(lookups(["user1"]))
+        self.assertEqual(self.backend.lookups[-1], "user1")
+        # the expired result of user2 is dropped when user1 is added again
+        self.assertEqual(database.stats()["found"]["size"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,242 @@
+"""Tests of the authentication audit log."""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+from pyxmpp2_scram import audit
+from pyxmpp2_scram.audit import AuditLog, AuditSink, FileAuditSink, \
+        LoggingAuditSink, redact_message, SUCCESS, FAILURE
+from pyxmpp2_scram.exceptions import NotAuthorizedException
+from pyxmpp2_scram.scram import SCRAMServerAuthenticator
+
+from .helpers import login
+
+class RecordingSink(AuditSink):
+    """Keeps the emitted events."""
+    def __init__(self):
+        self.events = []
+        self.closed = False
+
+    def emit(self, events):
+        self.events.extend(events)
+
+    def close(self):
+        self.closed = True
+
+class FailingSink(AuditSink):
+    """Fails on every call."""
+    def emit(self, events):
+        raise RuntimeError("Sink failure")
+
+class PasswordDatabase(object):
+    """Single-user plain-text password database."""
+    # pylint: disable=R0903
+    def get_password(self, username, formats, properties):
+        """Return the password of ``user``."""
+        # pylint: disable=W0613
+        if username == "user":
+            return "pencil", "plain"
+        return None, None
+
+class TestRedactMessage(unittest.TestCase):
+    """Checks what `redact_message` hides."""
+    def test_messages(self):
+        """Nonces, proofs, signatures and channel binding data are hidden,
+        the GS2 header 'p=' and the other attributes are kept."""
+        for message, expected in (
+                (b"n,,n=user,r=fyko+d2lbbFgONRv9qkxdawL",
+                                                b"n,,n=user,r=..."),
+                (b"p=tls-unique,a=admin,n=user,r=fyko",
+                                    b"p=tls-unique,a=admin,n=user,r=..."),
+                (b"r=fyko3rfcNHYJY1ZVvWVs7j,s=QSXCR+Q6sek8bf92,i=4096",
+                                    b"r=...,s=QSXCR+Q6sek8bf92,i=4096"),
+                (b"c=cD10bHMtdW5pcXVlLCxvbmU=,r=fyko3rfc,"
+                            b"p=v0X8v3Bz2T0CJGbJQyF0X+HI4Ts=",
+                                                    b"c=...,r=...,p=..."),
+                (b"v=rmF9pqV8S7suAoZWja4dJRkFsKQ=", b"v=..."),
+                (b"e=invalid-proof", b"e=invalid-proof")):
+            self.assertEqual(redact_message(message), expected)
+
+class TestAuditLog(unittest.TestCase):
+    """Checks the recording, filtering and draining of the events."""
+    def setUp(self):
+        self.sink = RecordingSink()
+
+    def make_log(self, **kwargs):
+        """Create an audit log which is drained only explicitly."""
+        audit_log = AuditLog([self.sink], flush_interval = 3600, **kwargs)
+        self.addCleanup(audit_log.close)
+        return audit_log
+
+    def test_events(self):
+        """Events are passed to the sinks on `flush`."""
+        audit_log = self.make_log()
+        audit_log.success("SCRAM-SHA-1", "server", "user", None, 0.5)
+        audit_log.failure("SCRAM-SHA-1", "server", "ghost", "admin",
+                                    NotAuthorizedException("bad"), 0.25)
+        self.assertEqual(self.sink.events, [])
+        self.assertEqual(audit_log.flush(), 2)
+        self.assertEqual(audit_log.flush(), 0)
+        success, failure = self.sink.events
+        self.assertEqual(success[1:], ("SCRAM-SHA-1", "server", "user",
+                                                None, SUCCESS, None, 0.5))
+        self.assertEqual(failure[1:], ("SCRAM-SHA-1", "server", "ghost",
+                        "admin", FAILURE, "NotAuthorizedException", 0.25))
+
+    def test_level(self):
+        """Successes are recorded at INFO, failures at WARNING."""
+        audit_log = self.make_log(level = logging.WARNING)
+        error = NotAuthorizedException("bad")
+        audit_log.success("SCRAM-SHA-1", "server", "user", None, 0)
+        audit_log.failure("SCRAM-SHA-1", "server", "user", None, error, 0)
+        audit_log.level = logging.ERROR
+        audit_log.success("SCRAM-SHA-1", "server", "user", None, 0)
+        audit_log.failure("SCRAM-SHA-1", "server", "user", None, error, 0)
+        audit_log.level = logging.DEBUG
+        audit_log.success("SCRAM-SHA-1", "server", "user", None, 0)
+        audit_log.flush()
+        self.assertEqual([event.outcome for event in self.sink.events],
+                                                        [FAILURE, SUCCESS])
+
+    def test_sampling(self):
+        """Only the sampled fraction of events is recorded."""
+        audit_log = self.make_log(success_sample_rate = 0.5,
+                                                failure_sample_rate = 0.0)
+        with mock.patch.object(audit.random, "random",
+                                            side_effect = [0.4, 0.6, 0.1]):
+            for _ in range(3):
+                audit_log.success("SCRAM-SHA-1", "server", "user", None, 0)
+                audit_log.failure("SCRAM-SHA-1", "server", "user", None,
+                                        NotAuthorizedException("bad"), 0)
+        self.assertEqual(audit_log.stats()["recorded"], 2)
+        audit_log.flush()
+        self.assertEqual([event.outcome for event in self.sink.events],
+                                                        [SUCCESS, SUCCESS])
+
+    def test_capacity(self):
+        """The oldest events are dropped when the buffer is full."""
+        audit_log = self.make_log(capacity = 2)
+        for username in ("a", "b", "c"):
+            audit_log.success("SCRAM-SHA-1", "server", username, None, 0)
+        self.assertEqual(audit_log.stats(),
+                            {"recorded": 3, "dropped": 1, "buffered": 2})
+        audit_log.flush()
+        self.assertEqual([event.username for event in self.sink.events],
+                                                                ["b", "c"])
+
+    def test_concurrent_counters(self):
+        """The counters are exact with events recorded by many threads."""
+        audit_log = self.make_log(capacity = 100)
+        def record():
+            """Record many events."""
+            for _ in range(5000):
+                audit_log.success("SCRAM-SHA-1", "server", "user", None, 0)
+        threads = [threading.Thread(target = record) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(audit_log.stats(),
+                        {"recorded": 40000, "dropped": 39900, "buffered": 100})
+
+    def test_failing_sink(self):
+        """A failing sink does not stop the others."""
+        audit_log = AuditLog([FailingSink(), self.sink],
+                                                    flush_interval = 3600)
+        self.addCleanup(audit_log.close)
+        audit_log.success("SCRAM-SHA-1", "server", "user", None, 0)
+        with self.assertLogs("pyxmpp2_scram.audit", logging.ERROR):
+            self.assertEqual(audit_log.flush(), 1)
+        self.assertEqual(len(self.sink.events), 1)
+
+    def test_close(self):
+        """`close` drains the remaining events and closes the sinks."""
+        audit_log = AuditLog([self.sink], flush_interval = 3600)
+        audit_log.success("SCRAM-SHA-1", "server", "user", None, 0)
+        audit_log.close()
+        audit_log.close()
+        self.assertEqual(len(self.sink.events), 1)
+        self.assertTrue(self.sink.closed)
+
+    def test_drain_thread(self):
+        """Events are drained periodically."""
+        audit_log = AuditLog([self.sink], flush_interval = 0.01)
+        self.addCleanup(audit_log.close)
+        audit_log.success("SCRAM-SHA-1", "server", "user", None, 0)
+        for _ in range(100):
+            if self.sink.events:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(self.sink.events), 1)
+
+    def test_server(self):
+        """The server records the finished exchanges."""
+        audit_log = self.make_log()
+        properties = {"SCRAM-iteration-count": 16,
+                                            "SCRAM-audit-log": audit_log}
+        login(SCRAMServerAuthenticator("SHA-1", False, PasswordDatabase()),
+                                            properties = dict(properties))
+        with self.assertRaises(NotAuthorizedException):
+            login(SCRAMServerAuthenticator("SHA-1", False,
+                                        PasswordDatabase()), password = "x",
+                                        properties = dict(properties))
+        audit_log.flush()
+        self.assertEqual([(event.mechanism, event.username, event.outcome,
+                                    event.exception)
+                                            for event in self.sink.events],
+                        [("SCRAM-SHA-1", "user", SUCCESS, None),
+                        ("SCRAM-SHA-1", "user", FAILURE,
+                                                "NotAuthorizedException")])
+        self.assertTrue(all(event.duration >= 0
+                                            for event in self.sink.events))
+
+class TestSinks(unittest.TestCase):
+    """Checks the provided sinks."""
+    def test_file(self):
+        """Events are written as JSON lines."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "audit.log")
+        audit_log = AuditLog([FileAuditSink(path)], flush_interval = 3600)
+        audit_log.success("SCRAM-SHA-1", "server", "user", None, 0.5)
+        audit_log.failure("SCRAM-SHA-1", "server", "ghost", None,
+                                        NotAuthorizedException("bad"), 0.25)
+        audit_log.close()
+        with io.open(path, encoding = "utf-8") as audit_file:
+            records = [json.loads(line) for line in audit_file]
+        self.assertEqual(len(records), 2)
+        self.assertEqual(sorted(records[0]), ["authzid", "duration",
+                        "exception", "mechanism", "outcome", "side",
+                        "timestamp", "username"])
+        self.assertEqual((records[0]["username"], records[0]["outcome"],
+                            records[0]["duration"]), ("user", SUCCESS, 0.5))
+        self.assertEqual((records[1]["username"], records[1]["exception"]),
+                                        ("ghost", "NotAuthorizedException"))
+
+    def test_logging(self):
+        """Successes are logged at INFO, failures at WARNING."""
+        logger = logging.getLogger("pyxmpp2_scram.test.audit")
+        audit_log = AuditLog([LoggingAuditSink(logger)],
+                                                    flush_interval = 3600)
+        audit_log.success("SCRAM-SHA-1", "server", "user", None, 0.5)
+        audit_log.failure("SCRAM-SHA-1", "server", "ghost", None,
+                                        NotAuthorizedException("bad"), 0.25)
+        with self.assertLogs(logger, logging.INFO) as logs:
+            audit_log.close()
+        self.assertEqual([record.levelname for record in logs.records],
+                                                        ["INFO", "WARNING"])
+        self.assertIn("'ghost'", logs.output[1])
+
+if __name__ == "__main__":
+    unittest.main()
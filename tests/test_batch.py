@@ -0,0 +1,98 @@
+"""Tests of the batch processing of server exchanges."""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from pyxmpp2_scram import kdf
+from pyxmpp2_scram.batch import SCRAMServerBatch
+from pyxmpp2_scram.exceptions import NotAuthorizedException
+from pyxmpp2_scram.instrument import Instrumentation
+from pyxmpp2_scram.scram import SCRAMClientAuthenticator
+
+class FailingBackend(kdf.KDFBackend):
+    """The Python backend, failing for the password ``"boom"``."""
+    name = "failing"
+    def supports(self, digest_name):
+        return True
+
+    def _derive(self, digest_name, password, salt, iterations):
+        if password == b"boom":
+            raise RuntimeError("Backend failure")
+        return kdf.PYTHON_BACKEND.derive(digest_name, password, salt,
+                                                                iterations)
+
+class PasswordDatabase(object):
+    """Plain-text password database, failing for the user ``"broken"``."""
+    # pylint: disable=R0903
+    passwords = {"alice": "pencil", "bob": "boom", "carol": "pencil"}
+    def get_password(self, username, formats, properties):
+        """Return the password of a user."""
+        # pylint: disable=W0613
+        if username == "broken":
+            raise IOError("Database failure")
+        if username in self.passwords:
+            return self.passwords[username], "plain"
+        return None, None
+
+class RecordingInstrumentation(Instrumentation):
+    """Records the reported successes and failures."""
+    def __init__(self):
+        self.events = []
+
+    def failure(self, mechanism, side, exception):
+        self.events.append(("failure", exception.__class__.__name__))
+
+    def success(self, mechanism, side):
+        self.events.append(("success", None))
+
+class TestBatch(unittest.TestCase):
+    """Checks the failure isolation and reporting of `SCRAMServerBatch`."""
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(2)
+        self.batch = SCRAMServerBatch("SHA-1", False, PasswordDatabase(),
+                                        self.executor, FailingBackend())
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_failures_isolated(self):
+        """A failed Hi() or lookup fails only its own exchange."""
+        users = ["alice", "bob", "broken", "nobody", "carol"]
+        instrumentation = RecordingInstrumentation()
+        properties = {"SCRAM-iteration-count": 64,
+                                "SCRAM-instrumentation": instrumentation}
+        clients = []
+        exchanges = []
+        for username in users:
+            client = SCRAMClientAuthenticator("SHA-1", False)
+            password = "boom" if username == "bob" else "pencil"
+            exchanges.append((properties, client.start({
+                            "username": username, "password": password})))
+            clients.append(client)
+        results = self.batch.start(exchanges)
+        self.assertIsInstance(results[1].error, RuntimeError)
+        self.assertIsInstance(results[2].error, IOError)
+        for index in (0, 3, 4):
+            self.assertIsNone(results[index].error)
+
+        responses = [(results[index].authenticator,
+                                clients[index].challenge(results[index].result))
+                                                    for index in (0, 3, 4)]
+        final = self.batch.responses(responses)
+        self.assertIsNone(final[0].error)
+        self.assertIsInstance(final[1].error, NotAuthorizedException)
+        self.assertIsNone(final[2].error)
+        for index, result in ((0, final[0]), (4, final[2])):
+            self.assertEqual(clients[index].finish(result.result[1]),
+                                {"username": users[index], "authzid": ""})
+        self.assertEqual(sorted(instrumentation.events), [
+                                ("failure", "NotAuthorizedException"),
+                                ("failure", "OSError"),
+                                ("failure", "RuntimeError"),
+                                ("success", None), ("success", None)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+"""Tests of the TLS channel binding data."""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import hashlib
+import unittest
+
+from pyxmpp2_scram.binding import certificate_hash_name, \
+        tls_server_end_point, ChannelBindingData, ServerChannelBinding, \
+        client_channel_binding
+from pyxmpp2_scram.exceptions import NotAuthorizedException
+from pyxmpp2_scram.scram import SCRAMClientAuthenticator, \
+        SCRAMServerAuthenticator
+
+def der(tag, content):
+    """Encode a DER element."""
+    length = len(content)
+    if length < 0x80:
+        header = bytearray([tag, length])
+    else:
+        length_bytes = bytearray()
+        while length:
+            length_bytes.insert(0, length & 0xff)
+            length >>= 8
+        header = bytearray([tag, 0x80 | len(length_bytes)]) + length_bytes
+    return bytes(header) + content
+
+def oid(dotted):
+    """Encode an object identifier."""
+    arcs = [int(arc) for arc in dotted.split(".")]
+    result = bytearray([arcs[0] * 40 + arcs[1]])
+    for arc in arcs[2:]:
+        encoded = bytearray([arc & 0x7f])
+        arc >>= 7
+        while arc:
+            encoded.insert(0, 0x80 | (arc & 0x7f))
+            arc >>= 7
+        result += encoded
+    return der(0x06, bytes(result))
+
+def certificate(algorithm, parameters = b""):
+    """Build a (fake) certificate with the given signature algorithm."""
+    tbs = der(0x30, der(0x02, b"\x01") + b"x" * 200)
+    return der(0x30, tbs + der(0x30, oid(algorithm) + parameters)
+                                                + der(0x03, b"\0signature"))
+
+def pss_parameters(hash_oid):
+    """Build RSASSA-PSS parameters with the given hash."""
+    return der(0x30, der(0xa0, der(0x30, oid(hash_oid))))
+
+class FakeTLS(object):
+    """TLS connection providing the channel binding data."""
+    def __init__(self, unique, peer_certificate = None,
+                                                    version = "TLSv1.2"):
+        self.unique = unique
+        self.peer_certificate = peer_certificate
+        self._version = version
+
+    def version(self):
+        """Get the protocol version."""
+        return self._version
+
+    def get_channel_binding(self, cb_type):
+        """Get the tls-unique data."""
+        assert cb_type == "tls-unique"
+        return self.unique
+
+    def getpeercert(self, binary_form = False):
+        """Get the server certificate."""
+        assert binary_form
+        return self.peer_certificate
+
+class PasswordDatabase(object):
+    """Single-user plain-text password database."""
+    # pylint: disable=R0903
+    def get_password(self, username, formats, properties):
+        """Return the password of ``user``."""
+        # pylint: disable=W0613
+        if username == "user":
+            return "pencil", "plain"
+        return None, None
+
+class TestEndPoint(unittest.TestCase):
+    """Checks the ``tls-server-end-point`` hash selection."""
+    def test_hash_selection(self):
+        """The signature hash is used, SHA-256 instead of MD5 and SHA-1."""
+        for algorithm, expected in (
+                    ("1.2.840.113549.1.1.4", "sha256"),
+                    ("1.2.840.113549.1.1.5", "sha256"),
+                    ("1.2.840.113549.1.1.11", "sha256"),
+                    ("1.2.840.113549.1.1.12", "sha384"),
+                    ("1.2.840.113549.1.1.13", "sha512"),
+                    ("1.2.840.10045.4.3.3", "sha384"),
+                    ("1.2.840.10045.4.3.4", "sha512"),
+                    ("1.3.101.112", "sha256")):     # Ed25519
+            self.assertEqual(certificate_hash_name(certificate(algorithm)),
+                                                                    expected)
+
+    def test_pss(self):
+        """The RSASSA-PSS hash is taken from the parameters."""
+        pss = "1.2.840.113549.1.1.10"
+        self.assertEqual(certificate_hash_name(certificate(pss,
+                    pss_parameters("2.16.840.1.101.3.4.2.2"))), "sha384")
+        self.assertEqual(certificate_hash_name(certificate(pss,
+                    pss_parameters("2.16.840.1.101.3.4.2.3"))), "sha512")
+        self.assertEqual(certificate_hash_name(certificate(pss,
+                                        der(0x30, b""))), "sha256")
+        self.assertEqual(certificate_hash_name(certificate(pss)), "sha256")
+
+    def test_malformed(self):
+        """Malformed certificates are rejected."""
+        cert = certificate("1.2.840.113549.1.1.12")
+        for bad in (b"", b"\x02\x01\x00", cert[:10], cert[:-20]):
+            with self.assertRaises(ValueError):
+                certificate_hash_name(bad)
+
+    def test_end_point(self):
+        """The data is the certificate hash."""
+        cert = certificate("1.2.840.113549.1.1.12")
+        self.assertEqual(tls_server_end_point(cert),
+                                                hashlib.sha384(cert).digest())
+        self.assertEqual(tls_server_end_point(cert),
+                                                hashlib.sha384(cert).digest())
+        cert = certificate("1.2.840.113549.1.1.5")
+        self.assertEqual(tls_server_end_point(cert),
+                                                hashlib.sha256(cert).digest())
+
+class TestChannelBindingData(unittest.TestCase):
+    """Checks the cached 'c=' values."""
+    def test_shared_values(self):
+        """Values shared by connections follow the data of each
+        connection."""
+        shared = {}
+        data1 = ChannelBindingData({"tls-unique": b"one"}, shared)
+        data2 = ChannelBindingData({"tls-unique": b"two"}, shared)
+        for _ in range(2):
+            self.assertEqual(data1.cb_value("tls-unique", b"p=tls-unique,,"),
+                                                b"cD10bHMtdW5pcXVlLCxvbmU=")
+            self.assertEqual(data2.cb_value("tls-unique", b"p=tls-unique,,"),
+                                                b"cD10bHMtdW5pcXVlLCx0d28=")
+
+    def test_server_connections(self):
+        """Connections with one certificate share the end point values but
+        not the tls-unique ones."""
+        cert = certificate("1.2.840.113549.1.1.11")
+        binding = ServerChannelBinding(cert)
+        header = b"p=tls-server-end-point,,"
+        data1 = binding.for_connection(FakeTLS(b"unique1"))
+        data2 = binding.for_connection(FakeTLS(b"unique2"))
+        self.assertEqual(data1["tls-server-end-point"],
+                                                hashlib.sha256(cert).digest())
+        self.assertIs(data1.cb_value("tls-server-end-point", header),
+                        data2.cb_value("tls-server-end-point", header))
+        self.assertNotEqual(data1.cb_value("tls-unique", b"p=tls-unique,,"),
+                        data2.cb_value("tls-unique", b"p=tls-unique,,"))
+        data3 = binding.for_connection(FakeTLS(b"unique3",
+                                                    version = "TLSv1.3"))
+        self.assertNotIn("tls-unique", data3)
+
+    def test_exchange(self):
+        """-PLUS exchanges succeed only with matching data."""
+        cert = certificate("1.2.840.113549.1.1.12")
+        binding = ServerChannelBinding(cert)
+        for client_unique, valid in ((b"unique", True), (b"other", False)):
+            client = SCRAMClientAuthenticator("SHA-256", True)
+            server = SCRAMServerAuthenticator("SHA-256", True,
+                                                        PasswordDatabase())
+            response = client.start({"username": "user",
+                        "password": "pencil",
+                        "channel-binding": client_channel_binding(
+                                        FakeTLS(client_unique, cert))})
+            challenge = server.start({"SCRAM-iteration-count": 16,
+                        "channel-binding": binding.for_connection(
+                                            FakeTLS(b"unique"))}, response)
+            response = client.challenge(challenge)
+            if valid:
+                client.finish(server.response(response)[1])
+            else:
+                with self.assertRaises(NotAuthorizedException):
+                    server.response(response)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+"""Tests of the bulk key derivation."""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+import sys
+import unittest
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+
+from pyxmpp2_scram import kdf
+from pyxmpp2_scram.bulk import BulkDeriver
+from pyxmpp2_scram.scram import HASH_FACTORIES, SCRAMOperations, derive_keys
+from pyxmpp2_scram.store import SCRAMCredentialStore
+
+class CountingBackend(kdf.KDFBackend):
+    """The Python backend, counting the Hi() computations. Not registered,
+    so it can only be used in the current process."""
+    name = "counting"
+    def __init__(self):
+        kdf.KDFBackend.__init__(self)
+        self.count = 0
+
+    def supports(self, digest_name):
+        return True
+
+    def _derive(self, digest_name, password, salt, iterations):
+        self.count += 1
+        return kdf.PYTHON_BACKEND.derive(digest_name, password, salt,
+                                                                iterations)
+
+def expected_keys(hash_name, password, salt, iteration_count):
+    """Compute the keys one at a time, like a SCRAM exchange."""
+    operations = SCRAMOperations(hash_name)
+    salted_password = operations.Hi(operations.Normalize(password), salt,
+                                                            iteration_count)
+    client_key, server_key = derive_keys(operations, salted_password)
+    return salted_password, operations.H(client_key), server_key
+
+class TestBulkDeriver(unittest.TestCase):
+    """Checks the results and the flow control of `BulkDeriver`."""
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_matches_hi(self):
+        """The keys are the ones computed by `SCRAMOperations`, for every
+        hash."""
+        jobs = [(hash_name, "pencil{0}".format(i),
+                                    "salt{0}".format(i).encode("ascii"), i)
+                        for hash_name in sorted(HASH_FACTORIES)
+                        for i in (1, 2, 7)]
+        deriver = BulkDeriver(self.executor, batch_size = 2)
+        self.assertEqual(list(deriver.derive(jobs)),
+                                [expected_keys(*job) for job in jobs])
+
+    def test_input_order(self):
+        """The results are in the order of the jobs."""
+        jobs = [("SHA-1", "password{0}".format(i), b"salt",
+                                        1 if i % 2 else 64) for i in range(50)]
+        deriver = BulkDeriver(self.executor, batch_size = 3, max_pending = 4)
+        self.assertEqual(list(deriver.derive(jobs)),
+                                [expected_keys(*job) for job in jobs])
+
+    def test_max_pending(self):
+        """The input is consumed only as fast as the results are."""
+        consumed = [0]
+        def jobs():
+            """Generate many jobs, counting them."""
+            for i in range(10000):
+                consumed[0] += 1
+                yield ("SHA-1", "password{0}".format(i), b"salt", 1)
+        deriver = BulkDeriver(self.executor, batch_size = 5, max_pending = 3)
+        results = deriver.derive(jobs())
+        for produced in range(1, 101):
+            next(results)
+            self.assertLessEqual(consumed[0] - produced, 3 * 5)
+        results.close()
+        self.assertLess(consumed[0], 200)
+
+    def test_custom_backend(self):
+        """An unregistered backend instance may be used."""
+        backend = CountingBackend()
+        jobs = [("SHA-256", "pencil", b"salt", 2)] * 3
+        for executor in (self.executor, None):
+            deriver = BulkDeriver(executor, backend)
+            self.assertEqual(list(deriver.derive(jobs)),
+                                [expected_keys(*job) for job in jobs])
+        self.assertEqual(backend.count, 6)
+
+    def test_store_build(self):
+        """`SCRAMCredentialStore.build` works with an unregistered
+        backend."""
+        backend = CountingBackend()
+        store = SCRAMCredentialStore(("SHA-1",), 2, kdf_backend = backend)
+        self.assertEqual(store.build([("alice", "pencil")]), 1)
+        self.assertIn("alice", store)
+        self.assertEqual(backend.count, 1)
+
+class TestImports(unittest.TestCase):
+    """Checks the modules needed on Python 2.7."""
+    def test_without_concurrent_futures(self):
+        """The store, credential file and batch modules do not need
+        `concurrent.futures`."""
+        code = ("import sys\n"
+                "sys.modules['concurrent'] = None\n"
+                "sys.modules['concurrent.futures'] = None\n"
+                "import pyxmpp2_scram.store, pyxmpp2_scram.credfile\n"
+                "import pyxmpp2_scram.batch\n")
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subprocess.check_call([sys.executable, "-c", code], cwd = root)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,175 @@
+"""Tests of the client key cache."""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+from pyxmpp2_scram import cache
+from pyxmpp2_scram.cache import KeyCache, LRUCache
+from pyxmpp2_scram.scram import SCRAMClientAuthenticator
+
+class Clock(object):
+    """Manually advanced clock."""
+    # pylint: disable=R0903
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class TestLRUCache(unittest.TestCase):
+    """Checks the shared cache helper."""
+    def test_entry_ttl_and_pop(self):
+        """Entries may have their own TTL and are removed by `pop`."""
+        clock = Clock()
+        with mock.patch.object(cache, "_clock", clock):
+            lru_cache = LRUCache(10, ttl = 60)
+            lru_cache.put("a", 1, ttl = 10)
+            lru_cache.put("b", 2)
+            self.assertEqual(lru_cache.pop("b"), 2)
+            self.assertIsNone(lru_cache.pop("b"))
+            clock.now += 10
+            self.assertIsNone(lru_cache.get("a"))
+            lru_cache.put("c", 3, ttl = 5)
+            clock.now += 5
+            self.assertIsNone(lru_cache.pop("c"))
+            self.assertEqual(len(lru_cache), 0)
+
+    def test_expired_dropped_on_put(self):
+        """Expired entries at the least recently used end are dropped when
+        a new one is added."""
+        clock = Clock()
+        with mock.patch.object(cache, "_clock", clock):
+            lru_cache = LRUCache(10, ttl = 60)
+            lru_cache.put("a", 1)
+            lru_cache.put("b", 2, ttl = 120)
+            lru_cache.put("c", 3)
+            clock.now += 60
+            lru_cache.put("d", 4)
+            self.assertEqual(len(lru_cache), 3)
+            self.assertEqual(lru_cache.stats()["evictions"], 1)
+
+    def test_remove_if(self):
+        """Entries are removed by a key predicate."""
+        lru_cache = LRUCache()
+        for key in range(10):
+            lru_cache.put(key, key)
+        self.assertEqual(lru_cache.remove_if(lambda key: key % 2), 5)
+        self.assertEqual(len(lru_cache), 5)
+
+class TestKeyCache(unittest.TestCase):
+    """Checks the LRU, expiry and single-flight behaviour."""
+    def test_keys(self):
+        """Keys depend on every input and do not contain the password."""
+        key_cache = KeyCache()
+        key = key_cache.make_key("SHA-1", "user", b"pencil", b"salt", 4096)
+        self.assertEqual(key, key_cache.make_key("SHA-1", "user", b"pencil",
+                                                            b"salt", 4096))
+        self.assertNotIn(b"pencil", key)
+        for other in (("SHA-256", "user", b"pencil", b"salt", 4096),
+                        ("SHA-1", "other", b"pencil", b"salt", 4096),
+                        ("SHA-1", "user", b"pencil2", b"salt", 4096),
+                        ("SHA-1", "user", b"pencil", b"salt2", 4096),
+                        ("SHA-1", "user", b"pencil", b"salt", 4097)):
+            self.assertNotEqual(key, key_cache.make_key(*other))
+        self.assertNotEqual(key, KeyCache().make_key("SHA-1", "user",
+                                                b"pencil", b"salt", 4096))
+
+    def test_lru(self):
+        """The least recently used entry is evicted."""
+        key_cache = KeyCache(2)
+        key_cache.put("a", 1)
+        key_cache.put("b", 2)
+        self.assertEqual(key_cache.get("a"), 1)
+        key_cache.put("c", 3)
+        self.assertIsNone(key_cache.get("b"))
+        self.assertEqual(key_cache.get("a"), 1)
+        self.assertEqual(key_cache.get("c"), 3)
+        stats = key_cache.stats()
+        self.assertEqual((stats["size"], stats["hits"], stats["misses"],
+                                    stats["evictions"]), (2, 3, 1, 1))
+
+    def test_ttl(self):
+        """Entries expire after the TTL."""
+        clock = Clock()
+        with mock.patch.object(cache, "_clock", clock):
+            key_cache = KeyCache(10, ttl = 60)
+            key_cache.put("a", 1)
+            clock.now += 59
+            self.assertEqual(key_cache.get("a"), 1)
+            clock.now += 1
+            self.assertIsNone(key_cache.get("a"))
+            self.assertEqual(len(key_cache), 0)
+            self.assertEqual(key_cache.stats()["evictions"], 1)
+
+    def test_invalidate(self):
+        """Entries are removed by user and hash."""
+        key_cache = KeyCache()
+        for hash_name in ("SHA-1", "SHA-256"):
+            for username in ("alice", "bob"):
+                key_cache.put(key_cache.make_key(hash_name, username,
+                                            b"pencil", b"salt", 16), True)
+        self.assertEqual(key_cache.invalidate(username = "alice"), 2)
+        self.assertEqual(key_cache.invalidate(hash_name = "SHA-1"), 1)
+        self.assertEqual(len(key_cache), 1)
+        key_cache.clear()
+        self.assertEqual(len(key_cache), 0)
+
+    def test_single_flight(self):
+        """Concurrent lookups of a missing key compute it once."""
+        key_cache = KeyCache()
+        calls = []
+        def compute():
+            """Slow computation."""
+            calls.append(1)
+            time.sleep(0.05)
+            return b"keys"
+        results = []
+        threads = [threading.Thread(target = lambda: results.append(
+                                key_cache.get_or_compute("key", compute)))
+                                                        for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [b"keys"] * 8)
+        self.assertEqual(len(calls), 1)
+
+    def test_failed_compute(self):
+        """A failed computation is not cached and does not block others."""
+        key_cache = KeyCache()
+        def fail():
+            """Failing computation."""
+            raise RuntimeError("failure")
+        with self.assertRaises(RuntimeError):
+            key_cache.get_or_compute("key", fail)
+        self.assertEqual(key_cache.get_or_compute("key", lambda: 1), 1)
+
+    def test_client(self):
+        """Clients sharing a cache compute Hi() once."""
+        key_cache = KeyCache()
+        for _ in range(3):
+            client = SCRAMClientAuthenticator("SHA-1", False)
+            client.start({"username": "user", "password": "pencil",
+                        "SCRAM-key-cache": key_cache,
+                        "nonce_factory": lambda: b"fyko+d2lbbFgONRv9qkxdawL"})
+            client.challenge(b"r=fyko+d2lbbFgONRv9qkxdawL3rfcNHYJY1ZVvWVs7j,"
+                                            b"s=QSXCR+Q6sek8bf92,i=4096")
+            self.assertEqual(client.finish(b"v=rmF9pqV8S7suAoZWja4dJRkFsKQ="),
+                                    {"username": "user", "authzid": ""})
+        self.assertEqual(key_cache.stats()["misses"], 1)
+        self.assertEqual(key_cache.stats()["hits"], 2)
+
+    def test_client_bad_cache(self):
+        """A key cache of a wrong type is rejected."""
+        client = SCRAMClientAuthenticator("SHA-1", False)
+        with self.assertRaises(TypeError):
+            client.start({"username": "user", "password": "pencil",
+                                                "SCRAM-key-cache": {}})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+"""Tests of the low-level helpers."""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+import hmac
+import random
+import threading
+import unittest
+
+from pyxmpp2_scram.core import bytes_to_int, int_to_bytes, \
+        PrecomputedHMAC, NonceFactory
+from pyxmpp2_scram.scram import HASH_FACTORIES, VALUE_CHARS_RE, \
+        SCRAMOperations
+
+def reference_xor(str1, str2):
+    """XOR two byte strings byte by byte."""
+    return bytes(bytearray(a ^ b for a, b in zip(bytearray(str1),
+                                                        bytearray(str2))))
+
+class TestIntegers(unittest.TestCase):
+    """Checks the byte string <-> integer conversions and XOR."""
+    def test_round_trip(self):
+        """Conversions keep the leading zero bytes."""
+        rand = random.Random(0)
+        for length in (0, 1, 2, 20, 32, 64):
+            for data in (b"\0" * length, b"\xff" * length,
+                            b"\0" + b"\x01" * max(length - 1, 0),
+                            bytes(bytearray(rand.randint(0, 255)
+                                                for _ in range(length)))):
+                data = data[:length]
+                value = bytes_to_int(data)
+                self.assertEqual(int_to_bytes(value, length), data)
+        self.assertEqual(bytes_to_int(b""), 0)
+        self.assertEqual(bytes_to_int(b"\x01\x00"), 256)
+        self.assertEqual(int_to_bytes(256, 4), b"\0\0\x01\0")
+
+    def test_xor(self):
+        """`SCRAMOperations.XOR` matches the byte by byte XOR."""
+        rand = random.Random(0)
+        for length in (1, 20, 32, 48, 64):
+            for _ in range(20):
+                str1 = bytes(bytearray(rand.randint(0, 255)
+                                                    for _ in range(length)))
+                str2 = bytes(bytearray(rand.randint(0, 255)
+                                                    for _ in range(length)))
+                self.assertEqual(SCRAMOperations.XOR(str1, str2),
+                                                reference_xor(str1, str2))
+        self.assertEqual(SCRAMOperations.XOR(b"\x01\x02", b"\x01\x02"),
+                                                                b"\0\0")
+        self.assertEqual(SCRAMOperations.XOR(b"\xff\xff\xff", b"\x0f"),
+                                                                b"\xf0")
+
+class TestPrecomputedHMAC(unittest.TestCase):
+    """Checks `PrecomputedHMAC` against `hmac.new`."""
+    def test_against_hmac(self):
+        """Same results for all the hashes and key lengths."""
+        for hash_factory in HASH_FACTORIES.values():
+            block_size = hash_factory().block_size
+            for key_length in (0, 1, 20, block_size - 1, block_size,
+                                            block_size + 1, 3 * block_size):
+                key = bytes(bytearray(i % 256 for i in range(key_length)))
+                prf = PrecomputedHMAC(key, hash_factory)
+                for message in (b"", b"Client Key", b"x" * 1000):
+                    self.assertEqual(prf(message), hmac.new(key, message,
+                                                    hash_factory).digest())
+
+    def test_reusable(self):
+        """A prepared key may be used many times."""
+        prf = SCRAMOperations("SHA-256").keyed_HMAC(b"key")
+        first = prf(b"message")
+        prf(b"other message")
+        self.assertEqual(prf(b"message"), first)
+
+class TestNonceFactory(unittest.TestCase):
+    """Checks the buffered nonce factory."""
+    def test_nonces(self):
+        """Nonces are printable, of the declared length and unique."""
+        for entropy in (1, 16, 18, 32):
+            factory = NonceFactory(entropy, buffer_size = 64)
+            nonces = [factory() for _ in range(1000)]
+            if entropy >= 16:
+                self.assertEqual(len(set(nonces)), 1000)
+            for nonce in nonces:
+                self.assertEqual(len(nonce), factory.length)
+                self.assertTrue(VALUE_CHARS_RE.match(nonce))
+        with self.assertRaises(ValueError):
+            NonceFactory(0)
+
+    def test_threads(self):
+        """Nonces generated in many threads at once are unique."""
+        factory = NonceFactory(buffer_size = 96)
+        results = [[] for _ in range(8)]
+        def generate(result):
+            """Generate nonces."""
+            for _ in range(2000):
+                result.append(factory())
+        threads = [threading.Thread(target = generate, args = (result,))
+                                                        for result in results]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        nonces = [nonce for result in results for nonce in result]
+        self.assertEqual(len(set(nonces)), len(nonces))
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+    def test_fork(self):
+        """A forked child does not repeat the parent's nonces."""
+        factory = NonceFactory()
+        factory()
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if not pid:
+            try:
+                os.close(read_end)
+                os.write(write_end, b"".join(factory() for _ in range(10)))
+            finally:
+                os._exit(0)     # pylint: disable=W0212
+        os.close(write_end)
+        data = b""
+        while True:
+            chunk = os.read(read_end, 4096)
+            if not chunk:
+                break
+            data += chunk
+        os.close(read_end)
+        os.waitpid(pid, 0)
+        length = factory.length
+        child = set(data[i:i + length] for i in range(0, len(data), length))
+        self.assertEqual(len(child), 10)
+        parent = set(factory() for _ in range(10))
+        self.assertFalse(child & parent)
+
+if __name__ == "__main__":
+    unittest.main()
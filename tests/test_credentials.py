@@ -0,0 +1,110 @@
+"""Tests of the reusable client credentials."""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import threading
+import unittest
+
+from pyxmpp2_scram.credentials import ClientProfile
+from pyxmpp2_scram.scram import SCRAMOperations, SCRAMClientAuthenticator, \
+        SCRAMServerAuthenticator
+
+CLIENT_NONCE = b"fyko+d2lbbFgONRv9qkxdawL"
+SERVER_FIRST = (b"r=fyko+d2lbbFgONRv9qkxdawL3rfcNHYJY1ZVvWVs7j,"
+                                            b"s=QSXCR+Q6sek8bf92,i=4096")
+CLIENT_FINAL = (b"c=biws,r=fyko+d2lbbFgONRv9qkxdawL3rfcNHYJY1ZVvWVs7j,"
+                                        b"p=v0X8v3Bz2T0CJGbJQyF0X+HI4Ts=")
+SERVER_FINAL = b"v=rmF9pqV8S7suAoZWja4dJRkFsKQ="
+
+class PasswordDatabase(object):
+    """Plain-text password database."""
+    # pylint: disable=R0903
+    def get_password(self, username, formats, properties):
+        """Return the password of ``user``."""
+        # pylint: disable=W0613
+        if username == "us,er=":
+            return "pencil", "plain"
+        return None, None
+
+class TestClientProfile(unittest.TestCase):
+    """Checks `ClientProfile` and its use by the client."""
+    def test_rfc5802(self):
+        """The profile gives the messages of the RFC example, deriving the
+        keys once."""
+        profile = ClientProfile("user", "pencil")
+        salt = b"A%\xc2G\xe4:\xb1\xe9<m\xffv"
+        self.assertIsNone(profile.lookup_keys("SHA-1", salt, 4096))
+        keys = None
+        for _ in range(2):
+            client = SCRAMClientAuthenticator("SHA-1", False)
+            self.assertEqual(client.start({"SCRAM-client-profile": profile,
+                                    "nonce_factory": lambda: CLIENT_NONCE}),
+                                        b"n,,n=user,r=" + CLIENT_NONCE)
+            self.assertEqual(client.challenge(SERVER_FIRST), CLIENT_FINAL)
+            self.assertEqual(client.finish(SERVER_FINAL),
+                                    {"username": "user", "authzid": ""})
+            if keys is None:
+                keys = profile.lookup_keys("SHA-1", salt, 4096)
+                self.assertIsNotNone(keys)
+            else:
+                self.assertIs(profile.lookup_keys("SHA-1", salt, 4096), keys)
+        self.assertEqual(profile.get_keys(SCRAMOperations("SHA-1"), salt,
+                                                        4096), (keys, True))
+
+    def test_attributes(self):
+        """The identity is escaped and the GS2 headers built once."""
+        profile = ClientProfile("us,er=", "pencil", "ad=min,")
+        self.assertEqual(profile.username_attribute, b"n=us=2Cer=3D")
+        self.assertEqual(profile.authzid_attribute, b"a=ad=3Dmin=2C")
+        header = profile.gs2_header(b"y")
+        self.assertEqual(header, b"y,a=ad=3Dmin=2C,")
+        self.assertIs(profile.gs2_header(b"y"), header)
+        self.assertEqual(ClientProfile("user", "pencil").gs2_header(
+                                        b"p=tls-unique"), b"p=tls-unique,,")
+
+    def test_server(self):
+        """Exchanges with a profile succeed with the server."""
+        profile = ClientProfile("us,er=", "pencil", "admin")
+        for _ in range(2):
+            client = SCRAMClientAuthenticator("SHA-256", False)
+            server = SCRAMServerAuthenticator("SHA-256", False,
+                                                        PasswordDatabase())
+            response = client.start({"SCRAM-client-profile": profile})
+            response = client.challenge(server.start(
+                            {"SCRAM-iteration-count": 16}, response))
+            properties, challenge = server.response(response)
+            self.assertEqual(properties,
+                                {"username": "us,er=", "authzid": "admin"})
+            self.assertEqual(client.finish(challenge),
+                                {"username": "us,er=", "authzid": "admin"})
+
+    def test_threads(self):
+        """Keys are derived once for concurrent exchanges."""
+        profile = ClientProfile("user", "pencil")
+        operations = SCRAMOperations("SHA-1")
+        results = []
+        def get_keys():
+            """Get the keys."""
+            results.append(profile.get_keys(operations, b"salt", 4096))
+        threads = [threading.Thread(target = get_keys) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(id(keys) for keys, _ in results)), 1)
+        self.assertEqual(sorted(cached for _, cached in results),
+                                                        [False] + [True] * 7)
+
+    def test_max_keys(self):
+        """Only the keys of the last `max_keys` salts are kept."""
+        profile = ClientProfile("user", "pencil", max_keys = 2)
+        operations = SCRAMOperations("SHA-1")
+        for salt in (b"salt1", b"salt2", b"salt3"):
+            profile.get_keys(operations, salt, 16)
+        self.assertIsNone(profile.lookup_keys("SHA-1", b"salt1", 16))
+        self.assertIsNotNone(profile.lookup_keys("SHA-1", b"salt3", 16))
+        self.assertFalse(profile.get_keys(operations, b"salt1", 16)[1])
+        self.assertTrue(profile.get_keys(operations, b"salt3", 16)[1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+"""Tests of the memory-mapped credential files."""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyxmpp2_scram.credfile import _HEADER, _SLOT, CredentialFile, \
+        CredentialFileBuilder, build_credential_file
+
+class TestCredentialFile(unittest.TestCase):
+    """Checks building and reading credential files."""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "credentials")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_build_and_read(self):
+        """Every user added is found, with the right iteration count."""
+        count = build_credential_file(self.path,
+                            (("user{0}".format(i), "pencil") for i in range(20)),
+                            ("SHA-1",), iteration_count = 16)
+        self.assertEqual(count, 20)
+        credentials = CredentialFile(self.path)
+        self.assertEqual(len(credentials), 20)
+        for i in range(20):
+            keys = credentials.get_keys("user{0}".format(i), "SHA-1")
+            self.assertEqual(keys[1], 16)
+        self.assertIsNone(credentials.get_keys("nobody", "SHA-1"))
+
+    def test_failed_build_removes_file(self):
+        """A failed build leaves neither the target nor a temporary file."""
+        def items():
+            """Fail after the first user."""
+            yield "user", "pencil"
+            raise KeyboardInterrupt()
+        with self.assertRaises(KeyboardInterrupt):
+            build_credential_file(self.path, items(), ("SHA-1",),
+                                                    iteration_count = 16)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_unfinished_build_removes_file(self):
+        """A builder neither committed nor aborted leaves no file."""
+        builder = CredentialFileBuilder(self.path, ("SHA-1",))
+        builder.add("user", {})
+        del builder
+        self.assertEqual(os.listdir(self.directory), [])
+        with CredentialFileBuilder(self.path, ("SHA-1",)) as builder:
+            builder.abort()
+        self.assertEqual(os.listdir(self.directory), [])
+        with self.assertRaises(ValueError):
+            builder.commit()
+
+    def test_full_index(self):
+        """A corrupted index with no empty slot does not hang lookups."""
+        with CredentialFileBuilder(self.path, ("SHA-1",)) as builder:
+            builder.add("user", {})
+        with open(self.path, "r+b") as stream:
+            data = stream.read()
+            slot_count, index_offset = _HEADER.unpack_from(data, 0)[3::2]
+            self.assertEqual(slot_count, 2)
+            offset, tag = max(_SLOT.unpack_from(data,
+                                        index_offset + slot * _SLOT.size)
+                                                for slot in range(slot_count))
+            stream.seek(index_offset)
+            stream.write(_SLOT.pack(offset, tag ^ 1) * slot_count)
+        credentials = CredentialFile(self.path)
+        with self.assertRaises(ValueError):
+            credentials.get_keys("other", "SHA-1")
+
+    def test_bad_values(self):
+        """Values which do not fit in the file format are rejected."""
+        entry = (b"s" * 16, 4096, b"k" * 20, b"k" * 20)
+        with CredentialFileBuilder(self.path, ("SHA-1",)) as builder:
+            for username, credentials in (("u" * 65536, {}),
+                        ("user", {"SHA-1": (b"s" * 256,) + entry[1:]}),
+                        ("user", {"SHA-1": entry[:1] + (0,) + entry[2:]}),
+                        ("user", {"SHA-1": entry[:1] + (2 ** 32,) + entry[2:]}),
+                        ("user", {"SHA-1": entry[:2] + (b"k",) + entry[3:]})):
+                with self.assertRaises(ValueError):
+                    builder.add(username, credentials)
+            builder.add("user", {"SHA-1": entry})
+        self.assertEqual(CredentialFile(self.path).get_keys("user", "SHA-1"),
+                                                                        entry)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+"""Tests of the decoy credentials for unknown users."""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import unittest
+
+from pyxmpp2_scram.decoy import DecoyCredentials
+from pyxmpp2_scram.exceptions import NotAuthorizedException
+from pyxmpp2_scram.parser import parse_server_first_message
+from pyxmpp2_scram.scram import HASH_FACTORIES, SCRAMClientAuthenticator, \
+        SCRAMServerAuthenticator
+
+SECRET = b"0123456789abcdef"
+
+class PasswordDatabase(object):
+    """Database without any users."""
+    # pylint: disable=R0903
+    def get_password(self, username, formats, properties):
+        """Find nobody."""
+        # pylint: disable=W0613,R0201
+        return None, None
+
+class TestDecoyCredentials(unittest.TestCase):
+    """Checks the derived credentials and their use by the server."""
+    def test_stable(self):
+        """Credentials depend on the secret, the user and the hash only."""
+        decoys = DecoyCredentials(SECRET)
+        for hash_name, hash_factory in HASH_FACTORIES.items():
+            salt, count, stored_key, server_key = decoys.get_keys(hash_name,
+                                                                "ghost", 4096)
+            self.assertEqual(len(salt), 16)
+            self.assertEqual(count, 4096)
+            self.assertEqual(len(stored_key), hash_factory().digest_size)
+            self.assertEqual(len(server_key), hash_factory().digest_size)
+            self.assertEqual(DecoyCredentials(SECRET, max_size = 1).get_keys(
+                                hash_name, "ghost", 4096),
+                                (salt, count, stored_key, server_key))
+            self.assertNotEqual(decoys.get_keys(hash_name, "ghost2",
+                                                            4096)[0], salt)
+            self.assertNotEqual(DecoyCredentials(b"x" * 16).get_keys(
+                                        hash_name, "ghost", 4096)[0], salt)
+            other = decoys.get_keys(hash_name, "ghost", 8192)
+            self.assertEqual(other[:2], (salt, 8192))
+            self.assertNotEqual(other[2:], (stored_key, server_key))
+
+    def test_salt_per_hash(self):
+        """Each hash gets a different salt."""
+        decoys = DecoyCredentials(SECRET)
+        salts = set(decoys.get_keys(hash_name, "ghost", 4096)[0]
+                                            for hash_name in HASH_FACTORIES)
+        self.assertEqual(len(salts), len(HASH_FACTORIES))
+
+    def test_arguments(self):
+        """Short secrets and bad salt sizes are rejected."""
+        self.assertEqual(len(DecoyCredentials(SECRET, salt_size = 32)
+                                .get_keys("SHA-1", "ghost", 4096)[0]), 32)
+        with self.assertRaises(ValueError):
+            DecoyCredentials(b"short")
+        for salt_size in (0, 33):
+            with self.assertRaises(ValueError):
+                DecoyCredentials(SECRET, salt_size = salt_size)
+        with self.assertRaises(ValueError):
+            DecoyCredentials(SECRET, max_size = 0)
+
+    def test_server(self):
+        """Unknown users get the same salt on every attempt and fail."""
+        decoys = DecoyCredentials(SECRET)
+        salts = set()
+        for _ in range(3):
+            client = SCRAMClientAuthenticator("SHA-256", False)
+            server = SCRAMServerAuthenticator("SHA-256", False,
+                                                        PasswordDatabase())
+            response = client.start({"username": "ghost",
+                                                    "password": "pencil"})
+            challenge = server.start({"SCRAM-decoy-credentials": decoys,
+                            "SCRAM-iteration-count": 4096}, response)
+            salts.add(parse_server_first_message(challenge).salt)
+            with self.assertRaises(NotAuthorizedException):
+                server.response(client.challenge(challenge))
+        self.assertEqual(len(salts), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+"""Tests of the instrumentation hooks."""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import logging
+import unittest
+
+from unittest import mock
+
+from pyxmpp2_scram import scram
+from pyxmpp2_scram.cache import KeyCache
+from pyxmpp2_scram.exceptions import NotAuthorizedException
+from pyxmpp2_scram.instrument import Instrumentation, \
+        LoggingInstrumentation, PrometheusInstrumentation
+from pyxmpp2_scram.scram import SCRAMClientAuthenticator, \
+        SCRAMServerAuthenticator
+
+class PasswordDatabase(object):
+    """Single-user plain-text password database."""
+    # pylint: disable=R0903
+    def get_password(self, username, formats, properties):
+        """Return the password of ``user``."""
+        # pylint: disable=W0613
+        if username == "user":
+            return "pencil", "plain"
+        return None, None
+
+class RecordingInstrumentation(Instrumentation):
+    """Records all the events."""
+    def __init__(self):
+        self.events = []
+
+    def phase(self, mechanism, side, phase, seconds):
+        self.events.append(("phase", mechanism, side, phase))
+
+    def kdf(self, mechanism, side, iteration_count, seconds):
+        self.events.append(("kdf", mechanism, side, iteration_count))
+
+    def cache(self, mechanism, hit):
+        self.events.append(("cache", mechanism, hit))
+
+    def failure(self, mechanism, side, exception):
+        self.events.append(("failure", mechanism, side,
+                                            exception.__class__.__name__))
+
+    def success(self, mechanism, side):
+        self.events.append(("success", mechanism, side))
+
+class Metric(object):
+    """Prometheus-like counter and histogram."""
+    def __init__(self, name, documentation, label_names, **kwargs):
+        # pylint: disable=W0613
+        self.name = name
+        self.values = {}
+        self._labels = None
+
+    def labels(self, *labels):
+        """Select the labels."""
+        self._labels = labels
+        return self
+
+    def inc(self, value = 1):
+        """Increment a counter."""
+        self.values[self._labels] = self.values.get(self._labels, 0) + value
+
+    def observe(self, value):
+        """Record a histogram value."""
+        self.values.setdefault(self._labels, []).append(value)
+
+def exchange(instrumentation, password, key_cache = None):
+    """Run a SCRAM-SHA-1 exchange, reporting both sides."""
+    client = SCRAMClientAuthenticator("SHA-1", False)
+    server = SCRAMServerAuthenticator("SHA-1", False, PasswordDatabase())
+    client_properties = {"username": "user", "password": password,
+                                "SCRAM-instrumentation": instrumentation}
+    if key_cache is not None:
+        client_properties["SCRAM-key-cache"] = key_cache
+    response = client.start(client_properties)
+    challenge = server.start({"SCRAM-instrumentation": instrumentation,
+                                "SCRAM-iteration-count": 16}, response)
+    response = client.challenge(challenge)
+    try:
+        challenge = server.response(response)[1]
+    except NotAuthorizedException:
+        return False
+    client.finish(challenge)
+    return True
+
+class TestInstrumentation(unittest.TestCase):
+    """Checks the events reported by the authenticators."""
+    def test_success(self):
+        """All the phases of a successful exchange are reported."""
+        instrumentation = RecordingInstrumentation()
+        self.assertTrue(exchange(instrumentation, "pencil"))
+        events = instrumentation.events
+        phases = set((event[2], event[3]) for event in events
+                                                    if event[0] == "phase")
+        self.assertEqual(phases, set([("client", "nonce"),
+                        ("client", "parse"), ("client", "kdf"),
+                        ("client", "proof"), ("client", "verify"),
+                        ("server", "parse"), ("server", "lookup"),
+                        ("server", "kdf"), ("server", "nonce"),
+                        ("server", "build"), ("server", "verify")]))
+        self.assertIn(("kdf", "SCRAM-SHA-1", "client", 16), events)
+        self.assertIn(("kdf", "SCRAM-SHA-1", "server", 16), events)
+        self.assertIn(("success", "SCRAM-SHA-1", "server"), events)
+        self.assertIn(("success", "SCRAM-SHA-1", "client"), events)
+        self.assertFalse([event for event in events
+                                                if event[0] == "failure"])
+
+    def test_server_nonce_not_in_build(self):
+        """The server nonce generation is not counted in the build phase."""
+        clock = [0.0]
+        seconds = {}
+        class TimingInstrumentation(Instrumentation):
+            """Records the phase times of the server."""
+            def phase(self, mechanism, side, phase, elapsed):
+                if side == "server":
+                    seconds[phase] = elapsed
+        def nonce_factory():
+            """Take one (fake) second to generate the nonce."""
+            clock[0] += 1
+            return b"server-nonce"
+        client = SCRAMClientAuthenticator("SHA-1", False)
+        server = SCRAMServerAuthenticator("SHA-1", False, PasswordDatabase())
+        response = client.start({"username": "user", "password": "pencil"})
+        with mock.patch.object(scram, "timer", lambda: clock[0]):
+            server.start({"SCRAM-instrumentation": TimingInstrumentation(),
+                                        "SCRAM-iteration-count": 16,
+                                        "nonce_factory": nonce_factory},
+                                                                    response)
+        self.assertEqual(seconds["nonce"], 1)
+        self.assertEqual(seconds["build"], 0)
+
+    def test_failure_and_cache(self):
+        """Failures and key cache lookups are reported."""
+        instrumentation = RecordingInstrumentation()
+        key_cache = KeyCache()
+        self.assertFalse(exchange(instrumentation, "wrong", key_cache))
+        self.assertIn(("failure", "SCRAM-SHA-1", "server",
+                            "NotAuthorizedException"), instrumentation.events)
+        self.assertNotIn(("success", "SCRAM-SHA-1", "server"),
+                                                    instrumentation.events)
+        self.assertIn(("cache", "SCRAM-SHA-1", False), instrumentation.events)
+
+    def test_prometheus(self):
+        """Events are recorded as metrics."""
+        instrumentation = PrometheusInstrumentation(counter_factory = Metric,
+                                                histogram_factory = Metric)
+        exchange(instrumentation, "pencil")
+        exchange(instrumentation, "wrong")
+        self.assertEqual(instrumentation.successes.values,
+                            {("SCRAM-SHA-1", "client"): 1,
+                                                ("SCRAM-SHA-1", "server"): 1})
+        self.assertEqual(instrumentation.failures.values,
+                {("SCRAM-SHA-1", "server", "NotAuthorizedException"): 1})
+        self.assertEqual(instrumentation.kdf_iterations.values,
+                            {("SCRAM-SHA-1", "client"): 32,
+                                                ("SCRAM-SHA-1", "server"): 32})
+
+    def test_logging(self):
+        """Events are logged at the configured level."""
+        logger = logging.getLogger("pyxmpp2_scram.test")
+        instrumentation = LoggingInstrumentation(logger, logging.INFO)
+        with self.assertLogs(logger, logging.INFO) as logs:
+            exchange(instrumentation, "pencil")
+        self.assertIn("INFO:pyxmpp2_scram.test:SCRAM-SHA-1 server success",
+                                                                logs.output)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+"""Tests of the Hi() backends."""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import hashlib
+import unittest
+
+from pyxmpp2_scram import kdf
+from pyxmpp2_scram.exceptions import BadChallengeException
+from pyxmpp2_scram.scram import HASH_FACTORIES, SCRAMOperations, \
+        SCRAMClientAuthenticator
+
+# RFC 5802 (SCRAM-SHA-1) and RFC 7677 (SCRAM-SHA-256) example exchanges
+RFC_EXCHANGES = [
+    ("SHA-1", b"fyko+d2lbbFgONRv9qkxdawL",
+        b"r=fyko+d2lbbFgONRv9qkxdawL3rfcNHYJY1ZVvWVs7j,s=QSXCR+Q6sek8bf92,"
+                                                                b"i=4096",
+        b"c=biws,r=fyko+d2lbbFgONRv9qkxdawL3rfcNHYJY1ZVvWVs7j,"
+                                    b"p=v0X8v3Bz2T0CJGbJQyF0X+HI4Ts=",
+        b"v=rmF9pqV8S7suAoZWja4dJRkFsKQ="),
+    ("SHA-256", b"rOprNGfwEbeRWgbNEkqO",
+        b"r=rOprNGfwEbeRWgbNEkqO%hvYDpWUa2RaTCAfuxFIlj)hNlF$k0,"
+                                    b"s=W22ZaJ0SNY7soEsUEjb6gQ==,i=4096",
+        b"c=biws,r=rOprNGfwEbeRWgbNEkqO%hvYDpWUa2RaTCAfuxFIlj)hNlF$k0,"
+                    b"p=dHzbZapWIk4jUhN+Ute9ytag9zjfMHgsqmmiz7AndVQ=",
+        b"v=6rriTRBi23WpRR/wtup+mMhUZUn/dB5nLTJRsjl95G4="),
+    ]
+
+class FailingBackend(kdf.KDFBackend):
+    """Backend raising an exception for every digest."""
+    name = "failing"
+    def __init__(self, exception):
+        kdf.KDFBackend.__init__(self)
+        self.exception = exception
+
+    def _derive(self, digest_name, password, salt, iterations):
+        raise self.exception
+
+class TestBackends(unittest.TestCase):
+    """Checks the backends against each other and the RFC examples."""
+    def test_backends_agree(self):
+        """All the available backends give the same results."""
+        for hash_name in HASH_FACTORIES:
+            for iterations in (1, 2, 4096):
+                results = set()
+                for name in kdf.available_backends():
+                    operations = SCRAMOperations(hash_name, name)
+                    results.add(operations.Hi(b"pencil", b"salt",
+                                                                iterations))
+                self.assertEqual(len(results), 1, (hash_name, iterations))
+
+    def test_rfc_exchanges(self):
+        """The RFC example exchanges, with every backend."""
+        for name in kdf.available_backends():
+            for (hash_name, c_nonce, server_first, client_final,
+                                        server_final) in RFC_EXCHANGES:
+                client = SCRAMClientAuthenticator(hash_name, False, name)
+                client.start({"username": "user", "password": "pencil",
+                                        "nonce_factory": lambda: c_nonce})
+                self.assertEqual(client.challenge(server_first),
+                                                            client_final)
+                self.assertEqual(client.finish(server_final),
+                                    {"username": "user", "authzid": ""})
+
+    def test_digest_names(self):
+        """The digest names are the lower-case `hashlib` names."""
+        for hash_name, factory in HASH_FACTORIES.items():
+            digest_name = SCRAMOperations(hash_name).digest_name
+            self.assertEqual(digest_name, digest_name.lower())
+            self.assertEqual(hashlib.new(digest_name).digest_size,
+                                                    factory().digest_size)
+            self.assertTrue(hasattr(hashlib, digest_name))
+
+    def test_zero_iterations(self):
+        """All the backends reject an iteration count of 0."""
+        for name in kdf.available_backends():
+            backend = kdf.get_backend(name)
+            with self.assertRaises(ValueError):
+                backend.derive("sha1", b"pencil", b"salt", 0)
+
+    def test_zero_iterations_challenge(self):
+        """A server first message with ``i=0`` is a bad challenge."""
+        client = SCRAMClientAuthenticator("SHA-1", False)
+        client.start({"username": "user", "password": "pencil",
+                                    "nonce_factory": lambda: b"abcdef"})
+        with self.assertRaises(BadChallengeException):
+            client.challenge(b"r=abcdefghij,s=QSXCR+Q6sek8bf92,i=0")
+
+    def test_unsupported_digest_fallback(self):
+        """A backend failing its self-test falls back to the Python loop."""
+        errors = [ValueError("unsupported")]
+        # pylint: disable=W0212
+        if kdf._UnsupportedAlgorithm is not None:
+            errors.append(kdf._UnsupportedAlgorithm("unsupported"))
+        expected = kdf.PYTHON_BACKEND.derive("md5", b"pencil", b"salt", 16)
+        for error in errors:
+            backend = FailingBackend(error)
+            self.assertFalse(backend.supports("md5"))
+            self.assertEqual(backend.derive("md5", b"pencil", b"salt", 16),
+                                                                    expected)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+"""Differential tests of the hand-written SCRAM message parsers.
+
+The parsers in `pyxmpp2_scram.parser` must accept exactly the messages
+matched by the regular expressions in `pyxmpp2_scram.scram` and return the
+same fields; they are compared on valid, mutated and random messages.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import random
+import unittest
+
+from pyxmpp2_scram import parser, scram
+
+PIECES = [b"n", b"y", b"p", b"=", b",", b"a", b"m", b"r", b"s", b"i", b"c",
+        b"v", b"e", b"\n", b"\0", b"x", b"1", b"9", b"+", b"/", b"=2C",
+        b"=3D", b"tls-unique", b"[", b"_", b" ", b"\x7f", b"\xff", b"p=",
+        b"n=", b"r=", b"s=", b"i=", b"c=", b"v=", b"e=", b"m=", b"a=",
+        b"abc", b"biws", b"n,,", b"y,,", b"p=tls,", b",p=", b",r=", b",s=",
+        b",i="]
+
+VALID_MESSAGES = [
+    b"n,,n=user,r=fyko+d2lbbFgONRv9qkxdawL",
+    b"p=tls-unique,a=ad=2Cm,n=u,r=x,ext=1",
+    b"y,a=admin,n=u=3Dv,r=abc",
+    b"n,,m=foo,n=u,r=a",
+    b"r=fyko+d2lbbFgONRv9qkxdawL3rfcNHYJY1ZVvWVs7j,s=QSXCR+Q6sek8bf92,"
+                                                                b"i=4096",
+    b"m=q,r=a,s=b,i=1,x",
+    b"c=biws,r=fyko+d2lbbFgONRv9qkxdawL3rfcNHYJY1ZVvWVs7j,"
+                                    b"p=v0X8v3Bz2T0CJGbJQyF0X+HI4Ts=",
+    b"c=biws,r=a,x=y,p=q",
+    b"v=rmF9pqV8S7suAoZWja4dJRkFsKQ=",
+    b"e=invalid-proof",
+    b"v=abc,ext",
+    ]
+
+PARSERS = [
+    (scram.CLIENT_FIRST_MESSAGE_RE, parser.parse_client_first_message,
+        ("gs2_header", "cb_name", "authzid", "mext", "username", "nonce",
+                                                        "client_first_bare")),
+    (scram.SERVER_FIRST_MESSAGE_RE, parser.parse_server_first_message,
+        ("mext", "nonce", "salt", "iteration_count")),
+    (scram.CLIENT_FINAL_MESSAGE_RE, parser.parse_client_final_message,
+        ("cb", "nonce", "proof", "without_proof")),
+    (scram.SERVER_FINAL_MESSAGE_RE, parser.parse_server_final_message,
+        ("error", "verifier")),
+    ]
+
+ROUNDS = 20000
+
+def mutate(rand, message):
+    """Delete, insert or replace up to three pieces of a message."""
+    message = bytearray(message)
+    for _ in range(rand.randint(0, 3)):
+        operation = rand.randint(0, 3)
+        index = rand.randint(0, len(message))
+        if operation == 0 and message:
+            del message[min(index, len(message) - 1)]
+        elif operation == 1:
+            message[index:index] = rand.choice(PIECES)
+        elif operation == 2 and message:
+            message[min(index, len(message) - 1)] = rand.randint(0, 255)
+        else:
+            message[index:index] = rand.choice((b"\n", b","))
+    return bytes(message)
+
+def generate(rand):
+    """Generate a mutated valid message or a random one."""
+    if rand.random() < 0.6:
+        return mutate(rand, rand.choice(VALID_MESSAGES))
+    return b"".join(rand.choice(PIECES) for _ in range(rand.randint(0, 12)))
+
+class TestParser(unittest.TestCase):
+    """Compares the parsers with the regular expressions."""
+    def check(self, regexp, parse, fields, message):
+        """Check that a parser agrees with a regular expression on
+        a message.
+
+        :return: `True` if the message was accepted
+        """
+        match = regexp.match(message)
+        parsed = parse(message)
+        self.assertEqual(match is None, parsed is None,
+                                            (parse.__name__, message))
+        if match is None:
+            return False
+        for field in fields:
+            self.assertEqual(getattr(parsed, field), match.group(field),
+                                            (parse.__name__, message, field))
+        return True
+
+    def test_valid(self):
+        """The valid messages are accepted by the matching parser."""
+        accepted = 0
+        for message in VALID_MESSAGES:
+            for regexp, parse, fields in PARSERS:
+                accepted += self.check(regexp, parse, fields, message)
+        self.assertGreaterEqual(accepted, len(VALID_MESSAGES))
+
+    def test_generated(self):
+        """The parsers agree on mutated and random messages."""
+        rand = random.Random(0)
+        for regexp, parse, fields in PARSERS:
+            accepted = 0
+            for _ in range(ROUNDS):
+                accepted += self.check(regexp, parse, fields,
+                                                            generate(rand))
+            self.assertGreater(accepted, 0, parse.__name__)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+"""Tests of the iteration count policy and the rate limiter."""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import logging
+import unittest
+
+from unittest import mock
+
+from pyxmpp2_scram import kdf, policy
+from pyxmpp2_scram.policy import IterationPolicy, RateLimiter
+from pyxmpp2_scram.scram import SCRAMOperations, SCRAMClientAuthenticator, \
+        SCRAMServerAuthenticator
+
+class Clock(object):
+    """Manually advanced clock."""
+    # pylint: disable=R0903
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class FakeKDFBackend(kdf.KDFBackend):
+    """Takes `seconds_per_iteration` of the fake clock per iteration."""
+    name = "fake"
+    def __init__(self, clock, seconds_per_iteration):
+        kdf.KDFBackend.__init__(self)
+        self.clock = clock
+        self.seconds_per_iteration = seconds_per_iteration
+        self.calls = []
+
+    def derive(self, digest_name, password, salt, iterations):
+        self.calls.append((digest_name, iterations))
+        self.clock.now += iterations * self.seconds_per_iteration
+        return b"\0" * 20
+
+class KeysDatabase(object):
+    """Single-user database with SCRAM-SHA-1 keys for 4096 iterations."""
+    # pylint: disable=R0903
+    def __init__(self):
+        operations = SCRAMOperations("SHA-1")
+        salted_password = operations.Hi(b"pencil", b"salt", 4096)
+        self.keys = (b"salt", 4096,
+                    operations.H(operations.HMAC(salted_password,
+                                                            b"Client Key")),
+                    operations.HMAC(salted_password, b"Server Key"))
+
+    def get_password(self, username, formats, properties):
+        """Return the keys of ``user``."""
+        # pylint: disable=W0613
+        if username == "user":
+            return self.keys, "SCRAM-SHA-1-Keys"
+        return None, None
+
+class TestRateLimiter(unittest.TestCase):
+    """Checks the token bucket."""
+    def test_burst_and_refill(self):
+        """Up to `burst` events pass at once, then `rate` per second."""
+        clock = Clock()
+        with mock.patch.object(policy, "_clock", clock):
+            limiter = RateLimiter(2, burst = 3)
+            self.assertEqual([limiter.allow() for _ in range(4)],
+                                                [True, True, True, False])
+            clock.now += 0.5
+            self.assertEqual([limiter.allow() for _ in range(2)],
+                                                            [True, False])
+            clock.now += 100
+            self.assertEqual([limiter.allow() for _ in range(4)],
+                                                [True, True, True, False])
+
+    def test_default_burst(self):
+        """The default burst is the rate, at least one."""
+        self.assertEqual(RateLimiter(5).burst, 5)
+        self.assertEqual(RateLimiter(0.1).burst, 1)
+
+class TestIterationPolicy(unittest.TestCase):
+    """Checks the calibration and its use by the server."""
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch.object(policy, "_cpu_clock", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_calibrate(self):
+        """Counts give the target time, rounded and clamped."""
+        backend = FakeKDFBackend(self.clock, 1.234e-6)
+        iteration_policy = IterationPolicy(kdf_backend = backend)
+        self.assertEqual(iteration_policy.calibrate(("SHA-1", "SHA-256")),
+                                        {"SHA-1": 40000, "SHA-256": 40000})
+        self.assertEqual(set(backend.calls), set([("sha1", 4096),
+                                                        ("sha256", 4096)]))
+        iteration_policy = IterationPolicy(kdf_backend = FakeKDFBackend(
+                                    self.clock, 1e-3), hash_names = ("SHA-1",))
+        self.assertEqual(iteration_policy.iteration_count("SHA-1"), 4096)
+        iteration_policy = IterationPolicy(max_iterations = 20000,
+                        kdf_backend = FakeKDFBackend(self.clock, 1e-9),
+                        hash_names = ("SHA-1",))
+        self.assertEqual(iteration_policy.iteration_count("SHA-1"), 20000)
+
+    def test_zero_time(self):
+        """A Hi() too fast for the clock gives the maximum count."""
+        iteration_policy = IterationPolicy(kdf_backend = FakeKDFBackend(
+                                                            self.clock, 0))
+        self.assertEqual(iteration_policy.iteration_count("SHA-1",
+                                                calibrate = True), 10000000)
+
+    def test_not_calibrated(self):
+        """Without calibration the minimum count is used and no upgrade is
+        requested, without measuring Hi()."""
+        backend = FakeKDFBackend(self.clock, 2 ** -20)
+        iteration_policy = IterationPolicy(kdf_backend = backend)
+        self.assertEqual(iteration_policy.iteration_count("SHA-1"), 4096)
+        self.assertFalse(iteration_policy.needs_upgrade("SHA-1", 1))
+        self.assertEqual(backend.calls, [])
+
+    def test_calibrated_once(self):
+        """Counts are measured once, on request."""
+        backend = FakeKDFBackend(self.clock, 2 ** -20)
+        iteration_policy = IterationPolicy(kdf_backend = backend)
+        self.assertEqual(iteration_policy.iteration_count("SHA-1",
+                                                    calibrate = True), 52000)
+        calls = len(backend.calls)
+        self.assertTrue(iteration_policy.needs_upgrade("SHA-1", 51999))
+        self.assertFalse(iteration_policy.needs_upgrade("SHA-1", 52000))
+        self.assertEqual(len(backend.calls), calls)
+
+    def test_log(self):
+        """The calibration result is logged."""
+        iteration_policy = IterationPolicy(kdf_backend = FakeKDFBackend(
+                                                    self.clock, 2 ** -20))
+        with self.assertLogs("pyxmpp2_scram.policy", logging.DEBUG) as logs:
+            iteration_policy.calibrate(("SHA-1",))
+        self.assertEqual(logs.output, ["DEBUG:pyxmpp2_scram.policy:SHA-1"
+                    " Hi() with fake backend: 1.0 us per iteration, using"
+                    " 52000 iterations"])
+
+    def test_dummy_limit(self):
+        """Unknown user Hi() computations are rate-limited."""
+        self.assertTrue(all(IterationPolicy().allow_dummy()
+                                                    for _ in range(100)))
+        iteration_policy = IterationPolicy(dummy_rate = 2)
+        self.assertEqual([iteration_policy.allow_dummy() for _ in range(3)],
+                                                        [True, True, False])
+
+    def test_upgrade_needed(self):
+        """Stored credentials below the calibrated policy are reported."""
+        for seconds_per_iteration, hash_names, expected in (
+                                            (2 ** -20, ("SHA-1",), True),
+                                            (2 ** -20, None, None),
+                                            (1e-3, ("SHA-1",), None)):
+            iteration_policy = IterationPolicy(kdf_backend = FakeKDFBackend(
+                                        self.clock, seconds_per_iteration),
+                                        hash_names = hash_names)
+            client = SCRAMClientAuthenticator("SHA-1", False)
+            server = SCRAMServerAuthenticator("SHA-1", False, KeysDatabase())
+            response = client.start({"username": "user",
+                                                    "password": "pencil"})
+            response = client.challenge(server.start(
+                    {"SCRAM-iteration-policy": iteration_policy}, response))
+            properties, challenge = server.response(response)
+            client.finish(challenge)
+            self.assertEqual(properties.get("SCRAM-upgrade-needed"),
+                                                                    expected)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+"""Tests of the server-side mechanism registry."""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import unittest
+
+from pyxmpp2_scram.registry import SCRAMMechanismRegistry
+from pyxmpp2_scram.store import SCRAMCredentialStore
+
+from .helpers import login
+
+class CountingStore(SCRAMCredentialStore):
+    """Credential store counting the lookups."""
+    def __init__(self):
+        SCRAMCredentialStore.__init__(self, ("SHA-512", "SHA-256", "SHA-1"),
+                                                                        16)
+        self.lookups = []
+
+    def get_password(self, username, formats, properties):
+        self.lookups.append("get_password")
+        return SCRAMCredentialStore.get_password(self, username, formats,
+                                                                properties)
+
+    def get_credentials(self, username, formats, properties):
+        self.lookups.append("get_credentials")
+        return SCRAMCredentialStore.get_credentials(self, username, formats,
+                                                                properties)
+
+class TestRegistry(unittest.TestCase):
+    """Checks the credential lookups of the created authenticators."""
+    def setUp(self):
+        self.store = CountingStore()
+        self.store.set_password("user", "pencil")
+        self.registry = SCRAMMechanismRegistry(self.store)
+
+    def test_single_lookup(self):
+        """Each exchange fetches all the hashes in a single call."""
+        for name in self.registry.mechanisms(False):
+            self.assertEqual(login(self.registry.create(name),
+                                        properties = {})["username"], "user")
+        self.assertEqual(self.store.lookups, ["get_credentials"] * 3)
+
+    def test_prefetched(self):
+        """Exchanges sharing the ``"SCRAM-credentials"`` dictionary fetch
+        the credentials once."""
+        properties = {"SCRAM-credentials": {}}
+        for name in self.registry.mechanisms(False):
+            self.assertEqual(login(self.registry.create(name),
+                                properties = properties)["username"], "user")
+        self.assertEqual(self.store.lookups, ["get_credentials"])
+        self.assertEqual(sorted(properties["SCRAM-credentials"]["user"]),
+                        ["SCRAM-SHA-1-Keys", "SCRAM-SHA-256-Keys",
+                                                    "SCRAM-SHA-512-Keys"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+"""Tests of the replayed exchange detection."""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+import unittest
+
+from pyxmpp2_scram.exceptions import NotAuthorizedException
+from pyxmpp2_scram.replay import NonceRegistry
+from pyxmpp2_scram.resume import ExchangeTokenCodec
+from pyxmpp2_scram.scram import SCRAMClientAuthenticator, \
+        SCRAMServerAuthenticator
+
+class PasswordDatabase(object):
+    """Single-user plain-text password database."""
+    # pylint: disable=R0903
+    def get_password(self, username, formats, properties):
+        """Return the password of ``user``."""
+        # pylint: disable=W0613
+        if username == "user":
+            return "pencil", "plain"
+        return None, None
+
+def nonces(prefix, count):
+    """Generate distinct nonces."""
+    return ["{0}-{1}".format(prefix, i).encode("ascii")
+                                                    for i in range(count)]
+
+class TestNonceRegistry(unittest.TestCase):
+    """Checks the Bloom filter rotation and error bounds."""
+    def test_replay(self):
+        """A nonce is accepted once."""
+        registry = NonceRegistry(capacity = 1000)
+        self.assertTrue(registry.add(b"nonce", 100))
+        self.assertFalse(registry.add(b"nonce", 100))
+        self.assertTrue(registry.add(b"other", 100))
+        stats = registry.stats()
+        self.assertEqual((stats["lookups"], stats["replays"]), (3, 1))
+        self.assertEqual(stats["size"], registry.size)
+        with self.assertRaises(ValueError):
+            NonceRegistry(generations = 1)
+
+    def test_rotation(self):
+        """A nonce is remembered for `window` to ``window * generations /
+        (generations - 1)`` seconds."""
+        registry = NonceRegistry(capacity = 1000, window = 10,
+                                                            generations = 3)
+        self.assertEqual(registry.period, 5)
+        self.assertTrue(registry.add(b"early", 100.0))
+        self.assertTrue(registry.add(b"late", 104.9))
+        self.assertFalse(registry.add(b"early", 109.9))
+        self.assertFalse(registry.add(b"late", 114.9))
+        # the filter of the period starting at 100 is reused at 115
+        self.assertTrue(registry.add(b"early", 115.0))
+        self.assertTrue(registry.add(b"late", 115.0))
+        self.assertFalse(registry.add(b"early", 115.0))
+
+    def test_no_false_negatives(self):
+        """Every nonce registered within the window is found again."""
+        registry = NonceRegistry(capacity = 2000, window = 10,
+                                        error_rate = 1e-3, generations = 3)
+        items = nonces("nonce", 2000)
+        for i, nonce in enumerate(items):
+            # may be rejected too: a false positive
+            registry.add(nonce, 100 + i * 0.005)
+        for nonce in items:
+            self.assertFalse(registry.add(nonce, 110.0))
+
+    def test_false_positive_rate(self):
+        """The false positive rate stays near `error_rate` up to
+        `capacity` nonces per window."""
+        registry = NonceRegistry(capacity = 10000, window = 10,
+                                        error_rate = 1e-3, generations = 3)
+        for nonce in nonces("first", 5000):
+            registry.add(nonce, 100.0)
+        for nonce in nonces("second", 5000):
+            registry.add(nonce, 105.0)
+        self.assertLess(registry.false_positive_rate(105.0), 3e-3)
+        rejected = sum(not registry.add(nonce, 105.0)
+                                        for nonce in nonces("fresh", 2000))
+        self.assertLessEqual(rejected, 40)
+        # the filters stop being used as they expire
+        self.assertLess(registry.false_positive_rate(115.0),
+                                        registry.false_positive_rate(110.0))
+        self.assertEqual(registry.false_positive_rate(120.0), 0.0)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+    def test_shared(self):
+        """A shared registry is used by forked processes."""
+        registry = NonceRegistry(capacity = 1000, shared = True)
+        self.assertTrue(registry.add(b"parent", 100))
+        pid = os.fork()
+        if not pid:
+            status = 1
+            try:
+                if not registry.add(b"parent", 100) \
+                                        and registry.add(b"child", 100):
+                    status = 0
+            finally:
+                os._exit(status)        # pylint: disable=W0212
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.assertFalse(registry.add(b"child", 100))
+
+    def test_server(self):
+        """A resumed exchange is accepted once."""
+        registry = NonceRegistry(capacity = 1000)
+        codec = ExchangeTokenCodec(b"0123456789abcdef")
+        client = SCRAMClientAuthenticator("SHA-1", False)
+        server = SCRAMServerAuthenticator("SHA-1", False, PasswordDatabase())
+        response = client.start({"username": "user", "password": "pencil"})
+        response = client.challenge(server.start(
+                                {"SCRAM-iteration-count": 16}, response))
+        token = server.suspend(codec)
+        properties = {"SCRAM-nonce-registry": registry}
+        server = SCRAMServerAuthenticator.resume(codec, token, properties,
+                                                        PasswordDatabase())
+        client.finish(server.response(response)[1])
+        server = SCRAMServerAuthenticator.resume(codec, token, properties,
+                                                        PasswordDatabase())
+        with self.assertRaises(NotAuthorizedException):
+            server.response(response)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+"""Tests of the suspended and resumed server exchanges."""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import time
+import unittest
+
+from pyxmpp2_scram import kdf
+from pyxmpp2_scram.exceptions import NotAuthorizedException
+from pyxmpp2_scram.resume import pack_fields, unpack_fields, \
+        ExchangeTokenCodec, ExchangeStoreCodec, MemoryExchangeStore
+from pyxmpp2_scram.scram import SCRAMClientAuthenticator, \
+        SCRAMServerAuthenticator
+
+SECRET = b"0123456789abcdef0123456789abcdef"
+
+class PasswordDatabase(object):
+    """Single-user plain-text password database."""
+    # pylint: disable=R0903
+    def get_password(self, username, formats, properties):
+        """Return the password of ``user``."""
+        # pylint: disable=W0613
+        if username == "user":
+            return "pencil", "plain"
+        return None, None
+
+class RecordingAuditLog(object):
+    """Records the reported exchanges."""
+    def __init__(self):
+        self.records = []
+
+    def success(self, mechanism, side, username, authzid, duration):
+        """Record a success."""
+        # pylint: disable=R0913
+        self.records.append(("success", mechanism, username, duration))
+
+    def failure(self, mechanism, side, username, authzid, exception,
+                                                                duration):
+        """Record a failure."""
+        # pylint: disable=R0913
+        self.records.append(("failure", mechanism, username, duration))
+
+def suspend(codec, properties = None):
+    """Run an exchange up to the client final message and suspend the
+    server.
+
+    :return: the client, the client final message and the token
+    """
+    if properties is None:
+        properties = {}
+    properties["SCRAM-iteration-count"] = 16
+    client = SCRAMClientAuthenticator("SHA-256", False)
+    server = SCRAMServerAuthenticator("SHA-256", False, PasswordDatabase())
+    response = client.start({"username": "user", "password": "pencil"})
+    response = client.challenge(server.start(properties, response))
+    return client, response, server.suspend(codec)
+
+class TestFields(unittest.TestCase):
+    """Checks the state serialization."""
+    def test_round_trip(self):
+        """Fields, including `None` and empty ones, are restored."""
+        fields = [b"a", None, b"", b"\xff" * 1000, None]
+        self.assertEqual(unpack_fields(pack_fields(fields)), fields)
+        with self.assertRaises(ValueError):
+            unpack_fields(pack_fields(fields)[:-1])
+        with self.assertRaises(ValueError):
+            pack_fields([b"x" * 0xffff])
+
+class TestResume(unittest.TestCase):
+    """Checks `SCRAMServerAuthenticator.suspend` and `resume`."""
+    def test_round_trip(self):
+        """An exchange is finished by a resumed authenticator."""
+        for codec in (ExchangeTokenCodec(SECRET),
+                            ExchangeStoreCodec(MemoryExchangeStore())):
+            client, response, token = suspend(codec)
+            server = SCRAMServerAuthenticator.resume(codec, token, {},
+                                                        PasswordDatabase())
+            self.assertEqual(server.name, "SCRAM-SHA-256")
+            properties, challenge = server.response(response)
+            self.assertEqual(properties,
+                                    {"username": "user", "authzid": None})
+            self.assertEqual(client.finish(challenge)["username"], "user")
+
+    def test_tampered(self):
+        """Modified tokens and tokens of another secret are rejected."""
+        codec = ExchangeTokenCodec(SECRET)
+        token = suspend(codec)[2]
+        for bad_token in (token[:-1] + bytes(bytearray([token[-1] ^ 1])),
+                            token[:20] + b"x" + token[21:], token[:40], b""):
+            with self.assertRaises(NotAuthorizedException):
+                SCRAMServerAuthenticator.resume(codec, bad_token, {},
+                                                        PasswordDatabase())
+        with self.assertRaises(NotAuthorizedException):
+            SCRAMServerAuthenticator.resume(ExchangeTokenCodec(b"x" * 32),
+                                            token, {}, PasswordDatabase())
+
+    def test_expired(self):
+        """Expired tokens are rejected."""
+        for codec in (ExchangeTokenCodec(SECRET, ttl = -1),
+                        ExchangeStoreCodec(MemoryExchangeStore(), ttl = -1)):
+            token = suspend(codec)[2]
+            with self.assertRaises(NotAuthorizedException):
+                SCRAMServerAuthenticator.resume(codec, token, {},
+                                                        PasswordDatabase())
+
+    def test_replay(self):
+        """Store tokens can be used once, self-contained ones until they
+        expire."""
+        codec = ExchangeStoreCodec(MemoryExchangeStore())
+        token = suspend(codec)[2]
+        SCRAMServerAuthenticator.resume(codec, token, {}, PasswordDatabase())
+        with self.assertRaises(NotAuthorizedException):
+            SCRAMServerAuthenticator.resume(codec, token, {},
+                                                        PasswordDatabase())
+        codec = ExchangeTokenCodec(SECRET)
+        token = suspend(codec)[2]
+        for _ in range(2):
+            SCRAMServerAuthenticator.resume(codec, token, {},
+                                                        PasswordDatabase())
+
+    def test_kdf_backend(self):
+        """The resumed authenticator uses the requested KDF backend."""
+        codec = ExchangeTokenCodec(SECRET)
+        token = suspend(codec)[2]
+        backend = kdf.PythonKDFBackend()
+        server = SCRAMServerAuthenticator.resume(codec, token, {},
+                                                PasswordDatabase(), backend)
+        self.assertIs(server.kdf_backend, backend)
+        self.assertIs(server.config.kdf_backend, backend)
+
+    def test_duration(self):
+        """The audited duration includes the time before suspension."""
+        codec = ExchangeTokenCodec(SECRET)
+        audit = RecordingAuditLog()
+        client, response, token = suspend(codec,
+                                            {"SCRAM-audit-log": audit})
+        time.sleep(0.1)
+        server = SCRAMServerAuthenticator.resume(codec, token,
+                            {"SCRAM-audit-log": audit}, PasswordDatabase())
+        client.finish(server.response(response)[1])
+        self.assertEqual(len(audit.records), 1)
+        self.assertEqual(audit.records[0][:3],
+                                    ("success", "SCRAM-SHA-256", "user"))
+        self.assertGreaterEqual(audit.records[0][3], 0.1)
+        self.assertLess(audit.records[0][3], 10)
+
+if __name__ == "__main__":
+    unittest.main()
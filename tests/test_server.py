@@ -0,0 +1,83 @@
+"""Tests of the server-side SCRAM authenticator."""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import unittest
+
+from pyxmpp2_scram import kdf
+from pyxmpp2_scram.exceptions import NotAuthorizedException
+from pyxmpp2_scram.scram import SCRAMOperations, SCRAMServerAuthenticator, \
+        get_server_config
+
+from .helpers import login
+
+SALT = b"0123456789abcdef"
+
+class PasswordDatabase(object):
+    """Single-user database with the password in one format."""
+    # pylint: disable=R0903
+    def __init__(self, pformat):
+        self.pformat = pformat
+        if pformat == "plain":
+            self.password = "pencil"
+        else:
+            operations = SCRAMOperations("SHA-1")
+            salted_password = operations.Hi(b"pencil", SALT, 16)
+            self.password = (SALT, 16,
+                        operations.H(operations.HMAC(salted_password,
+                                                            b"Client Key")),
+                        operations.HMAC(salted_password, b"Server Key"))
+
+    def get_password(self, username, formats, properties):
+        """Return the password of ``user``."""
+        # pylint: disable=W0613
+        if username == "user" and self.pformat in formats:
+            return self.password, self.pformat
+        return None, None
+
+class TestSaltFragments(unittest.TestCase):
+    """Checks what is put in the shared salt fragment cache."""
+    def setUp(self):
+        self.fragments = get_server_config("SHA-1", False).salt_fragments
+        self.fragments.clear()
+
+    def test_stored_keys(self):
+        """The fragment of stored credentials is cached once."""
+        database = PasswordDatabase("SCRAM-SHA-1-Keys")
+        for _ in range(3):
+            login(SCRAMServerAuthenticator("SHA-1", False, database))
+        self.assertEqual(list(self.fragments), [(SALT, 16)])
+
+    def test_random_salts(self):
+        """Random salts of plain passwords and unknown users are not
+        cached."""
+        database = PasswordDatabase("plain")
+        for _ in range(3):
+            login(SCRAMServerAuthenticator("SHA-1", False, database))
+            with self.assertRaises(NotAuthorizedException):
+                login(SCRAMServerAuthenticator("SHA-1", False, database),
+                                                                    "nobody")
+        self.assertEqual(len(self.fragments), 0)
+
+class TestServerConfig(unittest.TestCase):
+    """Checks the shared mechanism configurations."""
+    def test_shared(self):
+        """Registered backends share one configuration per mechanism."""
+        config = get_server_config("SHA-1", False, "python")
+        self.assertIs(get_server_config("SHA-1", False, kdf.PYTHON_BACKEND),
+                                                                    config)
+        self.assertIsNot(get_server_config("SHA-1", True, "python"), config)
+        self.assertEqual(get_server_config("SHA-1", True, "python").name,
+                                                        "SCRAM-SHA-1-PLUS")
+
+    def test_custom_backend(self):
+        """Configurations with other backend instances are not cached."""
+        backend = kdf.PythonKDFBackend()
+        config = get_server_config("SHA-1", False, backend)
+        self.assertIs(config.kdf_backend, backend)
+        self.assertIsNot(get_server_config("SHA-1", False, backend), config)
+        self.assertIs(get_server_config("SHA-1", False, "python").kdf_backend,
+                                                        kdf.PYTHON_BACKEND)
+
+if __name__ == "__main__":
+    unittest.main()
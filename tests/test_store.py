@@ -0,0 +1,106 @@
+"""Tests of the precomputed credential store."""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import unittest
+
+from pyxmpp2_scram import kdf
+from pyxmpp2_scram.exceptions import NotAuthorizedException
+from pyxmpp2_scram.scram import SCRAMServerAuthenticator
+from pyxmpp2_scram.store import SCRAMCredentialStore
+
+from .helpers import login
+
+class CountingBackend(kdf.KDFBackend):
+    """The Python backend, counting the Hi() computations."""
+    name = "counting"
+    def __init__(self):
+        kdf.KDFBackend.__init__(self)
+        self.count = 0
+
+    def supports(self, digest_name):
+        return True
+
+    def _derive(self, digest_name, password, salt, iterations):
+        self.count += 1
+        return kdf.PYTHON_BACKEND.derive(digest_name, password, salt,
+                                                                iterations)
+
+class LegacyDatabase(object):
+    """Plain-text password database."""
+    # pylint: disable=R0903
+    passwords = {"alice": "pencil", "bob": "secret"}
+    def get_password(self, username, formats, properties):
+        """Return the password of a user."""
+        # pylint: disable=W0613
+        if username in self.passwords and "plain" in formats:
+            return self.passwords[username], "plain"
+        return None, None
+
+class TestStore(unittest.TestCase):
+    """Checks the lookups and the lazy migration of credentials."""
+    def setUp(self):
+        self.backend = CountingBackend()
+        self.store = SCRAMCredentialStore(("SHA-1", "SHA-256"), 16,
+                            legacy_database = LegacyDatabase(),
+                            kdf_backend = self.backend)
+
+    def server(self):
+        """Create a SCRAM-SHA-1 authenticator using the store."""
+        return SCRAMServerAuthenticator("SHA-1", False, self.store)
+
+    def test_lookup_does_not_upgrade(self):
+        """Legacy users are authenticated without being upgraded."""
+        result = self.store.get_password("alice",
+                                    ("SCRAM-SHA-1-Keys", "plain"), {})
+        self.assertEqual(result, ("pencil", "plain"))
+        self.assertEqual(self.backend.count, 0)
+        self.assertEqual(login(self.server(), "alice", "pencil")["username"],
+                                                                    "alice")
+        self.assertNotIn("alice", self.store)
+        with self.assertRaises(NotAuthorizedException):
+            login(self.server(), "bob", "wrong")
+        self.assertNotIn("bob", self.store)
+
+    def test_upgrade(self):
+        """`upgrade` computes the missing and outdated credentials."""
+        self.assertTrue(self.store.upgrade("alice"))
+        self.assertEqual(self.backend.count, 2)
+        self.assertFalse(self.store.upgrade("alice"))
+        self.assertFalse(self.store.upgrade("nobody"))
+        self.assertFalse(self.store.needs_upgrade("alice"))
+        login(self.server(), "alice", "pencil")
+        self.assertEqual(self.backend.count, 2)
+
+        self.store.set_password("bob", "secret", iteration_count = 8)
+        self.assertTrue(self.store.needs_upgrade("bob"))
+        self.assertEqual(self.store.get_keys("bob", "SHA-1")[1], 8)
+        login(self.server(), "bob", "secret")
+        self.assertEqual(self.store.get_keys("bob", "SHA-1")[1], 8)
+        self.assertTrue(self.store.upgrade("bob"))
+        self.assertEqual(self.store.get_keys("bob", "SHA-1")[1], 16)
+
+    def test_removed_row_reuse(self):
+        """A removed user's record is reused without leaking the keys."""
+        self.store.set_password("alice", "pencil")
+        self.store.remove("alice")
+        self.assertIsNone(self.store.get_keys("alice", "SHA-1"))
+        self.store.set_password("carol", "pencil")
+        self.assertIsNone(self.store.get_keys("alice", "SHA-1"))
+        self.assertEqual(self.store.get_password("alice",
+                            ("SCRAM-SHA-1-Keys", "plain"), {}),
+                            ("pencil", "plain"))
+
+    def test_invalid_keys(self):
+        """Invalid credentials are rejected without allocating a record."""
+        key = b"k" * 20
+        for salt, iteration_count, stored_key in ((b"short", 16, key),
+                                                (b"s" * 16, 0, key),
+                                                (b"s" * 16, 16, b"short")):
+            with self.assertRaises(ValueError):
+                self.store.set_keys("carol", "SHA-1", salt, iteration_count,
+                                                            stored_key, key)
+            self.assertNotIn("carol", self.store)
+
+if __name__ == "__main__":
+    unittest.main()